@@ -0,0 +1,165 @@
+#!/usr/bin/env python3
+"""
+Cancellation
+Cooperative cancellation tokens for generation jobs and abortable backend requests
+"""
+
+import socket
+import threading
+import logging
+import requests
+from requests.adapters import HTTPAdapter
+
+logger = logging.getLogger(__name__)
+
+
+class JobCancelled(Exception):
+    """Raised inside a job once its CancelToken has fired."""
+
+
+class CancelToken:
+    """A one-shot cancellation flag that long-running work checks and waits on.
+
+    ``on_cancel`` registers callbacks (interrupting a ComfyUI prompt,
+    abandoning an HTTP request) that run once when ``cancel`` is first
+    called, or immediately if the token has already fired.
+    """
+
+    def __init__(self):
+        self._event = threading.Event()
+        self._lock = threading.Lock()
+        self._callbacks = []
+
+    @property
+    def cancelled(self):
+        return self._event.is_set()
+
+    def cancel(self):
+        with self._lock:
+            if self._event.is_set():
+                return
+            self._event.set()
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception:
+                logger.exception("Cancellation callback failed")
+
+    def on_cancel(self, callback):
+        with self._lock:
+            if not self._event.is_set():
+                self._callbacks.append(callback)
+                return
+        callback()
+
+    def wait(self, timeout=None):
+        """Sleep up to ``timeout`` seconds; returns True as soon as the token fires."""
+        return self._event.wait(timeout)
+
+    def raise_if_cancelled(self):
+        if self._event.is_set():
+            raise JobCancelled()
+
+
+class _AbortableAdapter(HTTPAdapter):
+    """HTTPAdapter that remembers the connections it hands out so ``abort`` can shut them down."""
+
+    def __init__(self, *args, **kwargs):
+        self._connections = []
+        self._connections_lock = threading.Lock()
+        self._aborted = False
+        super().__init__(*args, **kwargs)
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        adapter = self
+
+        def tracking(pool_cls):
+            class TrackingPool(pool_cls):
+                def _get_conn(self, timeout=None):
+                    conn = super()._get_conn(timeout=timeout)
+                    adapter._track(conn)
+                    return conn
+            return TrackingPool
+
+        # Replaced, not mutated: the default mapping is shared by every PoolManager
+        self.poolmanager.pool_classes_by_scheme = {
+            scheme: tracking(pool_cls) for scheme, pool_cls in self.poolmanager.pool_classes_by_scheme.items()
+        }
+
+    def _track(self, conn):
+        with self._connections_lock:
+            self._connections.append(conn)
+            aborted = self._aborted
+        if aborted:
+            self._shutdown(conn)
+
+    @staticmethod
+    def _shutdown(conn):
+        # shutdown() wakes a thread blocked sending or receiving on the socket; close() alone would not
+        sock = getattr(conn, 'sock', None)
+        if sock is not None:
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+        conn.close()
+
+    def abort(self):
+        with self._connections_lock:
+            self._aborted = True
+            connections = list(self._connections)
+        for conn in connections:
+            self._shutdown(conn)
+        self.close()
+
+
+def abortable_post(url, cancel_token=None, **kwargs):
+    """``requests.post`` that returns control as soon as ``cancel_token`` fires.
+
+    The request runs on a helper thread with its own session. On
+    cancellation JobCancelled is raised at once and the session's sockets
+    are shut down, so the upload or the wait for the response stops
+    instead of running to completion; the helper thread exits when its
+    send fails, and a response that arrived anyway is closed unread.
+    Request bodies should be bytes rather than open files, since the
+    helper may still be reading them after this returns.
+    """
+    if cancel_token is None:
+        return requests.post(url, **kwargs)
+    cancel_token.raise_if_cancelled()
+
+    outcome = {}
+    finished = threading.Event()
+    session = requests.Session()
+    adapter = _AbortableAdapter()
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+
+    def send():
+        try:
+            outcome['response'] = session.post(url, **kwargs)
+        except Exception as e:
+            outcome['error'] = e
+        finally:
+            if cancel_token.cancelled and 'response' in outcome:
+                outcome['response'].close()
+            # A non-streamed response is already read, so its connection can go
+            if cancel_token.cancelled or not kwargs.get('stream'):
+                session.close()
+            finished.set()
+
+    def abort():
+        finished.set()
+        adapter.abort()
+
+    threading.Thread(target=send, name='abortable-post', daemon=True).start()
+    cancel_token.on_cancel(abort)
+    finished.wait()
+    if cancel_token.cancelled:
+        logger.info("Aborted in-flight request to %s", url)
+        raise JobCancelled()
+    if 'error' in outcome:
+        raise outcome['error']
+    return outcome['response']
@@ -5,6 +5,8 @@ Simple script to communicate with ComfyUI API using the provided workflow
 """
 
 import json
+import random
+import hashlib
 import requests
 import websocket
 import uuid
@@ -13,8 +15,13 @@ import time
 import threading
 import os
 import logging
+from concurrent.futures import ThreadPoolExecutor
 # subprocess and shutil imports removed - no longer needed for voice processing
 from dotenv import load_dotenv
+try:
+    from api.cancellation import JobCancelled
+except ImportError:
+    from cancellation import JobCancelled
 
 # Load environment variables
 load_dotenv()
@@ -98,10 +105,44 @@ class ComfyUIClient:
             logger.error("Error getting history: %s", e)
             return None
     
-    def wait_for_completion(self, prompt_id, timeout=300, progress_callback=None):
+    def get_queue(self):
+        """Get the running and pending prompts"""
+        try:
+            response = requests.get(f"{self.base_url}/queue", timeout=10)
+            response.raise_for_status()
+            return response.json()
+        except requests.exceptions.RequestException as e:
+            logger.error("Error getting queue: %s", e)
+            return None
+
+    def cancel_prompt(self, prompt_id):
+        """Stop a prompt: interrupt it if it is running, delete it if it is still queued.
+
+        /interrupt stops whatever prompt is executing, so it is only sent
+        when the queue shows this prompt running. Returns True if either
+        request was made.
+        """
+        queue = self.get_queue()
+        if queue is None:
+            return False
+        try:
+            if any(item[1] == prompt_id for item in queue.get('queue_running', [])):
+                requests.post(f"{self.base_url}/interrupt", json={"prompt_id": prompt_id}, timeout=10).raise_for_status()
+                logger.info("Interrupted running prompt %s", prompt_id)
+                return True
+            if any(item[1] == prompt_id for item in queue.get('queue_pending', [])):
+                requests.post(f"{self.base_url}/queue", json={"delete": [prompt_id]}, timeout=10).raise_for_status()
+                logger.info("Deleted queued prompt %s", prompt_id)
+                return True
+        except requests.exceptions.RequestException as e:
+            logger.error("Error cancelling prompt %s: %s", prompt_id, e)
+        return False
+
+    def wait_for_completion(self, prompt_id, timeout=300, progress_callback=None, cancel_token=None):
         """Wait for prompt completion via WebSocket with timeout.
 
         Returns True if completion event detected, False on timeout or error.
+        Raises JobCancelled if ``cancel_token`` fires while waiting.
         """
         client_id = str(uuid.uuid4())
         completion_event = threading.Event()
@@ -283,7 +324,15 @@ class ComfyUIClient:
         )
         ws_thread.start()
 
+        if cancel_token is not None:
+            cancel_token.on_cancel(completion_event.set)
         finished = completion_event.wait(timeout)
+        if cancel_token is not None and cancel_token.cancelled:
+            try:
+                ws.close()
+            except Exception as e:
+                logger.debug("Error closing WebSocket: %s", e)
+            raise JobCancelled()
         if not finished:
             logger.warning("WebSocket wait timed out after %s seconds (mobile network issue?)", timeout)
             try:
@@ -316,7 +365,7 @@ def load_workflow(file_path=None):
     else:
         raise FileNotFoundError(f"Workflow file not found: {file_path}")
 
-def modify_prompt(workflow, new_prompt, negative_prompt="", seed=None):
+def modify_prompt(workflow, new_prompt, negative_prompt="", seed=None, batch_size=None):
     """Modify the text prompt in the workflow"""
     workflow_copy = json.loads(json.dumps(workflow))  # Deep copy
 
@@ -332,114 +381,200 @@ def modify_prompt(workflow, new_prompt, negative_prompt="", seed=None):
     if seed is not None and "3" in workflow_copy:
         workflow_copy["3"]["inputs"]["seed"] = seed
 
-    return workflow_copy
-
-# Voice workflow functions removed - application now uses Index-TTS 2
-
-# generate_voice function removed - application now uses Index-TTS 2
-
-def generate_image(prompt_text, negative_prompt="", output_dir="/Volumes/2TLexarNM610Pro/AI/vPrompt/uploads/generated", seed=None, progress_callback=None, server_address=None, port=None):
-    """Generate an image using ComfyUI"""
-    import random
-
-    client = ComfyUIClient(server_address=server_address, port=port)
+    # Update batch size if provided (EmptySD3LatentImage uses node "58")
+    if batch_size is not None and "58" in workflow_copy:
+        workflow_copy["58"]["inputs"]["batch_size"] = batch_size
 
-    # Load and modify workflow
-    workflow = load_workflow()
+    return workflow_copy
 
-    # Generate random seed if not provided
+def build_workflow(prompt_text, negative_prompt="", seed=None, batch_size=None):
+    """Load the workflow and patch in the prompts, seed (a random one when None) and batch size"""
     if seed is None:
         seed = random.randint(0, 2**32 - 1)  # Random 32-bit integer
+    return modify_prompt(load_workflow(), prompt_text, negative_prompt, seed, batch_size)
 
-    modified_workflow = modify_prompt(workflow, prompt_text, negative_prompt, seed)
+def build_batch_workflows(prompt_text, negative_prompt="", seeds=None, count=1):
+    """Workflows for one batch job: one per seed in ``seeds``, else a single ``count``-image latent batch"""
+    if seeds and len(seeds) > 1:
+        return [build_workflow(prompt_text, negative_prompt, seed) for seed in seeds]
+    seed = seeds[0] if seeds else None
+    return [build_workflow(prompt_text, negative_prompt, seed, count if count > 1 else None)]
 
-    # Generate unique client ID
-    client_id = str(uuid.uuid4())
-    
-    # Queue the prompt
-    result = client.queue_prompt(modified_workflow, client_id)
-    if not result:
-        logger.error("Failed to queue prompt")
-        return None
+def workflow_hash(workflow):
+    """SHA-256 of a patched workflow (or list of them); ComfyUI output is deterministic for a given hash"""
+    raw = json.dumps(workflow, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(raw.encode('utf-8')).hexdigest()
 
-    prompt_id = result.get("prompt_id")
-    if not prompt_id:
-        logger.error("No prompt_id received")
-        return None
+def _has_images(history, prompt_id):
+    return bool(history) and prompt_id in history and any('images' in o for o in history[prompt_id].get('outputs', {}).values())
 
+def _wait_for_history(client, prompt_id, progress_callback=None, cancel_token=None):
+    """Wait for a queued prompt to finish and return its history (None on failure)"""
     # Wait for completion (WebSocket) with timeout
     # Reduced timeout since ComfyUI typically completes in 30-60 seconds
     logger.info("Starting WebSocket wait for prompt_id: %s with 60s timeout", prompt_id)
-    success = client.wait_for_completion(prompt_id, timeout=60, progress_callback=progress_callback)
+    success = client.wait_for_completion(prompt_id, timeout=60, progress_callback=progress_callback, cancel_token=cancel_token)
     logger.info("WebSocket wait result for prompt_id: %s - success: %s", prompt_id, success)
 
-    if not success:
-        # Quick check: see if images are already available
-        history = client.get_history(prompt_id)
-        if history and prompt_id in history and any('images' in o for o in history[prompt_id].get('outputs', {}).values()):
-            pass
-        else:
-            # Fallback: poll history for a longer time to detect completed outputs
-            # Increased timeout to handle remote ComfyUI servers that may take longer
-            poll_deadline = time.time() + 90  # Increased from 15 to 90 seconds for remote servers
-            logger.info("WebSocket failed, falling back to polling for prompt_id: %s", prompt_id)
-            while time.time() < poll_deadline:
-                history = client.get_history(prompt_id)
-                if history:
-                    # Check if outputs exist
-                    if prompt_id in history and any('images' in o for o in history[prompt_id].get('outputs', {}).values()):
-                        logger.info("Polling detected completion with outputs for prompt_id: %s", prompt_id)
-                        break
-                    # Also check if job completed successfully (even without outputs yet)
-                    elif prompt_id in history:
-                        job_data = history[prompt_id]
-                        status = job_data.get('status', {})
-                        if status.get('completed') or status.get('status_str') == 'success':
-                            logger.info("Polling detected job completion (status: %s) for prompt_id: %s", status.get('status_str'), prompt_id)
-                            # Wait a bit more for outputs to appear
-                            time.sleep(1)
-                            history = client.get_history(prompt_id)
-                            if history and prompt_id in history and any('images' in o for o in history[prompt_id].get('outputs', {}).values()):
-                                break
-                time.sleep(1)  # Reduced from 2 to 1 second for faster detection
-
-        if not history:
-            logger.error("Failed to get history via polling")
-            return None
-
-    else:
+    if success:
         # Get the result
         history = client.get_history(prompt_id)
         if not history:
             logger.error("Failed to get history")
+        return history
+
+    # Quick check: see if images are already available
+    history = client.get_history(prompt_id)
+    if _has_images(history, prompt_id):
+        return history
+
+    # Fallback: poll history for a longer time to detect completed outputs
+    # Increased timeout to handle remote ComfyUI servers that may take longer
+    poll_deadline = time.time() + 90  # Increased from 15 to 90 seconds for remote servers
+    logger.info("WebSocket failed, falling back to polling for prompt_id: %s", prompt_id)
+    while time.time() < poll_deadline:
+        history = client.get_history(prompt_id)
+        if history:
+            # Check if outputs exist
+            if _has_images(history, prompt_id):
+                logger.info("Polling detected completion with outputs for prompt_id: %s", prompt_id)
+                break
+            # Also check if job completed successfully (even without outputs yet)
+            elif prompt_id in history:
+                job_data = history[prompt_id]
+                status = job_data.get('status', {})
+                if status.get('completed') or status.get('status_str') == 'success':
+                    logger.info("Polling detected job completion (status: %s) for prompt_id: %s", status.get('status_str'), prompt_id)
+                    # Wait a bit more for outputs to appear
+                    time.sleep(1)
+                    history = client.get_history(prompt_id)
+                    if _has_images(history, prompt_id):
+                        break
+        # Reduced from 2 to 1 second for faster detection
+        if cancel_token is None:
+            time.sleep(1)
+        elif cancel_token.wait(1):
+            raise JobCancelled()
+
+    if not history:
+        logger.error("Failed to get history via polling")
+    return history
+
+def _download_images(client, history, prompt_id, output_dir):
+    """Download every output image of a finished prompt into ``output_dir``; returns local paths"""
+    outputs = [image_info
+               for node_output in history.get(prompt_id, {}).get('outputs', {}).values()
+               for image_info in node_output.get('images', [])]
+    if not outputs:
+        return []
+
+    def download(image_info):
+        filename = image_info['filename']
+        subfolder = image_info.get('subfolder', '')
+
+        # Download image from ComfyUI server
+        image_data = client.get_image(filename, subfolder)
+        if not image_data:
+            logger.error("Failed to download image data for %s", filename)
             return None
-    
-    # Extract output images
+        os.makedirs(output_dir, exist_ok=True)
+        if filename.startswith("ComfyUI_"):
+            new_filename = "vPrompt_" + filename[len("ComfyUI_"):]
+        else:
+            new_filename = "vPrompt_" + filename
+        local_path = os.path.join(output_dir, new_filename)
+        with open(local_path, 'wb') as f:
+            f.write(image_data)
+        return local_path
+
+    # A batch's images are fetched side by side rather than one after another
+    with ThreadPoolExecutor(max_workers=min(4, len(outputs)), thread_name_prefix='comfyui-download') as pool:
+        return [path for path in pool.map(download, outputs) if path]
+
+# Voice workflow functions removed - application now uses Index-TTS 2
+
+# generate_voice function removed - application now uses Index-TTS 2
+
+def generate_images(prompt_text, negative_prompt="", output_dir="/Volumes/2TLexarNM610Pro/AI/vPrompt/uploads/generated", seeds=None, count=1, progress_callback=None, server_address=None, port=None, cancel_token=None):
+    """Generate several images as one batch using ComfyUI
+
+    With a single seed (or none) the ``count`` images come from one prompt
+    whose latent batch size is ``count``. A list of distinct ``seeds`` is
+    queued as one prompt per seed in a single pass, so ComfyUI runs them
+    back to back, and the results are collected in order. Progress is
+    reported for the batch as a whole. When ``cancel_token`` fires every
+    prompt of the batch is removed or interrupted and JobCancelled is raised.
+    If one prompt fails, the prompts after it are removed from ComfyUI's
+    queue and None is returned.
+    """
+    client = ComfyUIClient(server_address=server_address, port=port)
+
+    # Load and modify workflows (random seed if not provided)
+    workflows = build_batch_workflows(prompt_text, negative_prompt, seeds, count)
+
+    # Generate unique client ID
+    client_id = str(uuid.uuid4())
+
+    # Queue every prompt of the batch up front
+    prompt_ids = []
+    if cancel_token is not None:
+        # Queued prompts are deleted before the running one is interrupted,
+        # otherwise ComfyUI would start the next prompt of the batch
+        cancel_token.on_cancel(lambda: [client.cancel_prompt(prompt_id) for prompt_id in reversed(prompt_ids)])
+    for workflow in workflows:
+        if cancel_token is not None:
+            cancel_token.raise_if_cancelled()
+        result = client.queue_prompt(workflow, client_id)
+        if not result:
+            logger.error("Failed to queue prompt")
+            break
+        prompt_id = result.get("prompt_id")
+        if not prompt_id:
+            logger.error("No prompt_id received")
+            break
+        prompt_ids.append(prompt_id)
+        if cancel_token is not None and cancel_token.cancelled:
+            # Cancelled while this prompt was being queued
+            client.cancel_prompt(prompt_id)
+            raise JobCancelled()
+    if len(prompt_ids) < len(workflows):
+        # Don't leave half a batch running on the GPU
+        for prompt_id in reversed(prompt_ids):
+            client.cancel_prompt(prompt_id)
+        return None
+
     images = []
-    if prompt_id in history:
-        for node_id, node_output in history[prompt_id]['outputs'].items():
-            if 'images' in node_output:
-                for image_info in node_output['images']:
-                    filename = image_info['filename']
-                    subfolder = image_info.get('subfolder', '')
-
-                    # Download image from ComfyUI server
-                    image_data = client.get_image(filename, subfolder)
-                    if image_data:
-                        os.makedirs(output_dir, exist_ok=True)
-                        if filename.startswith("ComfyUI_"):
-                            new_filename = "vPrompt_" + filename[len("ComfyUI_"):]
-                        else:
-                            new_filename = "vPrompt_" + filename
-                        local_path = os.path.join(output_dir, new_filename)
-                        with open(local_path, 'wb') as f:
-                            f.write(image_data)
-                        images.append(local_path)
-                    else:
-                        logger.error("Failed to download image data for %s", filename)
+    for index, prompt_id in enumerate(prompt_ids):
+        prompt_progress = None
+        if progress_callback is not None:
+            def prompt_progress(percent, index=index):
+                progress_callback((index * 100 + percent) // len(prompt_ids))
+
+        history = _wait_for_history(client, prompt_id, prompt_progress, cancel_token)
+        if not history:
+            # The batch has failed; stop this prompt if it is somehow still running and drop the rest
+            for remaining in reversed(prompt_ids[index:]):
+                client.cancel_prompt(remaining)
+            return None
+
+        # Extract output images
+        if cancel_token is not None:
+            cancel_token.raise_if_cancelled()
+        images.extend(_download_images(client, history, prompt_id, output_dir))
 
     return images
 
+def generate_image(prompt_text, negative_prompt="", output_dir="/Volumes/2TLexarNM610Pro/AI/vPrompt/uploads/generated", seed=None, progress_callback=None, server_address=None, port=None, cancel_token=None):
+    """Generate an image using ComfyUI
+
+    When ``cancel_token`` fires the prompt is interrupted or removed from
+    ComfyUI's queue and JobCancelled is raised.
+    """
+    return generate_images(prompt_text, negative_prompt, output_dir,
+                           seeds=[seed] if seed is not None else None,
+                           progress_callback=progress_callback, server_address=server_address,
+                           port=port, cancel_token=cancel_token)
+
 if __name__ == "__main__":
     # Example usage
     prompt = "A beautiful sunset over a mountain landscape, cinematic lighting, highly detailed, 8k resolution"
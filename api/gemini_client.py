@@ -0,0 +1,292 @@
+#!/usr/bin/env python3
+"""
+Gemini API Client
+Shared keep-alive HTTP client for the Gemini generateContent endpoints
+"""
+
+import os
+import json
+import time
+import threading
+import logging
+import requests
+from requests.adapters import HTTPAdapter
+from dotenv import load_dotenv
+
+from api.rate_limiter import GeminiRateLimiter, THROTTLE_STATUSES
+from api.model_router import ModelRouter
+
+# Load environment variables
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Point at gemini_standin.py (e.g. http://127.0.0.1:8089/v1beta) to run without real quota
+GEMINI_BASE_URL = os.getenv('GEMINI_BASE_URL', "https://generativelanguage.googleapis.com/v1beta").rstrip('/')
+GEMINI_DEFAULT_MODEL = "gemini-2.0-flash"
+
+
+class GeminiClient:
+    """Thin wrapper around a pooled requests.Session for Gemini calls.
+
+    All Gemini calls made by the app go through one instance so TCP/TLS
+    connections to the API host are kept alive and reused between requests,
+    and so they share one rate limiter for the API key.
+    """
+
+    def __init__(self, api_key=None, model=None, pool_size=None, connect_timeout=None, read_timeout=None):
+        # Use environment variables if not provided
+        if pool_size is None:
+            pool_size = int(os.getenv('GEMINI_POOL_SIZE', '10'))
+        if connect_timeout is None:
+            connect_timeout = float(os.getenv('GEMINI_CONNECT_TIMEOUT', '5'))
+        if read_timeout is None:
+            read_timeout = float(os.getenv('GEMINI_READ_TIMEOUT', '60'))
+
+        self._api_key = api_key
+        self.model = model or os.getenv('GEMINI_MODEL', GEMINI_DEFAULT_MODEL)
+        self.pool_size = pool_size
+        self.timeout = (connect_timeout, read_timeout)
+
+        self._adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, pool_block=False)
+        self.session = requests.Session()
+        self.session.mount('https://', self._adapter)
+        self.session.mount('http://', self._adapter)
+        self.session.headers.update({"Content-Type": "application/json"})
+
+        self.limiter = GeminiRateLimiter()
+        self.router = ModelRouter(self.model)
+
+        self._stats_lock = threading.Lock()
+        self._calls = 0
+        self._uploads = 0
+        self._errors = 0
+
+    @property
+    def api_key(self):
+        # Read lazily so a key loaded after import (e.g. from .env) is honoured
+        return self._api_key or os.getenv('GEMINI_API_KEY', 'YOUR_API_KEY')
+
+    def model_url(self, model=None, method='generateContent'):
+        """Build the endpoint URL for a model method."""
+        return f"{GEMINI_BASE_URL}/models/{model or self.model}:{method}"
+
+    def upload_url(self):
+        """Build the Files API media upload URL (the base URL with an /upload prefix)."""
+        root, version = GEMINI_BASE_URL.rstrip('/').rsplit('/', 1)
+        return f"{root}/upload/{version}/files"
+
+    def upload_file(self, data, mime_type, display_name=None, timeout=None):
+        """Upload bytes to the Gemini Files API and return the ``file`` resource dict.
+
+        Uses the two-step resumable protocol: a start request that returns
+        an upload URL, then one request that sends the bytes and finalizes.
+        Both go through the rate limiter like generateContent calls. Files
+        are kept by Gemini for 48 hours.
+        """
+        headers = {
+            "X-goog-api-key": self.api_key,
+            "X-Goog-Upload-Protocol": "resumable",
+            "X-Goog-Upload-Command": "start",
+            "X-Goog-Upload-Header-Content-Length": str(len(data)),
+            "X-Goog-Upload-Header-Content-Type": mime_type,
+        }
+        with self._stats_lock:
+            self._uploads += 1
+        try:
+            start = self.limiter.call(lambda: self.session.post(
+                self.upload_url(),
+                json={"file": {"display_name": display_name or "vprompt-image"}},
+                headers=headers,
+                timeout=timeout or self.timeout
+            ))
+            start.raise_for_status()
+            upload_url = start.headers.get('X-Goog-Upload-URL')
+            if not upload_url:
+                raise requests.exceptions.RequestException("Files API start response has no upload URL")
+            response = self.limiter.call(lambda: self.session.post(
+                upload_url,
+                data=data,
+                headers={
+                    "Content-Type": mime_type,
+                    "X-Goog-Upload-Offset": "0",
+                    "X-Goog-Upload-Command": "upload, finalize",
+                },
+                timeout=timeout or self.timeout
+            ))
+            response.raise_for_status()
+            return response.json()['file']
+        except (requests.exceptions.RequestException, ValueError, KeyError):
+            with self._stats_lock:
+                self._errors += 1
+            raise
+
+    def generate_content(self, payload, model=None, timeout=None, api_key=None):
+        """POST a generateContent payload and return the raw requests.Response.
+
+        Without an explicit ``model`` the call goes through the model router,
+        which may hedge a slow primary request with a faster model.
+        """
+        headers = {"X-goog-api-key": api_key or self.api_key}
+        if model is None and self.router.enabled:
+            return self.router.call(
+                lambda routed_model: self._post(payload, routed_model, timeout, headers),
+                can_hedge=self.limiter.has_headroom
+            )
+        return self._post(payload, model or self.model, timeout, headers)
+
+    def _post(self, payload, model, timeout, headers):
+        with self._stats_lock:
+            self._calls += 1
+
+        def send():
+            started = time.monotonic()
+            response = self.session.post(
+                self.model_url(model),
+                json=payload,
+                headers=headers,
+                timeout=timeout or self.timeout
+            )
+            if response.status_code == 200:
+                self.router.record(model, time.monotonic() - started)
+            return response
+
+        try:
+            return self.limiter.call(send)
+        except requests.exceptions.RequestException:
+            with self._stats_lock:
+                self._errors += 1
+            raise
+
+    def stream_generate_content(self, payload, model=None, timeout=None, api_key=None):
+        """POST to streamGenerateContent (SSE) and yield text chunks as they arrive."""
+        headers = {"X-goog-api-key": api_key or self.api_key}
+        with self._stats_lock:
+            self._calls += 1
+
+        def send():
+            return self.session.post(
+                self.model_url(model, 'streamGenerateContent'),
+                params={'alt': 'sse'},
+                json=payload,
+                headers=headers,
+                timeout=timeout or self.timeout,
+                stream=True
+            )
+
+        try:
+            # Keep the concurrency slot until the stream has been read
+            response = self.limiter.call(send, hold=True)
+        except requests.exceptions.RequestException:
+            with self._stats_lock:
+                self._errors += 1
+            raise
+        held = response.status_code not in THROTTLE_STATUSES
+
+        try:
+            response.raise_for_status()
+            with response:
+                response.encoding = 'utf-8'
+                for line in response.iter_lines(decode_unicode=True):
+                    if not line or not line.startswith('data:'):
+                        continue
+                    try:
+                        chunk = json.loads(line[5:].strip())
+                    except ValueError:
+                        continue
+                    for candidate in chunk.get('candidates', [])[:1]:
+                        for part in candidate.get('content', {}).get('parts', []):
+                            if part.get('text'):
+                                yield part['text']
+        except requests.exceptions.RequestException:
+            with self._stats_lock:
+                self._errors += 1
+            raise
+        finally:
+            # Also runs when the consumer stops reading early
+            if held:
+                self.limiter.release()
+
+    def stats(self):
+        """Return pool configuration and connection reuse counters."""
+        connections = 0
+        pooled_requests = 0
+        pools = self._adapter.poolmanager.pools
+        for key in list(pools.keys()):
+            pool = pools.get(key)
+            connections += getattr(pool, 'num_connections', 0)
+            pooled_requests += getattr(pool, 'num_requests', 0)
+        with self._stats_lock:
+            calls, uploads, errors = self._calls, self._uploads, self._errors
+        return {
+            'model': self.model,
+            'pool_size': self.pool_size,
+            'connect_timeout': self.timeout[0],
+            'read_timeout': self.timeout[1],
+            'calls': calls,
+            'uploads': uploads,
+            'errors': errors,
+            'connections_opened': connections,
+            'connections_reused': max(0, pooled_requests - connections),
+            'rate_limiter': self.limiter.stats(),
+            'router': self.router.stats(),
+        }
+
+    def close(self):
+        self.session.close()
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_gemini_client():
+    """Return the process-wide shared GeminiClient."""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = GeminiClient()
+    return _client
+
+
+
+def json_generation_config(fields):
+    """Build a generationConfig asking Gemini for a flat JSON object of string fields."""
+    return {
+        "responseMimeType": "application/json",
+        "responseSchema": {
+            "type": "OBJECT",
+            "properties": {field: {"type": "STRING"} for field in fields},
+            "required": list(fields),
+            "propertyOrdering": list(fields),
+        },
+    }
+
+
+def parse_json_response(resp_json):
+    """Return the JSON object from a structured-output response, or None.
+
+    Responses requested with json_generation_config() are plain JSON text, so
+    this is a single json.loads with no scanning for embedded objects.
+    """
+    try:
+        text = resp_json['candidates'][0]['content']['parts'][0]['text']
+        parsed = json.loads(text)
+    except (KeyError, IndexError, TypeError, ValueError):
+        return None
+    if not isinstance(parsed, dict):
+        return None
+    # Older prompts sometimes wrapped the fields in a VIDEO/IMAGE object
+    for wrapper in ('VIDEO', 'IMAGE'):
+        if isinstance(parsed.get(wrapper), dict):
+            return parsed[wrapper]
+    return parsed
+
+
+def response_text(resp_json):
+    """Return the text of the first candidate in a generateContent response, or ''."""
+    try:
+        return resp_json['candidates'][0]['content']['parts'][0]['text']
+    except (KeyError, IndexError, TypeError):
+        return ''
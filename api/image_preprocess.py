@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+"""
+Image Preprocessing
+Downscale and re-encode uploads before they are sent to Gemini for recognition
+"""
+
+import io
+import os
+import threading
+import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from dotenv import load_dotenv
+
+# Load environment variables
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+PREPROCESS_ENABLED = os.getenv('IMAGE_PREPROCESS', 'true').lower() == 'true'
+MAX_EDGE = int(os.getenv('IMAGE_MAX_EDGE', '1536'))
+OUTPUT_FORMAT = os.getenv('IMAGE_OUTPUT_FORMAT', 'JPEG').upper()
+QUALITY = int(os.getenv('IMAGE_QUALITY', '85'))
+WORKERS = int(os.getenv('IMAGE_PREPROCESS_WORKERS', '2'))
+TIMEOUT = float(os.getenv('IMAGE_PREPROCESS_TIMEOUT', '30'))
+
+_OUTPUT_MIME_TYPES = {
+    'JPEG': 'image/jpeg',
+    'WEBP': 'image/webp',
+}
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def _downscale(data, max_edge, output_format, quality):
+    """Decode, orient, shrink and re-encode an image. Runs in a worker process.
+
+    Returns the encoded bytes, or None when the original is already small
+    enough that re-encoding would not help.
+    """
+    from PIL import Image, ImageOps
+    try:
+        import pillow_heif
+        pillow_heif.register_heif_opener()
+    except ImportError:
+        pass
+
+    with Image.open(io.BytesIO(data)) as img:
+        orientation = img.getexif().get(0x0112, 1)
+        resized = max(img.size) > max_edge
+        if not resized and orientation == 1 and img.format in ('JPEG', 'WEBP', 'PNG'):
+            return None
+
+        img = ImageOps.exif_transpose(img)
+        if resized:
+            img.thumbnail((max_edge, max_edge), Image.Resampling.LANCZOS)
+
+        # JPEG has no alpha channel; WebP keeps it
+        if output_format == 'JPEG' and img.mode != 'RGB':
+            img = img.convert('RGB')
+        elif img.mode not in ('RGB', 'RGBA'):
+            img = img.convert('RGBA' if 'A' in img.mode else 'RGB')
+
+        out = io.BytesIO()
+        img.save(out, output_format, quality=quality)
+        encoded = out.getvalue()
+
+    if not resized and len(encoded) >= len(data) and orientation == 1:
+        return None
+    return encoded
+
+
+def _get_pool():
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                # spawn avoids forking a process that already runs request threads
+                _pool = ProcessPoolExecutor(max_workers=WORKERS, mp_context=multiprocessing.get_context('spawn'))
+    return _pool
+
+
+def _reset_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
+
+
+def preprocess_image(data):
+    """Shrink an uploaded image for recognition.
+
+    Returns ``(image_bytes, mime_type)`` for the re-encoded image, or None if
+    preprocessing is disabled, unavailable or not worthwhile; callers then
+    send the original upload unchanged.
+    """
+    if not PREPROCESS_ENABLED:
+        return None
+    output_format = OUTPUT_FORMAT if OUTPUT_FORMAT in _OUTPUT_MIME_TYPES else 'JPEG'
+    try:
+        if WORKERS > 0:
+            future = _get_pool().submit(_downscale, data, MAX_EDGE, output_format, QUALITY)
+            encoded = future.result(timeout=TIMEOUT)
+        else:
+            encoded = _downscale(data, MAX_EDGE, output_format, QUALITY)
+    except ImportError:
+        logger.warning("Pillow not installed, sending original image to Gemini")
+        return None
+    except BrokenProcessPool as e:
+        logger.warning("Image preprocess pool broke, recreating: %s", e)
+        _reset_pool()
+        return None
+    except Exception as e:
+        logger.warning("Image preprocessing failed, sending original image: %s", e)
+        return None
+
+    if encoded is None:
+        return None
+    logger.info("Preprocessed image for recognition: %d -> %d bytes", len(data), len(encoded))
+    return encoded, _OUTPUT_MIME_TYPES[output_format]
@@ -0,0 +1,191 @@
+#!/usr/bin/env python3
+"""
+Gemini Image References
+Upload each unique image once to the Gemini Files API and reuse its file URI
+"""
+
+import os
+import re
+import time
+import hashlib
+import threading
+import logging
+from datetime import datetime
+from dotenv import load_dotenv
+
+from api.gemini_client import get_gemini_client
+from api.result_cache import ResultCache, make_cache_key
+from api.single_flight import SingleFlight
+from api import image_preprocess
+
+# Load environment variables
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Gemini deletes uploaded files 48 hours after upload
+FILE_LIFETIME = 48 * 3600
+
+# Statuses Gemini returns for an expired or deleted file reference
+FILE_REFERENCE_STATUSES = (403, 404)
+# A 400 only counts when its message is about the referenced file
+_FILE_WORD = re.compile(r'\bfiles?\b', re.IGNORECASE)
+_FILE_REASON = re.compile(r'not exist|not found|expired|invalid|permission|not in an? active state', re.IGNORECASE)
+
+
+def parse_expiration(value):
+    """Return an RFC 3339 ``expirationTime`` as a Unix timestamp, or None."""
+    if not value:
+        return None
+    # fromisoformat only takes up to microseconds; the API may send nanoseconds
+    value = re.sub(r'(\.\d{6})\d+', r'\1', value.replace('Z', '+00:00'))
+    try:
+        return datetime.fromisoformat(value).timestamp()
+    except ValueError:
+        return None
+
+
+class ImageReferenceManager:
+    """Map image content hashes to Gemini Files API URIs.
+
+    The first recognition of an image uploads the preprocessed bytes once;
+    later calls for the same upload (regenerate with new options, fused
+    rewrites, other languages) send a small ``file_data`` reference instead
+    of the base64 payload and skip preprocessing. Entries are dropped
+    ``expiry_margin`` seconds before Gemini's expiration time, and images
+    under ``min_bytes`` are left inline since a reference would not save
+    anything.
+    """
+
+    def __init__(self, enabled=None, min_bytes=None, expiry_margin=None, disk_dir=None):
+        # Use environment variables if not provided
+        if enabled is None:
+            enabled = os.getenv('GEMINI_FILES_API', 'true').lower() == 'true'
+        if min_bytes is None:
+            min_bytes = int(os.getenv('GEMINI_FILES_MIN_BYTES', '65536'))
+        if expiry_margin is None:
+            expiry_margin = int(os.getenv('GEMINI_FILES_EXPIRY_MARGIN', '3600'))
+
+        self.enabled = enabled
+        self.min_bytes = min_bytes
+        self.expiry_margin = expiry_margin
+        self._refs = ResultCache(
+            'image_references',
+            max_entries=int(os.getenv('GEMINI_FILES_MAX_ENTRIES', '1024')),
+            ttl=FILE_LIFETIME - expiry_margin,
+            disk_dir=disk_dir
+        )
+        self._uploads = SingleFlight()
+        self._lock = threading.Lock()
+        self._counters = {
+            'hits': 0,
+            'uploads': 0,
+            'upload_failures': 0,
+            'skipped_small': 0,
+            'expired': 0,
+            'forgotten': 0,
+        }
+
+    def _count(self, key):
+        with self._lock:
+            self._counters[key] += 1
+
+    @staticmethod
+    def key(image_bytes):
+        """Cache key for an original upload under the current preprocessing settings."""
+        return make_cache_key(
+            hashlib.sha256(image_bytes).hexdigest(),
+            image_preprocess.PREPROCESS_ENABLED,
+            image_preprocess.MAX_EDGE,
+            image_preprocess.OUTPUT_FORMAT,
+            image_preprocess.QUALITY
+        )
+
+    @staticmethod
+    def _part(ref):
+        return {"file_data": {"mime_type": ref['mime_type'], "file_uri": ref['uri']}}
+
+    def lookup(self, key):
+        """Return a ``file_data`` part for an unexpired upload, or None."""
+        ref = self._refs.get(key)
+        if ref is None:
+            return None
+        if ref['expires_at'] - self.expiry_margin <= time.time():
+            self._refs.delete(key)
+            self._count('expired')
+            return None
+        self._count('hits')
+        return self._part(ref)
+
+    def upload(self, key, data, mime_type):
+        """Upload ``data`` and return its ``file_data`` part, or None to send it inline."""
+        if len(data) < self.min_bytes:
+            self._count('skipped_small')
+            return None
+
+        def do_upload():
+            ref = self._refs.get(key)
+            if ref is not None:
+                return ref
+            file = get_gemini_client().upload_file(data, mime_type, display_name=key[:16])
+            if file.get('state', 'ACTIVE') != 'ACTIVE':
+                # Images are normally usable at once; don't cache one still processing
+                raise ValueError(f"uploaded file {file.get('name')} is {file.get('state')}")
+            expires_at = parse_expiration(file.get('expirationTime')) or time.time() + FILE_LIFETIME
+            ref = {
+                'uri': file['uri'],
+                'name': file.get('name'),
+                'mime_type': file.get('mimeType') or mime_type,
+                'expires_at': expires_at,
+            }
+            self._refs.set(key, ref)
+            self._count('uploads')
+            logger.info("Uploaded image to Gemini Files API as %s (%d bytes)", ref['name'], len(data))
+            return ref
+
+        try:
+            # Concurrent requests for the same new image share one upload
+            return self._part(self._uploads.do(key, do_upload))
+        except Exception as e:
+            self._count('upload_failures')
+            logger.warning("Gemini Files API upload failed, sending image inline: %s", e)
+            return None
+
+    def forget(self, key):
+        """Drop a reference Gemini rejected so the next call uploads again."""
+        self._refs.delete(key)
+        self._count('forgotten')
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counters)
+        stats['enabled'] = self.enabled
+        stats['min_bytes'] = self.min_bytes
+        stats['references'] = self._refs.stats()
+        return stats
+
+
+def uses_file_reference(payload):
+    """True when a generateContent payload refers to an uploaded file."""
+    return any('file_data' in part for content in payload.get('contents', []) for part in content.get('parts', []))
+
+
+def file_reference_rejected(response):
+    """True when a failed generateContent response (requests or httpx) rejected a file reference.
+
+    403 and 404 always mean the reference is gone. A 400 only does when the
+    error message says the file is invalid or expired, so an unrelated bad
+    request is not retried with a fresh upload and paid for twice.
+    """
+    status_code = getattr(response, 'status_code', None)
+    if status_code in FILE_REFERENCE_STATUSES:
+        return True
+    if status_code != 400:
+        return False
+    try:
+        message = response.text
+    except Exception:
+        # A streamed body that was never read
+        return False
+    message = message or ''
+    return bool(_FILE_WORD.search(message) and _FILE_REASON.search(message))
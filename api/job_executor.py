@@ -0,0 +1,304 @@
+#!/usr/bin/env python3
+"""
+Job Executor
+Bounded worker pools with per-client weighted fair queuing for image and voice generation jobs
+"""
+
+import os
+import math
+import time
+import itertools
+import threading
+import logging
+from collections import deque
+from dotenv import load_dotenv
+
+# Load environment variables
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+PRIORITY_CLASSES = ('interactive', 'batch')
+
+
+class QueueFull(Exception):
+    """The pool's pending queue is full; ``retry_after`` is a wait estimate in seconds."""
+
+    def __init__(self, pool, retry_after, client=None):
+        if client is None:
+            message = f"{pool} generation queue is full, retry in {retry_after}s"
+        else:
+            message = f"Too many {pool} jobs queued for this client, retry in {retry_after}s"
+        super().__init__(message)
+        self.pool = pool
+        self.retry_after = retry_after
+        self.client = client
+
+
+class _PendingJob:
+    __slots__ = ('job_id', 'fn', 'args', 'client', 'priority', 'tag')
+
+    def __init__(self, job_id, fn, args, client, priority, tag):
+        self.job_id = job_id
+        self.fn = fn
+        self.args = args
+        self.client = client
+        self.priority = priority
+        self.tag = tag
+
+
+class JobPool:
+    """A fixed number of worker threads shared fairly between clients.
+
+    Every (client, priority class) pair is a flow with its own FIFO. Jobs
+    get self-clocked fair queuing finish tags: a flow's next tag is
+    ``max(virtual_time, flow's last tag) + 1 / weight``, and a free worker
+    takes the smallest-tag head among clients below
+    ``max_running_per_client``. A client that queues dozens of jobs
+    therefore only pushes back its own jobs, and an interactive flow gets
+    ``weights['interactive'] / weights['batch']`` times the share of a
+    batch one.
+
+    ``submit`` never blocks: it raises QueueFull (with a Retry-After estimate
+    from the running average job duration) once ``max_pending`` jobs are
+    waiting in total or ``max_pending_per_client`` for that client. Workers
+    are started on first use and live for the process.
+    """
+
+    def __init__(self, name, workers, max_pending, expected_duration,
+                 max_running_per_client=None, max_pending_per_client=None, weights=None):
+        self.name = name
+        self.workers = max(1, workers)
+        self.max_pending = max_pending
+        self.max_running_per_client = max_running_per_client or self.workers
+        self.max_pending_per_client = max_pending_per_client or max_pending
+        self.weights = weights or {'interactive': 4.0, 'batch': 1.0}
+        self._avg_duration = float(expected_duration)
+
+        self._flows = {}  # (client, priority) -> deque of _PendingJob, tags ascending
+        self._last_tag = {}  # (client, priority) -> finish tag of its newest job
+        self._pending_by_client = {}
+        self._running_by_client = {}
+        self._virtual_time = 0.0
+        self._seq = itertools.count()
+        self._pending_count = 0
+
+        self._lock = threading.Lock()
+        self._has_work = threading.Condition(self._lock)
+        self._threads = []
+        self._running = 0
+        self._counters = {
+            'submitted': 0,
+            'rejected': 0,
+            'rejected_client': 0,
+            'cancelled': 0,
+            'completed': 0,
+            'failed': 0,
+        }
+
+    def _ensure_workers(self):
+        # Caller must hold self._lock
+        while len(self._threads) < self.workers:
+            thread = threading.Thread(target=self._work, name=f'{self.name}-job-{len(self._threads)}', daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def retry_after(self):
+        """Seconds until a queue slot is likely to free up."""
+        with self._lock:
+            return self._retry_after()
+
+    def _retry_after(self, waiting=None, workers=None):
+        # Caller must hold self._lock; the head of the queue starts when one running job ends
+        if waiting is None:
+            waiting = self._pending_count - self.max_pending + 1
+        waves = max(1, waiting) / (workers or self.workers)
+        return max(1, min(300, math.ceil(self._avg_duration * waves)))
+
+    def submit(self, job_id, fn, *args, client=None, priority='interactive'):
+        """Queue ``fn(job_id, *args)`` for ``client``; returns its estimated 1-based position or raises QueueFull."""
+        if priority not in self.weights:
+            priority = 'interactive'
+        with self._lock:
+            if self._pending_count >= self.max_pending:
+                self._counters['rejected'] += 1
+                raise QueueFull(self.name, self._retry_after())
+            client_pending = self._pending_by_client.get(client, 0)
+            if client_pending >= self.max_pending_per_client:
+                self._counters['rejected_client'] += 1
+                # The client's backlog drains at most max_running_per_client jobs at a time
+                retry_after = self._retry_after(client_pending - self.max_pending_per_client + 1,
+                                                min(self.workers, self.max_running_per_client))
+                raise QueueFull(self.name, retry_after, client=client)
+
+            flow = (client, priority)
+            tag = max(self._virtual_time, self._last_tag.get(flow, 0.0)) + 1.0 / self.weights[priority]
+            self._last_tag[flow] = tag
+            job = _PendingJob(job_id, fn, args, client, priority, (tag, next(self._seq)))
+            self._flows.setdefault(flow, deque()).append(job)
+            self._pending_by_client[client] = client_pending + 1
+            self._pending_count += 1
+            self._counters['submitted'] += 1
+            self._ensure_workers()
+            self._has_work.notify()
+            return self._position(job)
+
+    def _position(self, job):
+        # Caller must hold self._lock; jobs ahead by finish tag, ignoring concurrency caps
+        return 1 + sum(1 for flow in self._flows.values() for other in flow if other.tag < job.tag)
+
+    def position(self, job_id):
+        """Estimated 1-based position of a job still waiting in the queue, or None."""
+        with self._lock:
+            for flow in self._flows.values():
+                for job in flow:
+                    if job.job_id == job_id:
+                        return self._position(job)
+        return None
+
+    def cancel(self, job_id):
+        """Drop a job that is still waiting; returns False once a worker has taken it."""
+        with self._lock:
+            for key, flow in self._flows.items():
+                for job in flow:
+                    if job.job_id == job_id:
+                        flow.remove(job)
+                        if not flow:
+                            del self._flows[key]
+                        self._forget_pending(job)
+                        self._counters['cancelled'] += 1
+                        return True
+        return False
+
+    def _forget_pending(self, job):
+        # Caller must hold self._lock
+        self._pending_count -= 1
+        remaining = self._pending_by_client[job.client] - 1
+        if remaining:
+            self._pending_by_client[job.client] = remaining
+        else:
+            del self._pending_by_client[job.client]
+
+    def _next_job(self):
+        # Caller must hold self._lock; smallest finish tag among clients below their concurrency cap
+        best = None
+        for key, flow in self._flows.items():
+            if self._running_by_client.get(key[0], 0) >= self.max_running_per_client:
+                continue
+            if best is None or flow[0].tag < self._flows[best][0].tag:
+                best = key
+        if best is None:
+            return None
+        flow = self._flows[best]
+        job = flow.popleft()
+        if not flow:
+            del self._flows[best]
+        self._forget_pending(job)
+        self._virtual_time = max(self._virtual_time, job.tag[0])
+        # An idle flow whose last tag is behind virtual time would restart from it anyway
+        stale = [key for key, tag in self._last_tag.items() if tag <= self._virtual_time and key not in self._flows]
+        for key in stale:
+            del self._last_tag[key]
+        return job
+
+    def _work(self):
+        while True:
+            with self._lock:
+                job = self._next_job()
+                while job is None:
+                    self._has_work.wait()
+                    job = self._next_job()
+                self._running += 1
+                self._running_by_client[job.client] = self._running_by_client.get(job.client, 0) + 1
+            started = time.monotonic()
+            failed = False
+            try:
+                job.fn(job.job_id, *job.args)
+            except Exception:
+                failed = True
+                logger.exception("%s job %s raised", self.name, job.job_id)
+            finally:
+                duration = time.monotonic() - started
+                with self._lock:
+                    self._running -= 1
+                    running = self._running_by_client[job.client] - 1
+                    if running:
+                        self._running_by_client[job.client] = running
+                    else:
+                        del self._running_by_client[job.client]
+                    self._counters['failed' if failed else 'completed'] += 1
+                    # Exponential moving average keeps Retry-After tracking current load
+                    self._avg_duration = 0.8 * self._avg_duration + 0.2 * duration
+                    # The client dropping below its cap may unblock one of its waiting jobs
+                    self._has_work.notify()
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counters)
+            stats['workers'] = self.workers
+            stats['running'] = self._running
+            stats['pending'] = self._pending_count
+            stats['max_pending'] = self.max_pending
+            stats['max_pending_per_client'] = self.max_pending_per_client
+            stats['max_running_per_client'] = self.max_running_per_client
+            stats['clients'] = len(set(self._pending_by_client) | set(self._running_by_client))
+            stats['pending_by_priority'] = {priority: 0 for priority in self.weights}
+            for (_, priority), flow in self._flows.items():
+                stats['pending_by_priority'][priority] += len(flow)
+            stats['weights'] = dict(self.weights)
+            stats['avg_duration'] = round(self._avg_duration, 2)
+        return stats
+
+
+def _pool_from_env(kind, workers, queue_size, expected_seconds):
+    """Build the ``kind`` pool from <KIND>_JOB_* environment variables with the given defaults."""
+    prefix = kind.upper()
+    max_pending = int(os.getenv(f'{prefix}_JOB_QUEUE_SIZE', queue_size))
+    return JobPool(
+        kind,
+        workers=int(os.getenv(f'{prefix}_JOB_WORKERS', workers)),
+        max_pending=max_pending,
+        expected_duration=float(os.getenv(f'{prefix}_JOB_EXPECTED_SECONDS', expected_seconds)),
+        max_running_per_client=int(os.getenv(f'{prefix}_JOB_MAX_RUNNING_PER_CLIENT', '1')),
+        max_pending_per_client=int(os.getenv(f'{prefix}_JOB_QUEUE_PER_CLIENT', str(max(1, max_pending // 2)))),
+        weights={
+            'interactive': float(os.getenv('JOB_WEIGHT_INTERACTIVE', '4')),
+            'batch': float(os.getenv('JOB_WEIGHT_BATCH', '1')),
+        }
+    )
+
+
+class JobExecutor:
+    """Separate fair-share pools for image (ComfyUI) and voice (IndexTTS) jobs."""
+
+    def __init__(self):
+        self.pools = {
+            'image': _pool_from_env('image', '2', '20', '30'),
+            'voice': _pool_from_env('voice', '1', '20', '20'),
+        }
+
+    def submit(self, kind, job_id, fn, *args, client=None, priority='interactive'):
+        return self.pools[kind].submit(job_id, fn, *args, client=client, priority=priority)
+
+    def position(self, kind, job_id):
+        return self.pools[kind].position(job_id)
+
+    def cancel(self, kind, job_id):
+        return self.pools[kind].cancel(job_id)
+
+    def stats(self):
+        return {kind: pool.stats() for kind, pool in self.pools.items()}
+
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_job_executor():
+    """Return the process-wide JobExecutor."""
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = JobExecutor()
+    return _executor
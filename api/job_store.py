@@ -0,0 +1,497 @@
+#!/usr/bin/env python3
+"""
+Job Store
+Generation job records (in-memory or SQLite WAL) with completed-job TTL, an entry cap and a background sweeper
+"""
+
+import os
+import json
+import time
+import socket
+import sqlite3
+import itertools
+import threading
+import logging
+from dotenv import load_dotenv
+
+# Load environment variables
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+FINISHED_STATUSES = ('done', 'error', 'cancelled')
+ACTIVE_STATUSES = ('pending', 'processing')
+# A cancelled job's worker may still be unwinding; its late writes are dropped
+UPDATABLE_STATUSES = ACTIVE_STATUSES + ('done', 'error')
+
+# Identifies the process that runs a job, so a restarted server can find jobs orphaned by a dead one
+PROCESS_OWNER = f"{socket.gethostname()}:{os.getpid()}"
+
+
+def _owner_alive(owner):
+    """True unless ``owner`` is a process on this host that no longer exists."""
+    host, _, pid = (owner or '').rpartition(':')
+    if host != socket.gethostname() or not pid.isdigit():
+        return True
+    try:
+        os.kill(int(pid), 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class _SweepingStore:
+    """Sweeper thread, TTL/capacity settings and counters shared by both backends.
+
+    Every backend offers ``create``, ``get`` (a snapshot dict or None),
+    ``update`` (merge fields, returns False for an unknown or cancelled
+    job), ``cancel`` (atomically mark a pending/processing job cancelled),
+    ``subscribe``/``unsubscribe`` (count the clients sharing an active job),
+    ``delete``, ``wait_for_change``, ``claim_orphans``, ``sweep`` and ``stats``. Every
+    record carries a ``version`` that each update bumps. A job's finish time is
+    recorded when an update moves it to a FINISHED_STATUSES status; it is
+    removed ``ttl`` seconds later. Beyond ``max_entries`` records the oldest
+    finished jobs go first; jobs still pending or running are never evicted.
+    """
+
+    backend = None
+
+    def __init__(self, ttl=None, max_entries=None, sweep_interval=None):
+        # Use environment variables if not provided
+        if ttl is None:
+            ttl = float(os.getenv('GENERATION_JOB_TTL', '3600'))
+        if max_entries is None:
+            max_entries = int(os.getenv('GENERATION_JOB_MAX_ENTRIES', '1000'))
+        if sweep_interval is None:
+            sweep_interval = float(os.getenv('GENERATION_JOB_SWEEP_INTERVAL', '60'))
+
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.sweep_interval = sweep_interval
+        # Longest a waiter goes without re-reading the record (catches writes by other processes)
+        self.poll_interval = float(os.getenv('JOB_STORE_POLL_INTERVAL', '0.5'))
+
+        # Bumped and broadcast on every local write so waiters wake at once
+        self._changes = 0
+        self._changed = threading.Condition()
+
+        self._sweeper = None
+        self._sweeper_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._counters = {
+            'created': 0,
+            'evicted_ttl': 0,
+            'evicted_capacity': 0,
+            'sweeps': 0,
+        }
+        self._last_sweep_seconds = 0.0
+
+    def _count(self, key, delta=1):
+        with self._stats_lock:
+            self._counters[key] += delta
+
+    def _notify(self):
+        with self._changed:
+            self._changes += 1
+            self._changed.notify_all()
+
+    def subscribe(self, job_id):
+        """Count one more client waiting on an active job; False once it has finished."""
+        return self._update(job_id, lambda job: {'subscribers': job.get('subscribers', 1) + 1}, ACTIVE_STATUSES)
+
+    def unsubscribe(self, job_id, **fields):
+        """Drop one client from an active job and cancel it (with ``fields``) if it was the last.
+
+        Returns how many clients are still waiting (0 once the job is
+        cancelled), or None when the job is unknown or no longer active.
+        """
+        remaining = []
+
+        def change(job):
+            count = job.get('subscribers', 1) - 1
+            remaining.append(count)
+            if count > 0:
+                return {'subscribers': count}
+            return dict(fields, subscribers=0, status='cancelled')
+
+        if not self._update(job_id, change, ACTIVE_STATUSES):
+            return None
+        return remaining[-1]
+
+    def wait_for_change(self, job_id, since=0, timeout=30.0):
+        """Block until the job's ``version`` exceeds ``since``, it finishes, or ``timeout`` passes.
+
+        Returns the current record (None once it is gone); the caller compares
+        its ``version`` with ``since`` to tell a change from a timeout.
+        """
+        deadline = time.monotonic() + timeout
+        while True:
+            with self._changed:
+                seen = self._changes
+            job = self.get(job_id)
+            if job is None or job.get('version', 0) > since or job['status'] in FINISHED_STATUSES:
+                return job
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return job
+            with self._changed:
+                self._changed.wait_for(lambda: self._changes != seen, min(remaining, self.poll_interval))
+
+    def sweep(self, now=None):
+        """Drop jobs finished more than ``ttl`` seconds ago, then enforce ``max_entries``."""
+        started = time.monotonic()
+        now = time.time() if now is None else now
+        expired = self._delete_expired(now - self.ttl)
+        over = self._delete_over_capacity()
+        with self._stats_lock:
+            self._counters['evicted_ttl'] += expired
+            self._counters['evicted_capacity'] += over
+            self._counters['sweeps'] += 1
+            self._last_sweep_seconds = time.monotonic() - started
+        if expired or over:
+            logger.info("Job store swept %d expired and %d excess finished jobs", expired, over)
+        return expired + over
+
+    def _ensure_sweeper(self):
+        if self._sweeper is None:
+            with self._sweeper_lock:
+                if self._sweeper is None:
+                    self._sweeper = threading.Thread(target=self._sweep_loop, name='job-store-sweeper', daemon=True)
+                    self._sweeper.start()
+
+    def _sweep_loop(self):
+        while True:
+            time.sleep(self.sweep_interval)
+            try:
+                self.sweep()
+            except Exception:
+                logger.exception("Job store sweep failed")
+
+    def stats(self):
+        with self._stats_lock:
+            stats = dict(self._counters)
+            stats['last_sweep_ms'] = round(self._last_sweep_seconds * 1000, 3)
+        stats.update(self._sizes())
+        stats['active'] = stats['entries'] - stats['finished']
+        stats['backend'] = self.backend
+        stats['ttl'] = self.ttl
+        stats['max_entries'] = self.max_entries
+        stats['sweep_interval'] = self.sweep_interval
+        return stats
+
+
+class JobRecord:
+    """One job's state in the memory store.
+
+    The fields every job has are slots; anything else (images, prompt,
+    queued arguments) lives in ``fields``. A stored record is never
+    mutated: an update publishes a replacement, so readers take no lock,
+    and a progress update shares ``fields`` with the record it replaces.
+    """
+
+    __slots__ = ('status', 'progress', 'error', 'version', 'finished_at', 'fields')
+
+    def __init__(self, status, progress, error, version, finished_at, fields):
+        self.status = status
+        self.progress = progress
+        self.error = error
+        self.version = version
+        self.finished_at = finished_at
+        self.fields = fields
+
+    @classmethod
+    def from_dict(cls, job):
+        fields = dict(job)
+        fields.pop('version', None)
+        status = fields.pop('status', 'pending')
+        finished_at = time.time() if status in FINISHED_STATUSES else None
+        return cls(status, fields.pop('progress', 0), fields.pop('error', None), 1, finished_at, fields)
+
+    def replace(self, changes):
+        fields = self.fields
+        extra = {key: value for key, value in changes.items() if key not in ('status', 'progress', 'error', 'version')}
+        if extra:
+            fields = dict(fields, **extra)
+        status = changes.get('status', self.status)
+        finished_at = self.finished_at
+        if finished_at is None and status in FINISHED_STATUSES:
+            finished_at = time.time()
+        return JobRecord(status, changes.get('progress', self.progress), changes.get('error', self.error),
+                         self.version + 1, finished_at, fields)
+
+    def to_dict(self):
+        job = dict(self.fields)
+        job['status'] = self.status
+        job['progress'] = self.progress
+        job['error'] = self.error
+        job['version'] = self.version
+        return job
+
+
+class MemoryJobStore(_SweepingStore):
+    """Job records in a dict; only visible to the current process.
+
+    ``get`` is lock-free: it reads whichever immutable JobRecord is
+    currently published. Writers serialize per job on one of ``stripes``
+    locks, so progress updates for different jobs do not contend, and
+    status polls never wait for a writer. ``_index_lock`` only guards the
+    finish-ordered index used for TTL and capacity eviction.
+    """
+
+    backend = 'memory'
+
+    def __init__(self, stripes=64, **kwargs):
+        super().__init__(**kwargs)
+        self._stripes = [threading.Lock() for _ in range(stripes)]
+        self._index_lock = threading.Lock()
+        self._jobs = {}  # job_id -> JobRecord, replaced on every update
+        self._finished = {}  # job_id -> finish time, in finish order
+
+    def _stripe(self, job_id):
+        return self._stripes[hash(job_id) % len(self._stripes)]
+
+    def create(self, job_id, job):
+        with self._stripe(job_id):
+            record = self._jobs[job_id] = JobRecord.from_dict(dict(job, owner=PROCESS_OWNER))
+            if record.finished_at is not None:
+                with self._index_lock:
+                    self._finished[job_id] = record.finished_at
+        over = self._delete_over_capacity()
+        self._count('created')
+        self._count('evicted_capacity', over)
+        self._notify()
+        self._ensure_sweeper()
+
+    def get(self, job_id):
+        record = self._jobs.get(job_id)
+        return record.to_dict() if record is not None else None
+
+    def update(self, job_id, **fields):
+        return self._update(job_id, fields, UPDATABLE_STATUSES)
+
+    def cancel(self, job_id, **fields):
+        return self._update(job_id, dict(fields, status='cancelled'), ACTIVE_STATUSES)
+
+    def _update(self, job_id, fields, allowed):
+        with self._stripe(job_id):
+            record = self._jobs.get(job_id)
+            if record is None or record.status not in allowed:
+                return False
+            if callable(fields):
+                fields = fields(record.to_dict())
+            updated = self._jobs[job_id] = record.replace(fields)
+            if record.finished_at is None and updated.finished_at is not None:
+                with self._index_lock:
+                    self._finished[job_id] = updated.finished_at
+        self._notify()
+        return True
+
+    def delete(self, job_id):
+        with self._stripe(job_id):
+            deleted = self._jobs.pop(job_id, None) is not None
+            with self._index_lock:
+                self._finished.pop(job_id, None)
+        self._notify()
+        return deleted
+
+    def claim_orphans(self):
+        # Records never outlive the process that created them
+        return []
+
+    def _delete_expired(self, cutoff):
+        with self._index_lock:
+            # Finish order means the expired jobs are a prefix of the index
+            expired = []
+            for job_id, finished_at in self._finished.items():
+                if finished_at > cutoff:
+                    break
+                expired.append(job_id)
+            for job_id in expired:
+                del self._finished[job_id]
+        return self._drop(expired)
+
+    def _delete_over_capacity(self):
+        excess = len(self._jobs) - self.max_entries
+        if excess <= 0:
+            return 0
+        with self._index_lock:
+            # Oldest finished jobs first; jobs still pending or running are never evicted
+            victims = list(itertools.islice(self._finished, excess))
+            for job_id in victims:
+                del self._finished[job_id]
+        return self._drop(victims)
+
+    def _drop(self, job_ids):
+        for job_id in job_ids:
+            with self._stripe(job_id):
+                self._jobs.pop(job_id, None)
+        return len(job_ids)
+
+    def _sizes(self):
+        return {'entries': len(self._jobs), 'finished': len(self._finished)}
+
+
+class SQLiteJobStore(_SweepingStore):
+    """Job records in a SQLite database in WAL mode, shared by every worker process.
+
+    Readers never block the writer and each other under WAL, so status
+    polls from any gunicorn worker see jobs run by the others, and finished
+    results survive a restart. Each thread keeps its own connection; updates
+    are read-modify-write inside ``BEGIN IMMEDIATE`` so concurrent writers
+    from different processes do not lose fields.
+    """
+
+    backend = 'sqlite'
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS jobs (
+            id TEXT PRIMARY KEY,
+            status TEXT NOT NULL,
+            owner TEXT,
+            data TEXT NOT NULL,
+            created REAL NOT NULL,
+            updated REAL NOT NULL,
+            finished_at REAL
+        );
+        CREATE INDEX IF NOT EXISTS jobs_status_finished ON jobs (status, finished_at);
+    """
+
+    def __init__(self, path=None, **kwargs):
+        super().__init__(**kwargs)
+        self.path = path or os.getenv('JOB_STORE_PATH', os.path.join(os.getenv('CACHE_FOLDER', 'cache'), 'jobs.sqlite3'))
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._local = threading.local()
+        with self._connect() as conn:
+            conn.executescript(self.SCHEMA)
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.execute('PRAGMA busy_timeout=30000')
+            self._local.conn = conn
+        return conn
+
+    def create(self, job_id, job):
+        now = time.time()
+        job = dict(job, owner=PROCESS_OWNER, version=1)
+        status = job.get('status', 'pending')
+        self._connect().execute(
+            "INSERT OR REPLACE INTO jobs (id, status, owner, data, created, updated, finished_at) VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (job_id, status, PROCESS_OWNER, json.dumps(job, ensure_ascii=False), now, now,
+             now if status in FINISHED_STATUSES else None)
+        )
+        self._count('created')
+        self._notify()
+        self._ensure_sweeper()
+
+    def get(self, job_id):
+        row = self._connect().execute("SELECT data FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def update(self, job_id, **fields):
+        return self._update(job_id, fields, UPDATABLE_STATUSES)
+
+    def cancel(self, job_id, **fields):
+        return self._update(job_id, dict(fields, status='cancelled'), ACTIVE_STATUSES)
+
+    def _update(self, job_id, fields, allowed):
+        conn = self._connect()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            row = conn.execute("SELECT data, finished_at FROM jobs WHERE id = ?", (job_id,)).fetchone()
+            job = json.loads(row[0]) if row else None
+            if job is None or job['status'] not in allowed:
+                conn.execute('ROLLBACK')
+                return False
+            job.update(fields(job) if callable(fields) else fields)
+            job['version'] = job.get('version', 0) + 1
+            now = time.time()
+            finished_at = row[1]
+            if finished_at is None and job.get('status') in FINISHED_STATUSES:
+                finished_at = now
+            conn.execute(
+                "UPDATE jobs SET status = ?, data = ?, updated = ?, finished_at = ? WHERE id = ?",
+                (job.get('status'), json.dumps(job, ensure_ascii=False), now, finished_at, job_id)
+            )
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        self._notify()
+        return True
+
+    def delete(self, job_id):
+        deleted = self._connect().execute("DELETE FROM jobs WHERE id = ?", (job_id,)).rowcount > 0
+        self._notify()
+        return deleted
+
+    def claim_orphans(self):
+        """Take over unfinished jobs whose owning process on this host has exited.
+
+        Returns the claimed records (with ``id`` set) so the caller can
+        re-queue or fail them. The owner check-and-set is a single UPDATE,
+        so when several workers start together each orphan is claimed once.
+        """
+        conn = self._connect()
+        placeholders = ','.join('?' * len(ACTIVE_STATUSES))
+        rows = conn.execute(
+            f"SELECT id, owner, data FROM jobs WHERE status IN ({placeholders}) AND owner != ?",
+            ACTIVE_STATUSES + (PROCESS_OWNER,)
+        ).fetchall()
+        claimed = []
+        for job_id, owner, data in rows:
+            if _owner_alive(owner):
+                continue
+            job = json.loads(data)
+            job['owner'] = PROCESS_OWNER
+            cursor = conn.execute(
+                "UPDATE jobs SET owner = ?, data = ? WHERE id = ? AND owner = ?",
+                (PROCESS_OWNER, json.dumps(job, ensure_ascii=False), job_id, owner)
+            )
+            if cursor.rowcount:
+                claimed.append(dict(job, id=job_id))
+        return claimed
+
+    def _delete_expired(self, cutoff):
+        return self._connect().execute(
+            "DELETE FROM jobs WHERE finished_at IS NOT NULL AND finished_at <= ?", (cutoff,)
+        ).rowcount
+
+    def _delete_over_capacity(self):
+        conn = self._connect()
+        excess = conn.execute("SELECT COUNT(*) FROM jobs").fetchone()[0] - self.max_entries
+        if excess <= 0:
+            return 0
+        return conn.execute(
+            "DELETE FROM jobs WHERE id IN (SELECT id FROM jobs WHERE finished_at IS NOT NULL ORDER BY finished_at LIMIT ?)",
+            (excess,)
+        ).rowcount
+
+    def _sizes(self):
+        entries, finished = self._connect().execute(
+            "SELECT COUNT(*), COUNT(finished_at) FROM jobs"
+        ).fetchone()
+        return {'entries': entries, 'finished': finished, 'path': self.path}
+
+
+def create_job_store(path=None, **kwargs):
+    """Build the job store selected by JOB_STORE (``sqlite`` or ``memory``).
+
+    ``path`` picks the SQLite file (JOB_STORE_PATH by default); other keyword
+    arguments (``ttl``, ``max_entries``, ``sweep_interval``) go to the store.
+    """
+    backend = os.getenv('JOB_STORE', 'sqlite').lower()
+    if backend == 'memory':
+        return MemoryJobStore(**kwargs)
+    try:
+        return SQLiteJobStore(path, **kwargs)
+    except sqlite3.Error as e:
+        logger.error("SQLite job store unavailable (%s), keeping jobs in memory", e)
+        return MemoryJobStore(**kwargs)
@@ -0,0 +1,229 @@
+#!/usr/bin/env python3
+"""
+Gemini Model Router
+Rolling per-model latency tracking and hedged backup requests to a faster model
+"""
+
+import os
+import time
+import asyncio
+import threading
+import logging
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from dotenv import load_dotenv
+
+# Load environment variables
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+
+class LatencyTracker:
+    """Rolling window of successful call latencies for one model."""
+
+    def __init__(self, window=200):
+        self._samples = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def record(self, seconds):
+        with self._lock:
+            self._samples.append(seconds)
+
+    def percentile(self, p):
+        """Return the ``p``-th percentile (0-100) of the window, or None when empty."""
+        with self._lock:
+            samples = sorted(self._samples)
+        if not samples:
+            return None
+        index = min(len(samples) - 1, int(round(p / 100.0 * (len(samples) - 1))))
+        return samples[index]
+
+    def __len__(self):
+        with self._lock:
+            return len(self._samples)
+
+
+class ModelRouter:
+    """Hedge slow calls on the primary model with a backup on the fastest hedge model.
+
+    The primary request is sent first. If it has not answered after the
+    primary's rolling p95 (or ``default_delay`` until ``min_samples`` calls
+    have been seen), one backup request goes to whichever hedge model has the
+    lowest p50. The first successful response wins and the other call is
+    cancelled (async) or abandoned and closed when it returns (sync).
+
+    Hedging is off unless GEMINI_HEDGE=true: a hedged call may be answered
+    by a different model than the one configured, and a fired hedge is a
+    second billed request. An abandoned sync request cannot be interrupted,
+    so it keeps its rate-limiter slot and pooled connection until it
+    returns or hits the request timeout; ``can_hedge`` lets the caller skip
+    the backup while slots are short.
+    """
+
+    def __init__(self, primary, hedge_models=None, enabled=None, window=None, min_samples=None,
+                 default_delay=None, min_delay=None, max_workers=None):
+        # Use environment variables if not provided
+        if hedge_models is None:
+            hedge_models = [m.strip() for m in os.getenv('GEMINI_HEDGE_MODELS', 'gemini-2.0-flash-lite').split(',') if m.strip()]
+        if enabled is None:
+            enabled = os.getenv('GEMINI_HEDGE', 'false').lower() == 'true'
+        if window is None:
+            window = int(os.getenv('GEMINI_LATENCY_WINDOW', '200'))
+        if min_samples is None:
+            min_samples = int(os.getenv('GEMINI_HEDGE_MIN_SAMPLES', '20'))
+        if default_delay is None:
+            default_delay = float(os.getenv('GEMINI_HEDGE_DELAY', '10'))
+        if min_delay is None:
+            min_delay = float(os.getenv('GEMINI_HEDGE_MIN_DELAY', '1'))
+        if max_workers is None:
+            max_workers = int(os.getenv('GEMINI_POOL_SIZE', '10')) * 2
+
+        self.primary = primary
+        self.hedge_models = [m for m in hedge_models if m != primary]
+        self.enabled = enabled and bool(self.hedge_models)
+        self.window = window
+        self.min_samples = min_samples
+        self.default_delay = default_delay
+        self.min_delay = min_delay
+        self.max_workers = max_workers
+
+        self._trackers = {}
+        self._lock = threading.Lock()
+        self._executor = None
+        self._counters = {
+            'calls': 0,
+            'hedges_fired': 0,
+            'primary_wins': 0,
+            'hedge_wins': 0,
+        }
+
+    def _tracker(self, model):
+        with self._lock:
+            tracker = self._trackers.get(model)
+            if tracker is None:
+                tracker = self._trackers[model] = LatencyTracker(self.window)
+            return tracker
+
+    def _count(self, key):
+        with self._lock:
+            self._counters[key] += 1
+
+    def record(self, model, seconds):
+        """Record the latency of a successful call to ``model``."""
+        self._tracker(model).record(seconds)
+
+    def hedge_delay(self):
+        """Seconds to wait on the primary before firing the backup request."""
+        tracker = self._tracker(self.primary)
+        if len(tracker) < self.min_samples:
+            return self.default_delay
+        return max(self.min_delay, tracker.percentile(95))
+
+    def hedge_model(self):
+        """The hedge model with the lowest rolling p50; unmeasured models go first so they get samples."""
+        def p50(model):
+            value = self._tracker(model).percentile(50)
+            return -1 if value is None else value
+        return min(self.hedge_models, key=p50)
+
+    def _get_executor(self):
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='gemini-hedge')
+        return self._executor
+
+    @staticmethod
+    def _succeeded(future):
+        return future.exception() is None and getattr(future.result(), 'status_code', None) == 200
+
+    def call(self, send, can_hedge=None):
+        """Run ``send(model)`` on the primary, hedging to a backup model if it runs slow.
+
+        ``can_hedge`` is an optional callable consulted before firing the
+        backup, e.g. to skip hedging while the API key is being throttled.
+        """
+        self._count('calls')
+        executor = self._get_executor()
+        primary = executor.submit(send, self.primary)
+        done, _ = wait([primary], timeout=self.hedge_delay())
+        if done or (can_hedge is not None and not can_hedge()):
+            return primary.result()
+
+        model = self.hedge_model()
+        logger.info("Gemini %s slower than %.2fs, hedging with %s", self.primary, self.hedge_delay(), model)
+        self._count('hedges_fired')
+        backup = executor.submit(send, model)
+        pending = {primary, backup}
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if self._succeeded(future):
+                    self._count('primary_wins' if future is primary else 'hedge_wins')
+                    self._abandon(backup if future is primary else primary)
+                    return future.result()
+        # Neither call succeeded; surface the primary's outcome as an unhedged call would
+        self._abandon(backup)
+        return primary.result()
+
+    @staticmethod
+    def _abandon(future):
+        # A running requests call cannot be interrupted; close its response once it lands
+        # (at once if it already has)
+        def close(f):
+            if f.exception() is None and hasattr(f.result(), 'close'):
+                f.result().close()
+        future.add_done_callback(close)
+
+    @staticmethod
+    async def _close_async(task):
+        if task.done() and not task.cancelled() and task.exception() is None and hasattr(task.result(), 'aclose'):
+            await task.result().aclose()
+
+    async def call_async(self, send, can_hedge=None):
+        """Event-loop version of :meth:`call`; the losing request is cancelled."""
+        self._count('calls')
+        primary = asyncio.ensure_future(send(self.primary))
+        backup = None
+        try:
+            done, _ = await asyncio.wait({primary}, timeout=self.hedge_delay())
+            if done or (can_hedge is not None and not can_hedge()):
+                return await primary
+
+            model = self.hedge_model()
+            logger.info("Gemini %s slower than %.2fs, hedging with %s", self.primary, self.hedge_delay(), model)
+            self._count('hedges_fired')
+            backup = asyncio.ensure_future(send(model))
+            pending = {primary, backup}
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if self._succeeded(task):
+                        self._count('primary_wins' if task is primary else 'hedge_wins')
+                        await self._close_async(backup if task is primary else primary)
+                        return task.result()
+            await self._close_async(backup)
+            return await primary
+        finally:
+            # Also covers the caller being cancelled, e.g. by a pipeline stage deadline
+            for task in (primary, backup):
+                if task is not None and not task.done():
+                    task.cancel()
+
+    def stats(self):
+        models = {}
+        for model in [self.primary] + self.hedge_models:
+            tracker = self._tracker(model)
+            p50, p95 = tracker.percentile(50), tracker.percentile(95)
+            models[model] = {
+                'samples': len(tracker),
+                'p50': round(p50, 3) if p50 is not None else None,
+                'p95': round(p95, 3) if p95 is not None else None,
+            }
+        with self._lock:
+            stats = dict(self._counters)
+        stats['enabled'] = self.enabled
+        stats['hedge_delay'] = round(self.hedge_delay(), 3)
+        stats['models'] = models
+        return stats
@@ -0,0 +1,237 @@
+#!/usr/bin/env python3
+"""
+Prompt Pipeline
+Asyncio event loop and async Gemini client that run prompt generation off the Flask worker threads
+"""
+
+import os
+import copy
+import time
+import uuid
+import asyncio
+import functools
+import threading
+import logging
+from dotenv import load_dotenv
+
+try:
+    import httpx
+    HTTPX_AVAILABLE = True
+except ImportError:
+    HTTPX_AVAILABLE = False
+
+from api.gemini_client import get_gemini_client
+from api.job_store import create_job_store
+
+# Load environment variables
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+MAX_CONNECTIONS = int(os.getenv('PIPELINE_MAX_CONNECTIONS', '100'))
+JOB_TTL = int(os.getenv('PIPELINE_JOB_TTL', '600'))
+JOB_STORE_PATH = os.getenv('PIPELINE_JOB_STORE_PATH', os.path.join(os.getenv('CACHE_FOLDER', 'cache'), 'prompt_jobs.sqlite3'))
+
+# Job store statuses as reported to /prompt_job pollers
+_STATUS_NAMES = {'pending': 'pending', 'processing': 'running', 'done': 'completed', 'error': 'failed'}
+
+
+class StageTimeout(Exception):
+    """A pipeline stage ran past its deadline."""
+
+
+class PromptPipeline:
+    """Runs prompt-generation coroutines on one background event loop.
+
+    Flask handlers call :meth:`submit` with a coroutine function and get a
+    job id back straight away; the coroutine's Gemini waits are plain awaits
+    on a shared ``httpx.AsyncClient``, so hundreds of generations can be in
+    flight without holding a WSGI thread each. Job records live in a job
+    store (SQLite by default, see JOB_STORE), so a job submitted on one
+    gunicorn worker can be polled from any other; they are kept for
+    ``JOB_TTL`` seconds after they finish.
+    """
+
+    def __init__(self, max_connections=MAX_CONNECTIONS, job_ttl=JOB_TTL, store=None):
+        self.max_connections = max_connections
+        self.job_ttl = job_ttl
+        self.store = store if store is not None else create_job_store(JOB_STORE_PATH, ttl=job_ttl)
+        self._loop = None
+        self._client = None
+        self._start_lock = threading.Lock()
+        self._counters = {'submitted': 0, 'completed': 0, 'failed': 0}
+        self._counters_lock = threading.Lock()
+        self._inflight = {}  # key -> asyncio.Future, only touched on the loop thread
+        self._background = set()
+
+    def _ensure_loop(self):
+        if self._loop is None:
+            with self._start_lock:
+                if self._loop is None:
+                    loop = asyncio.new_event_loop()
+                    thread = threading.Thread(target=loop.run_forever, name='prompt-pipeline', daemon=True)
+                    thread.start()
+                    self._loop = loop
+        return self._loop
+
+    def fail_orphans(self):
+        """Fail prompt jobs left running by a worker process that has exited."""
+        for job in self.store.claim_orphans():
+            self.store.update(job['id'], status='error', error='Interrupted by server restart')
+            logger.warning("Orphaned prompt job %s marked as failed", job['id'])
+
+    def _get_client(self):
+        # Created lazily on the loop thread so it binds to the pipeline loop
+        if self._client is None:
+            gemini = get_gemini_client()
+            connect_timeout, read_timeout = gemini.timeout
+            self._client = httpx.AsyncClient(
+                timeout=httpx.Timeout(read_timeout, connect=connect_timeout),
+                limits=httpx.Limits(max_connections=self.max_connections, max_keepalive_connections=gemini.pool_size),
+                headers={"Content-Type": "application/json"}
+            )
+        return self._client
+
+    # Job handles
+
+    def submit(self, coro_fn, *args):
+        """Schedule ``coro_fn(job_id, *args)`` on the pipeline loop and return its job id."""
+        job_id = str(uuid.uuid4())
+        self.store.create(job_id, {
+            'type': 'prompt',
+            'status': 'pending',
+            'stage': None,
+            'result': None,
+            'error': None
+        })
+        self._count('submitted')
+        asyncio.run_coroutine_threadsafe(self._run(job_id, coro_fn, args), self._ensure_loop())
+        return job_id
+
+    async def _run(self, job_id, coro_fn, args):
+        await self.run_blocking(functools.partial(self.store.update, job_id, status='processing'))
+        try:
+            result = await coro_fn(job_id, *args)
+        except Exception as e:
+            logger.exception("Prompt pipeline job %s failed", job_id)
+            self._count('failed')
+            await self.run_blocking(functools.partial(self.store.update, job_id, status='error', error=str(e)))
+            return
+        self._count('completed')
+        await self.run_blocking(functools.partial(self.store.update, job_id, status='done', stage=None, result=result))
+
+    def _count(self, key):
+        with self._counters_lock:
+            self._counters[key] += 1
+
+    def get(self, job_id):
+        """Return a snapshot of a job record, or None if unknown or expired."""
+        job = self.store.get(job_id)
+        if job is None or job.get('type') != 'prompt':
+            return None
+        job['status'] = _STATUS_NAMES.get(job['status'], job['status'])
+        return job
+
+    # Helpers for pipeline coroutines
+
+    async def stage(self, job_id, name, awaitable, deadline):
+        """Await one named stage, raising StageTimeout once ``deadline`` seconds pass."""
+        await self.run_blocking(functools.partial(self.store.update, job_id, stage=name))
+        try:
+            return await asyncio.wait_for(awaitable, timeout=deadline)
+        except asyncio.TimeoutError:
+            raise StageTimeout(f"{name} stage exceeded {deadline}s deadline")
+
+    def spawn(self, coro):
+        """Start a fire-and-forget coroutine from the pipeline loop."""
+        task = asyncio.get_running_loop().create_task(coro)
+        # Keep a reference so the task is not garbage collected mid-flight
+        self._background.add(task)
+        task.add_done_callback(self._background.discard)
+
+    async def run_blocking(self, fn, *args):
+        """Run a blocking function (file I/O, image preprocessing) on the loop's executor."""
+        return await asyncio.get_running_loop().run_in_executor(None, fn, *args)
+
+    async def coalesce(self, key, coro_fn):
+        """Async single-flight: concurrent callers with the same key share one call."""
+        future = self._inflight.get(key)
+        if future is not None:
+            return copy.deepcopy(await asyncio.shield(future))
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            value = await coro_fn()
+            # Followers get copies of a snapshot so the leader may mutate its value
+            future.set_result(copy.deepcopy(value))
+            return value
+        except asyncio.CancelledError:
+            # The leader hit its deadline; followers see a failure rather than being cancelled
+            future.set_exception(RuntimeError(f"Coalesced call {key} was cancelled"))
+            future.exception()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # Mark retrieved so a failure nobody waited on is not logged as unhandled
+            future.exception()
+            raise
+        finally:
+            self._inflight.pop(key, None)
+
+    async def generate_content(self, payload, model=None):
+        """POST a generateContent payload and return the decoded JSON response."""
+        gemini = get_gemini_client()
+        client = self._get_client()
+
+        async def send(routed_model):
+            started = time.monotonic()
+            # Shares the sync client's limiter and router so both paths respect one quota
+            response = await gemini.limiter.call_async(lambda: client.post(
+                gemini.model_url(routed_model),
+                json=payload,
+                headers={"X-goog-api-key": gemini.api_key}
+            ))
+            if response.status_code == 200:
+                gemini.router.record(routed_model, time.monotonic() - started)
+            return response
+
+        if model is None and gemini.router.enabled:
+            response = await gemini.router.call_async(send, can_hedge=gemini.limiter.has_headroom)
+        else:
+            response = await send(model or gemini.model)
+        response.raise_for_status()
+        return response.json()
+
+    async def get_json(self, url):
+        """GET a URL and return its decoded JSON body."""
+        response = await self._get_client().get(url)
+        response.raise_for_status()
+        return response.json()
+
+    def stats(self):
+        with self._counters_lock:
+            stats = dict(self._counters)
+        store = self.store.stats()
+        stats.update({
+            'available': HTTPX_AVAILABLE,
+            'jobs': store['entries'],
+            'running': store['active'],
+            'store': store['backend'],
+            'max_connections': self.max_connections,
+        })
+        return stats
+
+
+_pipeline = None
+_pipeline_lock = threading.Lock()
+
+
+def get_prompt_pipeline():
+    """Return the process-wide PromptPipeline."""
+    global _pipeline
+    if _pipeline is None:
+        with _pipeline_lock:
+            if _pipeline is None:
+                _pipeline = PromptPipeline()
+                _pipeline.fail_orphans()
+    return _pipeline
@@ -0,0 +1,179 @@
+#!/usr/bin/env python3
+"""
+Prompt Template Registry
+Precompiled Gemini prompt templates loaded from prompt_templates.json, with a version hash
+"""
+
+import os
+import json
+import time
+import hashlib
+import itertools
+import threading
+import logging
+from dotenv import load_dotenv
+
+# Load environment variables
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TEMPLATES_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'prompt_templates.json')
+RELOAD_INTERVAL = float(os.getenv('PROMPT_TEMPLATES_RELOAD_INTERVAL', '5'))
+
+# Placeholder filled per request; everything else is substituted at load time
+_SLOT = '\x00slot\x00'
+
+# Lowercase output_lang spellings the rewrite (and system instruction) always accepted;
+# recognition, enhancement and fused prompts only ever matched the exact codes
+_LOWERCASE_ALIASES = {'zh-cn': 'zh-CN', 'zh-tw': 'zh-TW'}
+
+
+def _split(template, slot, **static):
+    """Fill the static placeholders now and split around the per-request one."""
+    return tuple(template.format(**static, **{slot: _SLOT}).split(_SLOT))
+
+
+class PromptTemplateRegistry:
+    """Recognition, enhancement, rewrite and fused-mode prompts keyed by request options.
+
+    Every (language, prompt type, creative, ending, multiple_scenes)
+    combination is rendered once when the file is loaded, so building a
+    prompt per request is a single join around the user's text. ``version``
+    is a hash of the template data; it changes whenever the file does and
+    is folded into the Gemini result cache keys. The file is re-read when
+    its mtime changes, so templates can be edited without a restart.
+    """
+
+    def __init__(self, path=None):
+        self.path = path or os.getenv('PROMPT_TEMPLATES_PATH', DEFAULT_TEMPLATES_PATH)
+        self._lock = threading.Lock()
+        self._mtime = None
+        self._checked_at = 0.0
+        self._state = None  # (version, compiled) swapped as one unit
+        self.load()
+
+    def load(self):
+        """Read and precompile the template file; keeps the previous templates if it is invalid."""
+        mtime = None
+        try:
+            mtime = os.path.getmtime(self.path)
+            with open(self.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            compiled = self._compile(data)
+        except Exception as e:
+            if self._state is None:
+                raise
+            logger.error("Prompt templates %s not reloaded: %s", self.path, e)
+            # Don't retry until the file changes again
+            self._mtime = mtime
+            return
+        raw = json.dumps(data, ensure_ascii=False, sort_keys=True, separators=(',', ':'))
+        version = hashlib.sha256(raw.encode('utf-8')).hexdigest()[:12]
+        with self._lock:
+            self._state = (version, compiled)
+            self._mtime = mtime
+        logger.info("Loaded prompt templates %s (version %s)", self.path, version)
+
+    @staticmethod
+    def _compile(data):
+        # The language a template is written in and the one it asks Gemini for
+        # can differ (see language()), so every pairing is rendered
+        compiled = {'languages': data['languages'], 'system': data.get('system', {})}
+        for lang, prompt_code in itertools.product(data['languages'], repeat=2):
+            prompt_lang = data['languages'][prompt_code]
+            for prompt_type, creative, ending, multiple_scenes in itertools.product(
+                    ('image', 'video'), (False, True), (False, True), (False, True)):
+                mode = 'creative' if creative else 'standard'
+                static = {
+                    'prompt_lang': prompt_lang,
+                    'ending': data['ending'][lang] if ending else '',
+                    'scene_instruction': data['scene_instruction'][lang]['multiple' if multiple_scenes else 'single'],
+                }
+                key = (lang, prompt_code, prompt_type, creative, ending, multiple_scenes)
+                compiled[('recognition',) + key] = _split(data['recognition'][lang][prompt_type][mode], 'unused', **static)
+                compiled[('enhance',) + key] = _split(data['enhance'][lang][prompt_type][mode], 'user_input', **static)
+            for creative in (False, True):
+                mode = 'creative' if creative else 'standard'
+                compiled[('rewrite', lang, prompt_code, creative)] = _split(data['rewrite'][lang][mode], 'prompt_json', prompt_lang=prompt_lang)
+        for prompt_code, prompt_lang in data['languages'].items():
+            for creative in (False, True):
+                mode = 'creative' if creative else 'standard'
+                compiled[('fused', prompt_code, creative)] = _split(data['fused'][mode], 'user_context', prompt_lang=prompt_lang)
+        return compiled
+
+    def maybe_reload(self):
+        """Reload the file if it changed; checks at most every RELOAD_INTERVAL seconds."""
+        now = time.monotonic()
+        if now - self._checked_at < RELOAD_INTERVAL:
+            return
+        self._checked_at = now
+        try:
+            mtime = os.path.getmtime(self.path)
+        except OSError:
+            return
+        if mtime != self._mtime:
+            self.load()
+
+    @property
+    def version(self):
+        self.maybe_reload()
+        return self._state[0]
+
+    def _get(self, key, value=''):
+        self.maybe_reload()
+        return value.join(self._state[1][key])
+
+    @staticmethod
+    def language(output_lang, lowercase=False):
+        """Map an output_lang form value to ``(template language, language named in the prompt)``.
+
+        Matches the branches the prompts had in app.py: 'en' and 'zh-CN' pick
+        their own templates and any other value the zh-TW one, while the
+        language named in the prompt is looked up by exact code and falls back
+        to English. Only the rewrite (``lowercase=True``) also took the
+        lowercase 'zh-cn' / 'zh-tw' spellings the form sends.
+        """
+        if lowercase:
+            output_lang = _LOWERCASE_ALIASES.get(output_lang, output_lang)
+        template_lang = output_lang if output_lang in ('en', 'zh-CN') else 'zh-TW'
+        prompt_lang = output_lang if output_lang in ('en', 'zh-CN', 'zh-TW') else 'en'
+        return template_lang, prompt_lang
+
+    def recognition(self, output_lang, prompt_type, creative_mode, include_ending):
+        key = ('recognition',) + self.language(output_lang) + (prompt_type if prompt_type == 'video' else 'image',
+                                                                bool(creative_mode), bool(include_ending), False)
+        return self._get(key)
+
+    def enhance(self, user_input_text, output_lang, prompt_type, creative_mode, include_ending, multiple_scenes):
+        key = ('enhance',) + self.language(output_lang) + (prompt_type if prompt_type == 'video' else 'image',
+                                                            bool(creative_mode), bool(include_ending), bool(multiple_scenes))
+        return self._get(key, user_input_text)
+
+    def rewrite(self, prompt_json_text, output_lang, creative_mode):
+        return self._get(('rewrite',) + self.language(output_lang, lowercase=True) + (bool(creative_mode),), prompt_json_text)
+
+    def fused(self, user_context_text, output_lang, creative_mode):
+        return self._get(('fused', self.language(output_lang)[1], bool(creative_mode)), user_context_text)
+
+    def system_instruction(self, output_lang):
+        """System instruction pinning the response language, or ''."""
+        self.maybe_reload()
+        output_lang = _LOWERCASE_ALIASES.get(output_lang, output_lang)
+        if output_lang not in ('zh-CN', 'zh-TW'):
+            return ''
+        return self._state[1]['system'].get(output_lang, '')
+
+
+_registry = None
+_registry_lock = threading.Lock()
+
+
+def get_template_registry():
+    """Return the process-wide PromptTemplateRegistry."""
+    global _registry
+    if _registry is None:
+        with _registry_lock:
+            if _registry is None:
+                _registry = PromptTemplateRegistry()
+    return _registry
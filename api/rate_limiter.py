@@ -0,0 +1,292 @@
+#!/usr/bin/env python3
+"""
+Gemini Rate Limiter
+Token bucket, AIMD concurrency limit and jittered retry for calls sharing one API key
+"""
+
+import os
+import time
+import random
+import asyncio
+import threading
+import logging
+from email.utils import parsedate_to_datetime
+from requests.exceptions import RequestException
+from dotenv import load_dotenv
+
+# Load environment variables
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+THROTTLE_STATUSES = (429, 503)
+
+
+class RateLimitTimeout(RequestException):
+    """A call waited longer than the queue timeout for a rate-limit slot."""
+
+
+def parse_retry_after(value):
+    """Return the delay in seconds from a Retry-After header (seconds or HTTP date), or None."""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class GeminiRateLimiter:
+    """Client-side admission control for one Gemini API key.
+
+    A call first reserves a token from a bucket refilled at ``rpm`` requests
+    per minute (bursting to ``burst``), then takes one of ``limit``
+    concurrency slots. The limit grows by one per window of successful calls
+    and halves on a 429/503 (AIMD), at most once per ``decrease_interval``
+    seconds. Throttled calls are retried with full-jitter exponential backoff,
+    waiting at least as long as the server's Retry-After, during which the
+    bucket is paused so other callers queue instead of hitting the quota.
+    """
+
+    def __init__(self, rpm=None, burst=None, max_concurrency=None, min_concurrency=None,
+                 max_retries=None, retry_base=None, retry_max=None, queue_timeout=None):
+        # Use environment variables if not provided
+        if rpm is None:
+            rpm = float(os.getenv('GEMINI_RATE_LIMIT_RPM', '1000'))
+        if burst is None:
+            burst = int(os.getenv('GEMINI_RATE_LIMIT_BURST', '20'))
+        if max_concurrency is None:
+            max_concurrency = int(os.getenv('GEMINI_MAX_CONCURRENCY', '16'))
+        if min_concurrency is None:
+            min_concurrency = int(os.getenv('GEMINI_MIN_CONCURRENCY', '1'))
+        if max_retries is None:
+            max_retries = int(os.getenv('GEMINI_MAX_RETRIES', '4'))
+        if retry_base is None:
+            retry_base = float(os.getenv('GEMINI_RETRY_BASE', '1'))
+        if retry_max is None:
+            retry_max = float(os.getenv('GEMINI_RETRY_MAX', '30'))
+        if queue_timeout is None:
+            queue_timeout = float(os.getenv('GEMINI_QUEUE_TIMEOUT', '60'))
+
+        self.rate = rpm / 60.0
+        self.burst = burst
+        self.max_concurrency = max_concurrency
+        self.min_concurrency = min_concurrency
+        self.max_retries = max_retries
+        self.retry_base = retry_base
+        self.retry_max = retry_max
+        self.queue_timeout = queue_timeout
+        self.decrease_interval = 1.0
+
+        self._lock = threading.Lock()
+        self._slot_freed = threading.Condition(self._lock)
+        self._tokens = float(burst)
+        self._refilled_at = time.monotonic()
+        self._paused_until = 0.0
+        self._limit = float(max(min_concurrency, min(max_concurrency, max_concurrency // 2 or 1)))
+        self._in_flight = 0
+        self._last_decrease = 0.0
+        self._counters = {
+            'attempts': 0,
+            'throttled': 0,
+            'retries': 0,
+            'queued': 0,
+            'queue_timeouts': 0,
+            'gave_up': 0,
+        }
+        self._queue_wait_total = 0.0
+        self._queue_wait_max = 0.0
+
+    # Token bucket
+
+    def _reserve(self):
+        """Take a token and return how long the caller must wait before using it."""
+        # Caller must hold self._lock
+        now = time.monotonic()
+        if self.rate > 0:
+            self._tokens = min(self.burst, self._tokens + (now - self._refilled_at) * self.rate)
+        self._refilled_at = now
+        wait = max(0.0, self._paused_until - now)
+        if self.rate <= 0:
+            return wait
+        # Tokens may go negative; the deficit is the caller's place in the queue
+        self._tokens -= 1
+        if self._tokens < 0:
+            wait = max(wait, -self._tokens / self.rate)
+        return wait
+
+    def _refund(self):
+        # Caller must hold self._lock
+        if self.rate > 0:
+            self._tokens = min(self.burst, self._tokens + 1)
+
+    def _record_wait(self, waited):
+        # Caller must hold self._lock
+        if waited > 0.001:
+            self._counters['queued'] += 1
+            self._queue_wait_total += waited
+            self._queue_wait_max = max(self._queue_wait_max, waited)
+
+    # Slots
+
+    def acquire(self):
+        """Block until a token and a concurrency slot are available."""
+        start = time.monotonic()
+        deadline = start + self.queue_timeout
+        with self._lock:
+            self._counters['attempts'] += 1
+            wait = self._reserve()
+            if start + wait > deadline:
+                self._refund()
+                self._counters['queue_timeouts'] += 1
+                raise RateLimitTimeout(f"Gemini rate limit queue wait {wait:.1f}s exceeds {self.queue_timeout}s")
+        if wait > 0:
+            time.sleep(wait)
+        with self._lock:
+            while self._in_flight >= int(self._limit):
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._counters['queue_timeouts'] += 1
+                    raise RateLimitTimeout("Timed out waiting for a Gemini concurrency slot")
+                self._slot_freed.wait(remaining)
+            self._in_flight += 1
+            self._record_wait(time.monotonic() - start)
+
+    async def acquire_async(self):
+        """Event-loop version of :meth:`acquire`; waits without blocking the loop."""
+        start = time.monotonic()
+        deadline = start + self.queue_timeout
+        with self._lock:
+            self._counters['attempts'] += 1
+            wait = self._reserve()
+            if start + wait > deadline:
+                self._refund()
+                self._counters['queue_timeouts'] += 1
+                raise RateLimitTimeout(f"Gemini rate limit queue wait {wait:.1f}s exceeds {self.queue_timeout}s")
+        if wait > 0:
+            await asyncio.sleep(wait)
+        while True:
+            with self._lock:
+                if self._in_flight < int(self._limit):
+                    self._in_flight += 1
+                    self._record_wait(time.monotonic() - start)
+                    return
+                if time.monotonic() >= deadline:
+                    self._counters['queue_timeouts'] += 1
+                    raise RateLimitTimeout("Timed out waiting for a Gemini concurrency slot")
+            await asyncio.sleep(0.05)
+
+    def release(self):
+        """Give back a concurrency slot."""
+        with self._lock:
+            self._in_flight = max(0, self._in_flight - 1)
+            self._slot_freed.notify()
+
+    def has_headroom(self):
+        """True when a call could start now without queueing on a pause or the concurrency limit."""
+        with self._lock:
+            return self._paused_until <= time.monotonic() and self._in_flight < int(self._limit)
+
+    # AIMD feedback
+
+    def record(self, status_code, retry_after=None):
+        """Adjust the concurrency limit from a response status (None for transport errors)."""
+        with self._lock:
+            if status_code in THROTTLE_STATUSES:
+                self._counters['throttled'] += 1
+                now = time.monotonic()
+                if now - self._last_decrease >= self.decrease_interval:
+                    self._limit = max(self.min_concurrency, self._limit / 2)
+                    self._last_decrease = now
+                    logger.warning("Gemini throttled (%s), concurrency limit now %d", status_code, int(self._limit))
+                if retry_after:
+                    # Hold every caller back until the server says quota is available again
+                    self._paused_until = max(self._paused_until, now + retry_after)
+            elif status_code is not None and status_code < 500:
+                self._limit = min(self.max_concurrency, self._limit + 1 / self._limit)
+                self._slot_freed.notify_all()
+
+    def retry_delay(self, attempt, retry_after=None):
+        """Return the delay before retry ``attempt`` (0-based), or None to give up."""
+        if attempt >= self.max_retries or (retry_after is not None and retry_after > self.queue_timeout):
+            with self._lock:
+                self._counters['gave_up'] += 1
+            return None
+        with self._lock:
+            self._counters['retries'] += 1
+        # Full jitter keeps retries from many callers from lining up
+        delay = random.uniform(0, min(self.retry_max, self.retry_base * 2 ** attempt))
+        return max(delay, retry_after or 0.0)
+
+    # Retry loops
+
+    def call(self, send, hold=False):
+        """Run ``send()`` (returns a requests-style response) under the limiter, retrying throttles.
+
+        With ``hold=True`` a successful call keeps its concurrency slot and
+        the caller must :meth:`release` it, e.g. after consuming a stream.
+        """
+        attempt = 0
+        while True:
+            self.acquire()
+            try:
+                response = send()
+            except Exception:
+                self.record(None)
+                self.release()
+                raise
+            retry_after = parse_retry_after(response.headers.get('Retry-After'))
+            self.record(response.status_code, retry_after)
+            if response.status_code not in THROTTLE_STATUSES:
+                if not hold:
+                    self.release()
+                return response
+            self.release()
+            delay = self.retry_delay(attempt, retry_after)
+            if delay is None:
+                return response
+            logger.info("Gemini returned %s, retrying in %.2fs", response.status_code, delay)
+            response.close()
+            time.sleep(delay)
+            attempt += 1
+
+    async def call_async(self, send):
+        """Event-loop version of :meth:`call` for an async ``send()``."""
+        attempt = 0
+        while True:
+            await self.acquire_async()
+            try:
+                response = await send()
+            except Exception:
+                self.record(None)
+                raise
+            finally:
+                self.release()
+            retry_after = parse_retry_after(response.headers.get('Retry-After'))
+            self.record(response.status_code, retry_after)
+            if response.status_code not in THROTTLE_STATUSES:
+                return response
+            delay = self.retry_delay(attempt, retry_after)
+            if delay is None:
+                return response
+            logger.info("Gemini returned %s, retrying in %.2fs", response.status_code, delay)
+            await asyncio.sleep(delay)
+            attempt += 1
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counters)
+            stats['concurrency_limit'] = int(self._limit)
+            stats['in_flight'] = self._in_flight
+            stats['tokens'] = round(self._tokens, 2)
+            stats['paused_for'] = round(max(0.0, self._paused_until - time.monotonic()), 2)
+            stats['queue_wait_total'] = round(self._queue_wait_total, 3)
+            stats['queue_wait_max'] = round(self._queue_wait_max, 3)
+        stats['rate_rpm'] = self.rate * 60
+        stats['burst'] = self.burst
+        stats['max_concurrency'] = self.max_concurrency
+        return stats
@@ -0,0 +1,193 @@
+#!/usr/bin/env python3
+"""
+Result Cache
+Two-tier (memory LRU + on-disk JSON) cache for Gemini results with TTL eviction
+"""
+
+import os
+import json
+import copy
+import time
+import hashlib
+import threading
+import logging
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+
+def make_cache_key(*parts):
+    """Build a stable SHA-256 key from JSON-serializable parts."""
+    raw = json.dumps(parts, ensure_ascii=False, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+
+class ResultCache:
+    """Thread-safe LRU cache with per-entry TTL and an optional disk tier.
+
+    The memory tier holds up to ``max_entries`` items and, when ``max_bytes``
+    is set, at most that many bytes of serialized values. When ``disk_dir`` is
+    set, every entry is also written there as a JSON file so results survive
+    a restart; the disk tier is capped at ``max_disk_entries`` files and the
+    oldest files are removed first.
+    """
+
+    def __init__(self, name, max_entries=256, ttl=86400, disk_dir=None, max_disk_entries=2048, max_bytes=None):
+        self.name = name
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.disk_dir = disk_dir
+        self.max_disk_entries = max_disk_entries
+
+        self._entries = OrderedDict()  # key -> (expires_at, value, size)
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._counters = {
+            'memory_hits': 0,
+            'disk_hits': 0,
+            'misses': 0,
+            'sets': 0,
+            'evictions': 0,
+            'expired': 0,
+        }
+
+        if self.disk_dir:
+            os.makedirs(self.disk_dir, exist_ok=True)
+
+    def _disk_path(self, key):
+        return os.path.join(self.disk_dir, f"{key}.json")
+
+    def get(self, key):
+        """Return a copy of the cached value for ``key`` or None on a miss."""
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                expires_at, value, size = entry
+                if expires_at > now:
+                    self._entries.move_to_end(key)
+                    self._counters['memory_hits'] += 1
+                    return copy.deepcopy(value)
+                del self._entries[key]
+                self._bytes -= size
+                self._counters['expired'] += 1
+
+        value = self._disk_get(key, now)
+        with self._lock:
+            if value is None:
+                self._counters['misses'] += 1
+                return None
+            self._counters['disk_hits'] += 1
+            self._store(key, value, now + self.ttl)
+        return copy.deepcopy(value)
+
+    def set(self, key, value):
+        """Store ``value`` (must be JSON-serializable) under ``key``."""
+        expires_at = time.time() + self.ttl
+        value = copy.deepcopy(value)
+        with self._lock:
+            self._counters['sets'] += 1
+            self._store(key, value, expires_at)
+        self._disk_set(key, value, expires_at)
+
+    def _store(self, key, value, expires_at):
+        # Caller must hold self._lock
+        size = len(json.dumps(value, ensure_ascii=False).encode('utf-8'))
+        old = self._entries.pop(key, None)
+        if old is not None:
+            self._bytes -= old[2]
+        if self.max_bytes is not None and size > self.max_bytes:
+            return
+        self._entries[key] = (expires_at, value, size)
+        self._bytes += size
+        while len(self._entries) > self.max_entries or (self.max_bytes is not None and self._bytes > self.max_bytes):
+            _, (_, _, evicted_size) = self._entries.popitem(last=False)
+            self._bytes -= evicted_size
+            self._counters['evictions'] += 1
+
+    def _disk_get(self, key, now):
+        if not self.disk_dir:
+            return None
+        path = self._disk_path(key)
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                record = json.load(f)
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            logger.warning("Cache %s: unreadable disk entry %s: %s", self.name, path, e)
+            return None
+        if record.get('expires_at', 0) <= now:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            with self._lock:
+                self._counters['expired'] += 1
+            return None
+        return record.get('value')
+
+    def _disk_set(self, key, value, expires_at):
+        if not self.disk_dir:
+            return
+        path = self._disk_path(key)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump({'expires_at': expires_at, 'value': value}, f, ensure_ascii=False)
+            os.replace(tmp_path, path)
+            self._prune_disk()
+        except Exception as e:
+            logger.warning("Cache %s: failed to write disk entry %s: %s", self.name, path, e)
+
+    def _prune_disk(self):
+        files = [os.path.join(self.disk_dir, f) for f in os.listdir(self.disk_dir) if f.endswith('.json')]
+        excess = len(files) - self.max_disk_entries
+        if excess <= 0:
+            return
+        for path in sorted(files, key=os.path.getmtime)[:excess]:
+            try:
+                os.remove(path)
+                with self._lock:
+                    self._counters['evictions'] += 1
+            except OSError:
+                pass
+
+    def delete(self, key):
+        """Drop ``key`` from both tiers."""
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is not None:
+                self._bytes -= entry[2]
+        if self.disk_dir:
+            try:
+                os.remove(self._disk_path(key))
+            except OSError:
+                pass
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+        if self.disk_dir:
+            for f in os.listdir(self.disk_dir):
+                if f.endswith('.json'):
+                    try:
+                        os.remove(os.path.join(self.disk_dir, f))
+                    except OSError:
+                        pass
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counters)
+            stats['entries'] = len(self._entries)
+            stats['bytes'] = self._bytes
+        hits = stats['memory_hits'] + stats['disk_hits']
+        total = hits + stats['misses']
+        stats['hit_rate'] = round(hits / total, 4) if total else 0.0
+        stats['max_entries'] = self.max_entries
+        stats['max_bytes'] = self.max_bytes
+        stats['ttl'] = self.ttl
+        stats['disk_dir'] = self.disk_dir
+        return stats
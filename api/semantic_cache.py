@@ -0,0 +1,243 @@
+#!/usr/bin/env python3
+"""
+Semantic Cache
+Near-duplicate lookup of Gemini results by hashed n-gram text embeddings (NumPy)
+"""
+
+import os
+import re
+import zlib
+import threading
+import unicodedata
+import copy
+import logging
+from collections import OrderedDict
+from dotenv import load_dotenv
+
+try:
+    import numpy as np
+    NUMPY_AVAILABLE = True
+except ImportError:
+    NUMPY_AVAILABLE = False
+
+# Load environment variables
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+_WORD = re.compile(r'\w+')
+_PUNCTUATION = re.compile(r'[^\w\s]')
+# Han characters carry meaning one by one, so they are compared individually
+_HAN = re.compile(r'[\u3400-\u9fff\uf900-\ufaff]')
+_HAN_GAP = re.compile(r'(?<=[\u3400-\u9fff\uf900-\ufaff]) (?=[\u3400-\u9fff\uf900-\ufaff])')
+
+# Words whose presence or absence does not change the request. Negations
+# (no, not, without, 不, 沒, 無, ...) and numbers are deliberately kept.
+STOPWORDS = frozenset("""
+a an the of with and is are was were be been it its very please
+的 了 地 得 着 著 之 和 與 与 及 在 是 也 很 請 请
+""".split())
+
+
+def normalize_text(text):
+    """Fold width/case, drop punctuation and collapse whitespace so trivial edits embed identically."""
+    text = unicodedata.normalize('NFKC', text or '').lower()
+    # Chinese has no word spaces, so a space or comma between Han characters is dropped
+    return _HAN_GAP.sub('', ' '.join(_PUNCTUATION.sub(' ', text).split()))
+
+
+def content_words(text):
+    """Set of words, numbers and Han characters in ``text`` that are not stopwords.
+
+    Two texts can share a cached result only when these sets are equal, so
+    a swapped subject, colour, number or an added negation never matches
+    however close the embeddings are.
+    """
+    text = _HAN.sub(lambda m: f' {m.group()} ', normalize_text(text))
+    return frozenset(word for word in _WORD.findall(text) if word not in STOPWORDS)
+
+
+def embed_text(text, dim=512):
+    """Embed ``text`` as an L2-normalized signed feature-hashing vector.
+
+    Features are character bigrams and trigrams (which work for Chinese,
+    where there are no spaces) plus whole words. Empty text gives a zero
+    vector, which never matches anything by cosine.
+    """
+    text = normalize_text(text)
+    features = [text[i:i + n] for n in (2, 3) for i in range(len(text) - n + 1)]
+    features.extend(_WORD.findall(text))
+    vector = np.zeros(dim, dtype=np.float32)
+    if not features:
+        return vector
+    # crc32 is stable across processes, unlike hash()
+    hashes = np.fromiter((zlib.crc32(f.encode('utf-8')) for f in features), dtype=np.uint64, count=len(features))
+    signs = np.where((hashes >> np.uint64(31)) & np.uint64(1), -1.0, 1.0).astype(np.float32)
+    np.add.at(vector, (hashes % np.uint64(dim)).astype(np.intp), signs)
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+
+class _Index:
+    """Embedding matrix for one partition; grows by doubling up to ``capacity`` rows."""
+
+    def __init__(self, capacity, dim):
+        self.capacity = capacity
+        self.matrix = np.zeros((min(capacity, 16), dim), dtype=np.float32)
+        self.last_used = np.zeros(len(self.matrix), dtype=np.int64)
+        self.texts = []
+        self.values = []
+        self.rows = {}  # normalized text -> row
+        self.words = []
+        self.rows_by_words = {}  # content words -> set of rows
+        self.size = 0
+
+    def append(self, text, vector, value):
+        if self.size == len(self.matrix):
+            rows = min(self.capacity, 2 * self.size)
+            self.matrix = np.resize(self.matrix, (rows, self.matrix.shape[1]))
+            self.last_used = np.resize(self.last_used, rows)
+        row = self.size
+        self.size += 1
+        self.matrix[row] = vector
+        self.texts.append(text)
+        self.values.append(value)
+        self.rows[text] = row
+        self.words.append(None)
+        self.set_words(row, content_words(text))
+        return row
+
+    def set_words(self, row, words):
+        old = self.words[row]
+        if old is not None:
+            rows = self.rows_by_words[old]
+            rows.discard(row)
+            if not rows:
+                del self.rows_by_words[old]
+        self.words[row] = words
+        self.rows_by_words.setdefault(words, set()).add(row)
+
+
+class SemanticCache:
+    """Cache values by text similarity within separate indexes.
+
+    Each index key (e.g. output language plus the options that change
+    Gemini's answer) gets its own matrix of up to ``max_entries`` unit
+    vectors. Only rows with the same content words as the lookup (see
+    content_words()) are candidates; they are scored with one
+    matrix-vector product, and the best row is a hit when its cosine
+    similarity reaches ``threshold``. The least recently
+    used row is overwritten when an index is full, and the least recently
+    used index is dropped beyond ``max_indexes``.
+    """
+
+    def __init__(self, name, threshold=None, dim=None, max_entries=None, max_indexes=None):
+        # Use environment variables if not provided
+        if threshold is None:
+            threshold = float(os.getenv('SEMANTIC_CACHE_THRESHOLD', '0.95'))
+        if dim is None:
+            dim = int(os.getenv('SEMANTIC_CACHE_DIM', '512'))
+        if max_entries is None:
+            max_entries = int(os.getenv('SEMANTIC_CACHE_SIZE', '512'))
+        if max_indexes is None:
+            max_indexes = int(os.getenv('SEMANTIC_CACHE_INDEXES', '32'))
+
+        self.name = name
+        self.threshold = threshold
+        self.dim = dim
+        self.max_entries = max_entries
+        self.max_indexes = max_indexes
+
+        self._indexes = OrderedDict()
+        self._tick = 0
+        self._lock = threading.Lock()
+        self._counters = {
+            'exact_hits': 0,
+            'similar_hits': 0,
+            'misses': 0,
+            'sets': 0,
+            'evictions': 0,
+        }
+
+    def get(self, index_key, text):
+        """Return a copy of the value cached for the most similar text, or None."""
+        normalized = normalize_text(text)
+        vector = embed_text(normalized, self.dim)
+        with self._lock:
+            index = self._indexes.get(index_key)
+            if index is None or index.size == 0:
+                self._counters['misses'] += 1
+                return None
+            self._indexes.move_to_end(index_key)
+            row = index.rows.get(normalized)
+            if row is not None:
+                self._counters['exact_hits'] += 1
+            else:
+                candidates = index.rows_by_words.get(content_words(normalized))
+                if not candidates:
+                    self._counters['misses'] += 1
+                    return None
+                candidates = list(candidates)
+                scores = index.matrix[candidates] @ vector
+                best = int(np.argmax(scores))
+                if scores[best] < self.threshold:
+                    self._counters['misses'] += 1
+                    return None
+                row = candidates[best]
+                self._counters['similar_hits'] += 1
+                logger.debug("Semantic cache %s: %.3f match for %r -> %r", self.name, scores[best], normalized, index.texts[row])
+            self._tick += 1
+            index.last_used[row] = self._tick
+            value = index.values[row]
+        return copy.deepcopy(value)
+
+    def set(self, index_key, text, value):
+        """Store ``value`` for ``text`` in the index ``index_key``."""
+        normalized = normalize_text(text)
+        vector = embed_text(normalized, self.dim)
+        value = copy.deepcopy(value)
+        with self._lock:
+            self._counters['sets'] += 1
+            index = self._indexes.get(index_key)
+            if index is None:
+                index = self._indexes[index_key] = _Index(self.max_entries, self.dim)
+                while len(self._indexes) > self.max_indexes:
+                    _, dropped = self._indexes.popitem(last=False)
+                    self._counters['evictions'] += dropped.size
+            self._indexes.move_to_end(index_key)
+
+            row = index.rows.get(normalized)
+            if row is not None:
+                index.values[row] = value
+            elif index.size < self.max_entries:
+                row = index.append(normalized, vector, value)
+            else:
+                # Overwrite the least recently used row in place
+                row = int(np.argmin(index.last_used))
+                del index.rows[index.texts[row]]
+                self._counters['evictions'] += 1
+                index.rows[normalized] = row
+                index.texts[row] = normalized
+                index.values[row] = value
+                index.matrix[row] = vector
+                index.set_words(row, content_words(normalized))
+            self._tick += 1
+            index.last_used[row] = self._tick
+
+    def clear(self):
+        with self._lock:
+            self._indexes.clear()
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counters)
+            stats['indexes'] = len(self._indexes)
+            stats['entries'] = sum(index.size for index in self._indexes.values())
+        hits = stats['exact_hits'] + stats['similar_hits']
+        total = hits + stats['misses']
+        stats['hit_rate'] = round(hits / total, 4) if total else 0.0
+        stats['threshold'] = self.threshold
+        stats['dim'] = self.dim
+        stats['max_entries'] = self.max_entries
+        stats['max_indexes'] = self.max_indexes
+        return stats
@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+"""
+Single-Flight
+Coalesce identical concurrent calls so only one of them does the work
+"""
+
+import copy
+import threading
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class _Call:
+    __slots__ = ('done', 'result', 'error')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """Run ``fn`` once per key while a call for that key is in flight.
+
+    The first caller for a key (the leader) runs the function; callers that
+    arrive with the same key before it finishes block until it does and get
+    a deep copy of the leader's result (or re-raise its exception).
+    """
+
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+        self._leaders = 0
+        self._shared = 0
+
+    def do(self, key, fn):
+        with self._lock:
+            call = self._calls.get(key)
+            if call is None:
+                call = _Call()
+                self._calls[key] = call
+                self._leaders += 1
+                leader = True
+            else:
+                self._shared += 1
+                leader = False
+
+        if not leader:
+            logger.debug("Single-flight: waiting on in-flight call %s", key)
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return copy.deepcopy(call.result)
+
+        try:
+            value = fn()
+            # Followers get copies of a snapshot so the leader may mutate its value
+            call.result = copy.deepcopy(value)
+            return value
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+            call.done.set()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'in_flight': len(self._calls),
+                'leaders': self._leaders,
+                'shared': self._shared,
+            }
@@ -8,13 +8,18 @@ import json
 import sys
 import os
 try:
-    from .comfyui_client import generate_image
+    from api.cancellation import JobCancelled
+except ImportError:
+    from cancellation import JobCancelled
+try:
+    from .comfyui_client import generate_image, generate_images, build_batch_workflows, workflow_hash
 except ImportError:
     try:
-        from comfyui_client import generate_image
+        from comfyui_client import generate_image, generate_images, build_batch_workflows, workflow_hash
     except ImportError:
         print("ComfyUI client not available, using mock mode")
-        generate_image = None
+        generate_image = generate_images = None
+        build_batch_workflows = workflow_hash = None
 from dotenv import load_dotenv
 
 # Load environment variables
@@ -103,6 +108,19 @@ def json_to_prompt(vprompt_json):
     
     return positive_prompt, negative_prompt
 
+def generation_key(vprompt_dict, seed, seeds=None, count=1):
+    """Hash of the exact workflow(s) a fixed-seed generation would queue, or None if it is not reproducible"""
+    if seeds:
+        seed = seeds[0]
+    if seed is None or build_batch_workflows is None:
+        return None
+    positive, negative = json_to_prompt(vprompt_dict)
+    if not positive:
+        return None
+    workflows = build_batch_workflows(positive, negative or "", seeds or [seed], count)
+    # A single workflow hashes on its own so existing single-image keys stay valid
+    return workflow_hash(workflows[0] if len(workflows) == 1 else workflows)
+
 def generate_from_vprompt_json(json_file, output_dir="./vprompt_output", seed=None):
     """Generate image from vPrompt JSON file"""
     try:
@@ -137,8 +155,8 @@ def generate_from_vprompt_json(json_file, output_dir="./vprompt_output", seed=No
         print(f"❌ Error processing vPrompt JSON: {e}")
         return None
 
-def generate_from_vprompt_dict(vprompt_dict, output_dir="./vprompt_output", seed=None, progress_callback=None, server_address=None, port=None):
-    """Generate image from vPrompt dictionary"""
+def generate_from_vprompt_dict(vprompt_dict, output_dir="./vprompt_output", seed=None, progress_callback=None, server_address=None, port=None, cancel_token=None, seeds=None, count=1):
+    """Generate image from vPrompt dictionary (``count`` images, or one per seed in ``seeds``)"""
     try:
         positive, negative = json_to_prompt(vprompt_dict)
         
@@ -154,18 +172,22 @@ def generate_from_vprompt_dict(vprompt_dict, output_dir="./vprompt_output", seed
             print("❌ ComfyUI not available, cannot generate images")
             return None
             
-        images = generate_image(
+        images = generate_images(
             prompt_text=positive,
             negative_prompt=negative or "",
             output_dir=output_dir,
-            seed=seed,
+            seeds=seeds or ([seed] if seed is not None else None),
+            count=count,
             progress_callback=progress_callback,
             server_address=server_address,
-            port=port
+            port=port,
+            cancel_token=cancel_token
         )
         
         return images
         
+    except JobCancelled:
+        raise
     except Exception as e:
         print(f"❌ Error processing vPrompt dictionary: {e}")
         return None
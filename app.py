@@ -5,15 +5,19 @@ from datetime import datetime
 
 # Configure logging to show INFO messages
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
-from flask import Flask, render_template, request, redirect, url_for, send_file, jsonify, send_from_directory
+from flask import Flask, render_template, request, redirect, url_for, send_file, jsonify, send_from_directory, Response
 from werkzeug.utils import secure_filename
 # 假設 Gemini API 有官方 Python SDK
 # from gemini_flash_lite_sdk import GeminiClient
 import requests
 from dotenv import load_dotenv
 import base64
+import hashlib
 from flask import make_response
 import threading
+import asyncio
+import functools
+import copy
 import uuid
 import time
 
@@ -23,21 +27,38 @@ import os
 sys.path.append(os.path.join(os.path.dirname(__file__), 'api'))
 from comfyui_client import ComfyUIClient  # Import ComfyUIClient from the `api` directory
 
-# In-memory job store for generation progress tracking
-generation_jobs = {}
-generation_jobs_lock = threading.Lock()
+# Job store for generation progress tracking (SQLite WAL shared by all workers, or memory); finished jobs expire
+from api.job_store import create_job_store
+generation_jobs = None  # Opened by start_services()
+# Seconds between keep-alive comments on an idle /generation_events stream
+GENERATION_EVENTS_HEARTBEAT = float(os.getenv('GENERATION_EVENTS_HEARTBEAT', '15'))
+# Longest a /generation_status long-poll (?since=&wait=) may block
+GENERATION_STATUS_MAX_WAIT = float(os.getenv('GENERATION_STATUS_MAX_WAIT', '30'))
 
 # Import image generation integration
 try:
-    from api.vprompt_integration import generate_from_vprompt_dict
+    from api.vprompt_integration import generate_from_vprompt_dict, generation_key
     COMFYUI_AVAILABLE = True
 except ImportError as e:
     try:
         from api.simple_integration import generate_from_vprompt_dict
+        generation_key = None  # Placeholder images are not worth caching
         COMFYUI_AVAILABLE = True
     except ImportError as e2:
         COMFYUI_AVAILABLE = False
 
+# Shared keep-alive client for all Gemini calls
+from api.gemini_client import get_gemini_client, json_generation_config, parse_json_response, response_text
+from api.result_cache import ResultCache, make_cache_key
+from api.single_flight import SingleFlight
+from api.image_references import ImageReferenceManager, uses_file_reference, file_reference_rejected
+from api.image_preprocess import preprocess_image
+from api.semantic_cache import SemanticCache, NUMPY_AVAILABLE
+from api.prompt_pipeline import get_prompt_pipeline, HTTPX_AVAILABLE
+from api.prompt_templates import get_template_registry
+from api.job_executor import get_job_executor, QueueFull, PRIORITY_CLASSES
+from api.cancellation import CancelToken, JobCancelled, abortable_post
+
 UPLOAD_FOLDER = 'uploads'
 GENERATED_FOLDER = os.path.abspath('uploads/generated')
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif', 'heic', 'heif'}
@@ -47,6 +68,44 @@ app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 os.makedirs(GENERATED_FOLDER, exist_ok=True)
 
+# Gemini result caches (opened by start_services())
+CACHE_FOLDER = os.getenv('CACHE_FOLDER', 'cache')
+recognition_cache = None
+rewrite_cache = None
+# Coalesces identical concurrent Gemini calls onto one request
+gemini_flight = SingleFlight()
+# Near-duplicate text-only submissions reuse an earlier enhancement (requires numpy)
+ENHANCE_SEMANTIC_CACHE = os.getenv('ENHANCE_SEMANTIC_CACHE', 'true').lower() == 'true' and NUMPY_AVAILABLE
+enhance_cache = None
+# Uploaded images referenced by Files API URI instead of being re-sent inline
+image_references = None
+
+# Fixed-seed image jobs are keyed by a hash of the patched ComfyUI workflow: identical
+# requests attach to the running job, and finished image lists are reused without a GPU run
+IMAGE_GENERATION_DEDUP = os.getenv('IMAGE_GENERATION_DEDUP', 'true').lower() == 'true'
+generation_results = None  # Opened by start_services()
+active_generations = {}  # generation key -> id of the job producing it
+active_generations_lock = threading.Lock()
+generation_dedup_stats = {'attached': 0, 'cached': 0, 'queued': 0}
+# Largest 'count' / 'seeds' batch a single image job may ask for
+IMAGE_BATCH_MAX = int(os.getenv('IMAGE_BATCH_MAX', '8'))
+
+# Fused mode: one Gemini call returns both the recognition JSON and the prose prompt
+GEMINI_FUSED_MODE = os.getenv('GEMINI_FUSED_MODE', 'false').lower() == 'true'
+fused_stats = {'calls': 0, 'fallbacks': 0}
+fused_stats_lock = threading.Lock()
+
+# Async prompt pipeline used by AJAX submissions; per-stage deadlines in seconds
+PROMPT_PIPELINE_ENABLED = os.getenv('PROMPT_PIPELINE', 'true').lower() == 'true' and HTTPX_AVAILABLE
+PIPELINE_DEADLINES = {
+    'recognition': float(os.getenv('PIPELINE_RECOGNITION_DEADLINE', '60')),
+    'rewrite': float(os.getenv('PIPELINE_REWRITE_DEADLINE', '45')),
+    'geolocation': float(os.getenv('PIPELINE_GEOLOCATION_DEADLINE', '5')),
+}
+
+# Seconds a rewrite request waits for the browser to open /prompt_stream/<stream_id>
+PROMPT_STREAM_TTL = 300
+
 # --- WS capture control (for capturing raw ComfyUI websocket messages) ---
 @app.route('/capture_ws_start', methods=['POST'])
 def capture_ws_start():
@@ -173,18 +232,22 @@ def get_location_from_ip(ip_address):
         # Use a simple free IP geolocation service
         response = requests.get(f'http://ip-api.com/json/{ip_address}', timeout=5)
         if response.status_code == 200:
-            data = response.json()
-            if data['status'] == 'success':
-                return {
-                    'country': data.get('country', 'Unknown'),
-                    'region': data.get('regionName', 'Unknown'),
-                    'city': data.get('city', 'Unknown'),
-                    'timezone': data.get('timezone', 'Unknown'),
-                    'isp': data.get('isp', 'Unknown')
-                }
+            return parse_location(response.json())
     except Exception as e:
         pass
     
+    return parse_location(None)
+
+def parse_location(data):
+    """Turn an ip-api.com response into the location record stored in the logs"""
+    if data and data.get('status') == 'success':
+        return {
+            'country': data.get('country', 'Unknown'),
+            'region': data.get('regionName', 'Unknown'),
+            'city': data.get('city', 'Unknown'),
+            'timezone': data.get('timezone', 'Unknown'),
+            'isp': data.get('isp', 'Unknown')
+        }
     return {
         'country': 'Unknown',
         'region': 'Unknown', 
@@ -193,16 +256,27 @@ def get_location_from_ip(ip_address):
         'isp': 'Unknown'
     }
 
-def log_user_interaction(user_inputs, prompt_result, prompt_json_result, uploaded_file_path=None, generated_images=None):
-    """Log user interaction to JSON file"""
+interaction_log_lock = threading.Lock()
+
+def log_user_interaction(user_inputs, prompt_result, prompt_json_result, uploaded_file_path=None, generated_images=None,
+                         client_ip=None, location_info=None, user_agent=None):
+    """Log user interaction to JSON file
+
+    Client details default to the current request; the prompt pipeline passes
+    them in because it logs outside the request context.
+    """
     try:
         # Create logs directory if it doesn't exist
         log_dir = 'logs'
         os.makedirs(log_dir, exist_ok=True)
         
         # Get client information
-        client_ip = get_client_ip()
-        location_info = get_location_from_ip(client_ip)
+        if client_ip is None:
+            client_ip = get_client_ip()
+        if location_info is None:
+            location_info = get_location_from_ip(client_ip)
+        if user_agent is None:
+            user_agent = request.headers.get('User-Agent', 'Unknown')
         
         # Create log entry
         log_entry = {
@@ -214,26 +288,28 @@ def log_user_interaction(user_inputs, prompt_result, prompt_json_result, uploade
             'prompt_json_result': prompt_json_result,
             'uploaded_file_path': uploaded_file_path,
             'generated_images': generated_images,
-            'user_agent': request.headers.get('User-Agent', 'Unknown')
+            'user_agent': user_agent
         }
         
         # Generate log filename with date
         log_filename = f"user_interactions_{datetime.now().strftime('%Y-%m-%d')}.json"
         log_filepath = os.path.join(log_dir, log_filename)
         
-        # Read existing logs or create new list
-        if os.path.exists(log_filepath):
-            with open(log_filepath, 'r', encoding='utf-8') as f:
-                logs = json.load(f)
-        else:
-            logs = []
-        
-        # Add new log entry
-        logs.append(log_entry)
-        
-        # Write back to file
-        with open(log_filepath, 'w', encoding='utf-8') as f:
-            json.dump(logs, f, ensure_ascii=False, indent=2)
+        # Pipeline jobs log from executor threads, so serialise the read-modify-write
+        with interaction_log_lock:
+            # Read existing logs or create new list
+            if os.path.exists(log_filepath):
+                with open(log_filepath, 'r', encoding='utf-8') as f:
+                    logs = json.load(f)
+            else:
+                logs = []
+
+            # Add new log entry
+            logs.append(log_entry)
+
+            # Write back to file
+            with open(log_filepath, 'w', encoding='utf-8') as f:
+                json.dump(logs, f, ensure_ascii=False, indent=2)
         
         
     except Exception as e:
@@ -267,39 +343,785 @@ def handle_regenerate_request():
             except (ValueError, TypeError):
                 return jsonify({'error': 'Invalid seed value'}), 400
 
+        # Optional batch: 'count' images or one per entry of 'seeds'
+        seeds, count, invalid = requested_image_batch(seed)
+        if invalid:
+            return invalid
 
         # Debug: echo back received JSON in response for frontend confirmation
         debug_echo = json.dumps(prompt_json, ensure_ascii=False, indent=2)
 
-        # Generate a unique job ID for the regenerate request
-        job_id = str(uuid.uuid4())
-
-        # Initialize the job in the global jobs dictionary
-        with generation_jobs_lock:
-            generation_jobs[job_id] = {
-                'status': 'pending',
-                'progress': 0,
-                'images': [],
-                'error': None,
-                'seed': seed
-            }
-
-        # Start background generation thread
-        thread = threading.Thread(target=_background_generate, args=(job_id, prompt_json, seed))
-        thread.daemon = True
-        thread.start()
+        # Queue the job on the bounded image pool (429 when the queue is full),
+        # or reuse an identical fixed-seed job
+        job_id, queue_position, reused, busy = queue_image_job({
+            'status': 'pending',
+            'progress': 0,
+            'images': [],
+            'error': None,
+            'seed': seed,
+            'seeds': seeds,
+            'count': count
+        }, prompt_json, seed, seeds=seeds, count=count)
+        if busy:
+            return busy
 
         # Return job ID for frontend to poll
         return jsonify({
             'job_id': job_id,
             'message': 'Image regeneration started',
             'seed': seed,
+            'seeds': seeds,
+            'count': count,
+            'queue_position': queue_position,
+            'reused': reused,
             'debug_echo': debug_echo
         }), 200
 
     except Exception as e:
         return jsonify({'error': f'Internal server error: {str(e)}'}), 500
 
+def requested_job_priority():
+    """Priority class asked for by the request ('priority' in the JSON body or form); interactive by default."""
+    if request.is_json:
+        body = request.get_json(silent=True)
+        priority = body.get('priority') if isinstance(body, dict) else None
+    else:
+        priority = request.form.get('priority')
+    return priority if priority in PRIORITY_CLASSES else 'interactive'
+
+
+def requested_image_batch(seed=None):
+    """Images asked for by the request as ``(seeds, count, error_response)``.
+
+    A 'seeds' list (comma-separated in a form) makes one image per seed; a
+    'count' makes that many images from one latent batch, on ``seed`` (the
+    request's 'seed') when it is given. Both are capped by IMAGE_BATCH_MAX,
+    and a request with both 'seed' and 'seeds' is rejected.
+    """
+    if request.is_json:
+        body = request.get_json(silent=True)
+        body = body if isinstance(body, dict) else {}
+        raw_seeds, raw_count = body.get('seeds'), body.get('count')
+    else:
+        raw_seeds, raw_count = request.form.get('seeds'), request.form.get('count')
+    if isinstance(raw_seeds, str):
+        raw_seeds = [part for part in raw_seeds.split(',') if part.strip()]
+    try:
+        seeds = [int(seed) for seed in raw_seeds] if raw_seeds else None
+        count = int(raw_count) if raw_count not in (None, '') else len(seeds or [None])
+    except (ValueError, TypeError):
+        return None, None, (jsonify({'error': 'Invalid seeds or count value'}), 400)
+    if seeds and seed is not None:
+        return None, None, (jsonify({'error': 'Send either seed or seeds, not both'}), 400)
+    if seeds and (count != len(seeds) or len(set(seeds)) != len(seeds)):
+        return None, None, (jsonify({'error': 'seeds must be distinct and match count'}), 400)
+    if not 1 <= count <= IMAGE_BATCH_MAX:
+        return None, None, (jsonify({'error': f'count must be between 1 and {IMAGE_BATCH_MAX}'}), 400)
+    return seeds, count, None
+
+
+def queue_generation_job(kind, job_id, job, fn, *args):
+    """Record a generation job and queue ``fn(job_id, *args)`` on the bounded ``kind`` pool.
+
+    Jobs are scheduled fairly per client IP and priority class. Returns
+    ``(queue_position, None)``, or ``(None, response)`` with a 429 and
+    Retry-After when the pool's queue, or this client's share of it, is full.
+    """
+    client = get_client_ip()
+    priority = requested_job_priority()
+    # The arguments are kept so a restarted server can re-queue the job
+    generation_jobs.create(job_id, dict(job, args=list(args), client=client, priority=priority))
+    try:
+        return get_job_executor().submit(kind, job_id, fn, *args, client=client, priority=priority), None
+    except QueueFull as e:
+        generation_jobs.delete(job_id)
+        response = jsonify({'error': str(e), 'retry_after': e.retry_after})
+        response.status_code = 429
+        response.headers['Retry-After'] = str(e.retry_after)
+        return None, response
+
+
+def image_generation_key(prompt_json, seed, modified_text=None, seeds=None, count=1):
+    """Workflow hash for a reproducible (fixed-seed) image job, or None when it must run fresh."""
+    if not IMAGE_GENERATION_DEDUP or generation_key is None or (seed is None and not seeds):
+        return None
+    try:
+        return generation_key(apply_modified_text(copy.deepcopy(prompt_json), modified_text), seed, seeds, count)
+    except Exception as e:
+        logging.getLogger(__name__).warning("Could not hash image workflow: %s", e)
+        return None
+
+
+def queue_image_job(job, prompt_json, seed, modified_text=None, seeds=None, count=1):
+    """Queue an image job unless an identical fixed-seed one can be reused.
+
+    Returns ``(job_id, queue_position, reused, busy_response)``. ``reused``
+    is 'attached' when the request joined an identical job that is still
+    pending or running, 'cached' when a new job was completed at once from
+    the stored images of an earlier run, and None for a fresh GPU run. An
+    attached request is counted as one more subscriber of the shared job,
+    so cancel_generation only stops the run once every subscriber has
+    cancelled.
+    """
+    job_id = str(uuid.uuid4())
+    key = image_generation_key(prompt_json, seed, modified_text, seeds, count)
+    if key is None:
+        queue_position, busy = queue_generation_job('image', job_id, job, _background_generate,
+                                                    prompt_json, seed, modified_text, seeds, count)
+        return job_id, queue_position, None, busy
+
+    with active_generations_lock:
+        running_id = active_generations.get(key)
+        if running_id and generation_jobs.subscribe(running_id):
+            generation_dedup_stats['attached'] += 1
+            return running_id, get_job_executor().position('image', running_id), 'attached', None
+        active_generations.pop(key, None)
+
+        images = generation_results.get(key)
+        if images and all(os.path.exists(image['path']) for image in images):
+            generation_jobs.create(job_id, dict(job, generation_key=key))
+            generation_jobs.update(job_id, status='done', progress=100, images=images, cached=True)
+            generation_dedup_stats['cached'] += 1
+            return job_id, None, 'cached', None
+        if images:
+            # The files were cleaned up; run it again
+            generation_results.delete(key)
+
+        queue_position, busy = queue_generation_job('image', job_id, dict(job, generation_key=key),
+                                                    _background_generate, prompt_json, seed, modified_text, seeds, count)
+        if not busy:
+            active_generations[key] = job_id
+            generation_dedup_stats['queued'] += 1
+        return job_id, queue_position, None, busy
+
+
+def release_image_generation(job_id):
+    """Forget a finished job's in-flight entry and cache its images for identical requests."""
+    job = generation_jobs.get(job_id)
+    key = job.get('generation_key') if job else None
+    if not key:
+        return
+    with active_generations_lock:
+        if active_generations.get(key) == job_id:
+            del active_generations[key]
+    if job['status'] == 'done' and job.get('images'):
+        generation_results.set(key, job['images'])
+
+
+def prompt_fields(prompt_type, include_ending):
+    """Return the JSON fields Gemini is asked to fill for recognition/enhancement."""
+    fields = ['Scene', 'ambiance_or_mood', 'Location', 'Visual style']
+    if prompt_type == 'video':
+        fields.append('camera motion')
+    fields.append('lighting')
+    if include_ending:
+        fields.append('ending')
+    return fields
+
+
+def cached_gemini_call(stage, cache, key, fn):
+    """Return the cached value for ``key`` or run ``fn`` once for all concurrent callers.
+
+    Identical in-flight requests (same stage and key) wait on a single Gemini
+    call and share its result. Truthy results are stored in ``cache`` when
+    one is given.
+    """
+    if cache is not None:
+        value = cache.get(key)
+        if value is not None:
+            return value
+
+    def call():
+        value = fn()
+        if value and cache is not None:
+            cache.set(key, value)
+        return value
+
+    return gemini_flight.do(f"{stage}:{key}", call)
+
+
+def register_prompt_stream(payload, rewrite_key):
+    """Park a rewrite payload until the browser opens its SSE stream; returns the stream id.
+
+    The payload is kept in the prompt job store so the stream can be opened
+    on any worker process. It is stored as a finished record, so the store's
+    TTL sweep drops streams the browser never picked up.
+    """
+    stream_id = str(uuid.uuid4())
+    get_prompt_pipeline().store.create(stream_id, {
+        'type': 'prompt_stream',
+        'status': 'done',
+        'payload': payload,
+        'rewrite_key': rewrite_key,
+        'created': time.time()
+    })
+    return stream_id
+
+
+def take_prompt_stream(stream_id):
+    """Remove and return a parked rewrite; None if unknown, expired or already opened."""
+    store = get_prompt_pipeline().store
+    pending = store.get(stream_id)
+    # Only the caller whose delete succeeds may relay it
+    if not pending or pending.get('type') != 'prompt_stream' or not store.delete(stream_id):
+        return None
+    if time.time() - pending['created'] > PROMPT_STREAM_TTL:
+        return None
+    return pending
+
+
+def build_recognition_payload(image_bytes, filename, prompt_type, output_lang, creative_mode, include_ending, reupload=False):
+    """Build the generateContent payload that turns an uploaded image into the prompt JSON fields.
+
+    The image goes as a Files API reference when it was uploaded before (or
+    can be uploaded now), otherwise inline. ``reupload`` drops a reference
+    Gemini rejected and uploads the image again.
+    """
+    image_part = None
+    ref_key = image_references.key(image_bytes) if image_references.enabled else None
+    if ref_key and reupload:
+        image_references.forget(ref_key)
+    elif ref_key:
+        image_part = image_references.lookup(ref_key)
+    if image_part is None:
+        # Downscale/re-encode large uploads so the request body stays small
+        processed = preprocess_image(image_bytes)
+        if processed:
+            image_bytes, mime_type = processed
+        else:
+            # Get appropriate MIME type for the uploaded file
+            mime_type = get_image_mime_type(filename)
+        if ref_key:
+            image_part = image_references.upload(ref_key, image_bytes, mime_type)
+        if image_part is None:
+            image_part = {"inline_data": {"mime_type": mime_type, "data": base64.b64encode(image_bytes).decode()}}
+
+    prompt_text_recog = get_template_registry().recognition(output_lang, prompt_type, creative_mode, include_ending)
+    payload = {
+        "contents": [
+            {
+                "parts": [
+                    {"text": prompt_text_recog},
+                    image_part
+                ]
+            }
+        ],
+        "generationConfig": json_generation_config(prompt_fields(prompt_type, include_ending))
+    }
+    return payload
+
+
+def generate_image_content(build, *args):
+    """Send ``build(*args)`` to Gemini, re-uploading once if a stale file reference is rejected."""
+    payload = build(*args)
+    resp = get_gemini_client().generate_content(payload)
+    if resp.status_code != 200 and uses_file_reference(payload) and file_reference_rejected(resp):
+        logging.getLogger(__name__).warning("Gemini rejected an image file reference (%s), uploading again", resp.status_code)
+        resp.close()
+        resp = get_gemini_client().generate_content(build(*args, reupload=True))
+    return resp
+
+
+def recognize_image(image_bytes, filename, prompt_type, output_lang, creative_mode, include_ending):
+    """Run Gemini image recognition and return the parsed JSON fields, or None on failure."""
+    resp = generate_image_content(build_recognition_payload, image_bytes, filename, prompt_type, output_lang, creative_mode, include_ending)
+    try:
+        return parse_json_response(resp.json())
+    except Exception as e:
+        return None
+
+
+def build_fused_payload(image_bytes, filename, prompt_type, output_lang, creative_mode, include_ending, user_context, reupload=False):
+    """Build a recognition payload that also asks for the Complete Prompt as ``prompt_text``."""
+    fields = prompt_fields(prompt_type, include_ending)
+    payload = build_recognition_payload(image_bytes, filename, prompt_type, output_lang, creative_mode, include_ending, reupload)
+    templates = get_template_registry()
+    rewrite_instruction = templates.fused(json.dumps(user_context, ensure_ascii=False), output_lang, creative_mode)
+    payload['contents'][0]['parts'][0]['text'] += "\n\n" + rewrite_instruction
+    payload['generationConfig'] = json_generation_config(fields + ['prompt_text'])
+    system_instruction = templates.system_instruction(output_lang)
+    if system_instruction:
+        payload["systemInstruction"] = {"parts": [{"text": system_instruction}]}
+    return payload
+
+
+def validate_fused_result(result, prompt_type, include_ending):
+    """Return the fused result if it is usable, otherwise count a fallback and return None."""
+    fields = prompt_fields(prompt_type, include_ending)
+    # Every field must be a string, the prose must be present and the image must have been recognised
+    valid = (
+        isinstance(result, dict)
+        and all(isinstance(result.get(field), str) for field in fields + ['prompt_text'])
+        and result['prompt_text'].strip()
+        and any(result[field].strip() for field in fields)
+    )
+    if not valid:
+        logger = logging.getLogger(__name__)
+        logger.warning("Fused recognition response failed validation, falling back to two calls")
+        with fused_stats_lock:
+            fused_stats['fallbacks'] += 1
+        return None
+    return result
+
+
+def recognize_and_rewrite(image_bytes, filename, prompt_type, output_lang, creative_mode, include_ending, user_context):
+    """Fused mode: recognize the image and write the Complete Prompt in one Gemini call.
+
+    Returns the recognition fields plus ``prompt_text``, or None when the
+    response fails validation so the caller can fall back to the two-call path.
+    """
+    with fused_stats_lock:
+        fused_stats['calls'] += 1
+    try:
+        resp = generate_image_content(build_fused_payload, image_bytes, filename, prompt_type, output_lang, creative_mode, include_ending, user_context)
+        result = parse_json_response(resp.json())
+    except Exception as e:
+        result = None
+    return validate_fused_result(result, prompt_type, include_ending)
+
+
+def time_to_chinese(tstr):
+    if not tstr or ':' not in tstr:
+        return ''
+    h, m = tstr.split(':')
+    h = int(h)
+    if 5 <= h < 8:
+        return '黎明'
+    elif 8 <= h < 12:
+        return '上午'
+    elif 12 <= h < 13:
+        return '中午'
+    elif 13 <= h < 17:
+        return '下午'
+    elif 17 <= h < 19:
+        return '傍晚'
+    elif 19 <= h < 23:
+        return '晚上'
+    elif h == 0:
+        return '午夜'
+    elif 23 <= h < 24:
+        return '深夜'
+    else:
+        return ''
+
+
+def build_rewrite_payload(prompt_json_for_gemini, output_lang, creative_mode):
+    """Build the generateContent payload that turns the prompt JSON into prose."""
+    templates = get_template_registry()
+    prompt_for_gemini = templates.rewrite(json.dumps(prompt_json_for_gemini, ensure_ascii=False), output_lang, creative_mode)
+
+    # Add system instruction to enforce language output
+    system_instruction = templates.system_instruction(output_lang)
+
+    payload = {
+        "contents": [
+            {
+                "parts": [
+                    {"text": prompt_for_gemini}
+                ]
+            }
+        ]
+    }
+
+    # Add system instruction if needed
+    if system_instruction:
+        payload["systemInstruction"] = {
+            "parts": [
+                {"text": system_instruction}
+            ]
+        }
+    return payload
+
+
+def rewrite_prompt(prompt_json_for_gemini, output_lang, creative_mode):
+    """Ask Gemini to rewrite the prompt JSON as fluent prose; returns '' on failure."""
+    payload = build_rewrite_payload(prompt_json_for_gemini, output_lang, creative_mode)
+    resp2 = get_gemini_client().generate_content(payload)
+    try:
+        resp2_json = resp2.json()
+        prompt_text = resp2_json['candidates'][0]['content']['parts'][0]['text']
+
+        # Debug logging to track API response
+        logger = logging.getLogger(__name__)
+        logger.info(f"Gemini API Request - Language: {output_lang}")
+        logger.info(f"Gemini API Request Prompt: {payload['contents'][0]['parts'][0]['text'][:200]}...")
+        logger.info(f"Gemini API Response: {prompt_text[:200]}...")
+
+    except Exception as e:
+        logger = logging.getLogger(__name__)
+        logger.error(f"Gemini API Error: {str(e)}")
+        logger.error(f"API Response: {resp2.text if resp2 else 'No response'}")
+        prompt_text = ''
+    return prompt_text
+
+
+def build_enhance_payload(user_input_text, prompt_type, output_lang, creative_mode, include_ending, multiple_scenes):
+    """Build the generateContent payload that expands text-only user inputs into the prompt JSON fields."""
+    enhance_prompt = get_template_registry().enhance(user_input_text, output_lang, prompt_type, creative_mode, include_ending, multiple_scenes)
+
+    payload = {
+        "contents": [
+            {
+                "parts": [
+                    {"text": enhance_prompt}
+                ]
+            }
+        ],
+        "generationConfig": json_generation_config(prompt_fields(prompt_type, include_ending))
+    }
+    return payload
+
+
+def enhance_inputs(user_input_text, prompt_type, output_lang, creative_mode, include_ending, multiple_scenes):
+    """Ask Gemini to expand text-only user inputs into the prompt JSON fields, or None on failure."""
+    result = None
+    payload = build_enhance_payload(user_input_text, prompt_type, output_lang, creative_mode, include_ending, multiple_scenes)
+    try:
+        resp = get_gemini_client().generate_content(payload)
+        if resp.status_code == 200:
+            result = parse_json_response(resp.json())
+    except Exception as e:
+        # Keep the original result if API call fails
+        pass
+    return result
+
+
+def empty_result(prompt_type):
+    """Blank recognition fields used when Gemini gives no usable answer."""
+    if prompt_type == 'video':
+        return {'Scene': '', 'ambiance_or_mood': '', 'Location': '', 'Visual style': '', 'camera motion': '', 'lighting': '', 'ending': ''}
+    return {'Scene': '', 'ambiance_or_mood': '', 'Location': '', 'Visual style': '', 'lighting': '', 'ending': ''}
+
+
+def enhance_cache_index(output_lang, prompt_type, creative_mode, include_ending, multiple_scenes,
+                        scene, custom_scene, character, custom_character, time):
+    """Semantic cache index for a text-only submission.
+
+    One index per language; the options and the picker values (scene,
+    character, time) must match exactly, so only the free-text extra
+    description is compared by similarity.
+    """
+    return output_lang, make_cache_key(
+        get_template_registry().version, prompt_type, creative_mode, include_ending, multiple_scenes,
+        scene, custom_scene, character, custom_character, time
+    )
+
+
+def user_inputs_result(prompt_type, scene, custom_scene, character, custom_character, time, extra_desc):
+    """Build the starting fields for a text-only submission.
+
+    Returns ``(result, user_input_text)``; ``user_input_text`` is '' when
+    there is nothing for Gemini to enhance.
+    """
+    # Create a more intelligent user input result
+    user_scene = scene if scene != '其它' else custom_scene
+    user_character = character if character != '其它' else custom_character
+
+    # Build result based on available user inputs
+    result = {
+        'Scene': user_scene if user_scene and user_scene != '其它' else '',
+        'ambiance_or_mood': '',  # Will be inferred by Gemini based on other inputs
+        'Location': user_scene if user_scene and user_scene != '其它' else '',  # Use scene as location if provided
+        'Visual style': '',  # Will be inferred
+        'camera motion': get_default_camera_motion(prompt_type, user_scene, user_character) if prompt_type == 'video' else '',
+        'lighting': '',  # Will be inferred
+        'ending': ''  # Will be inferred
+    }
+
+    user_input_text = ''
+    if any([user_scene, user_character, extra_desc, time]):
+        # Create a prompt for Gemini to enhance user inputs
+        user_inputs = []
+        if user_scene: user_inputs.append(f"場景: {user_scene}")
+        if user_character: user_inputs.append(f"主角: {user_character}")
+        if time: user_inputs.append(f"時間: {time}")
+        if extra_desc: user_inputs.append(f"額外描述: {extra_desc}")
+        user_input_text = ", ".join(user_inputs)
+    return result, user_input_text
+
+
+def fused_user_context(prompt_type, time, character, custom_character, extra_desc):
+    """User details the fused recognition call needs to write the Complete Prompt."""
+    main_character = character if character != '其它' else custom_character
+    return {
+        'type': prompt_type,
+        'time': time_to_chinese(time) or time or '',
+        'main_character': '' if main_character == '用戶自定' else (main_character or ''),
+        'extra_desc': extra_desc or ''
+    }
+
+
+def compose_prompt_json(result, prompt_type, time, character, custom_character, extra_desc, include_ending):
+    """Merge Gemini's fields with the user's selections into the prompt JSON."""
+    # 確保 result 總是有預設值，防止 KeyError
+    if result is None:
+        result = {
+            'Scene': '',
+            'ambiance_or_mood': '',
+            'Location': '',
+            'Visual style': '',
+            'camera motion': '',
+            'lighting': '',
+            'ending': ''
+        }
+
+    # 確保 result 包含所有必要的鍵
+    default_keys = ['Scene', 'ambiance_or_mood', 'Location', 'Visual style', 'camera motion', 'lighting']
+    if include_ending:
+        default_keys.append('ending')
+    for key in default_keys:
+        if key not in result:
+            result[key] = ''
+
+    # 整合用戶選擇
+    main_character = character if character != '其它' else custom_character
+    def skip_custom(val):
+        return '' if val == '用戶自定' else val
+    def infer_or_value(val, field_name):
+        return val if val else ''
+    def safe_get(dictionary, key, default=''):
+        """安全地從字典獲取值，避免 KeyError"""
+        return dictionary.get(key, default) if dictionary else default
+
+    prompt_json = {
+        'Scene': infer_or_value(skip_custom(safe_get(result, 'Scene')), 'Scene'),
+        'ambiance_or_mood': infer_or_value(skip_custom(safe_get(result, 'ambiance_or_mood')), 'ambiance_or_mood'),
+        'Location': infer_or_value(skip_custom(safe_get(result, 'Location')), 'Location'),
+        'Visual style': infer_or_value(skip_custom(safe_get(result, 'Visual style')), 'Visual style'),
+        'lighting': infer_or_value(skip_custom(safe_get(result, 'lighting')), 'lighting'),
+        'type': infer_or_value(prompt_type, 'type'),
+        'time': infer_or_value(time, 'time'),
+        'main_character': infer_or_value(skip_custom(main_character), 'main_character'),
+        'extra_desc': infer_or_value(extra_desc, 'extra_desc')
+    }
+
+    # Only add ending if user requested it
+    if include_ending:
+        prompt_json['ending'] = infer_or_value(skip_custom(safe_get(result, 'ending')), 'ending')
+
+    # Only add camera motion for video prompts
+    if prompt_type == 'video':
+        prompt_json['camera motion'] = infer_or_value(skip_custom(safe_get(result, 'camera motion')), 'camera motion')
+    return prompt_json
+
+
+def rewrite_input(prompt_json):
+    """Copy of the prompt JSON sent for the prose rewrite, with the time as a time of day."""
+    zh_time = time_to_chinese(prompt_json.get('time'))
+    prompt_json_for_gemini = dict(prompt_json)
+    if zh_time:
+        prompt_json_for_gemini['time'] = zh_time
+    return prompt_json_for_gemini
+
+
+def is_all_infer_or_default(j):
+    if not j:
+        return True
+
+    # Define infer keys based on prompt type and user preferences
+    base_infer_keys = [
+        'Scene', 'ambiance_or_mood', 'Location', 'Visual style', 'lighting', 'main_character', 'extra_desc'
+    ]
+
+    # Add ending only if user requested it
+    if 'ending' in j:
+        base_infer_keys.append('ending')
+
+    # Add camera motion only for video prompts
+    infer_keys = base_infer_keys.copy()
+    if j.get('type') == 'video':
+        infer_keys.append('camera motion')
+
+    for k in infer_keys:
+        v = j.get(k, '')
+        # Convert to string if it's not already, then check
+        if v and isinstance(v, str) and not v.startswith('[Please infer'):
+            return False
+        elif v and not isinstance(v, str):
+            # If it's not a string and not empty, it's valid content
+            return False
+
+    # Check if type and time are default values
+    prompt_type = j.get('type', '')
+    if prompt_type not in ['image', 'video']:
+        return False
+    if j.get('time', '') != '00:00':
+        return False
+    return True
+
+
+def set_prompt_cookies(resp, user_inputs, output_lang_display, bypass_time):
+    """Remember the submitted form values in cookies."""
+    # Only store user input values, not rendered content
+    if user_inputs['prompt_type'] is not None:
+        resp.set_cookie('prompt_type', user_inputs['prompt_type'])
+    if user_inputs['output_lang'] is not None:
+        resp.set_cookie('output_lang', output_lang_display)
+    if user_inputs['time'] is not None:
+        resp.set_cookie('time', user_inputs['time'])
+    for key in ('scene', 'custom_scene', 'character', 'custom_character', 'extra_desc'):
+        resp.set_cookie(key, user_inputs[key] if user_inputs[key] is not None else '')
+    for key in ('creative_mode', 'include_ending', 'multiple_scenes'):
+        resp.set_cookie(key, 'true' if user_inputs[key] else 'false')
+    resp.set_cookie('bypass_time', str(bypass_time).lower())
+
+
+async def pipeline_gemini_call(job_id, stage, cache, key, parse, build, *args, on_call=None):
+    """Async counterpart of cached_gemini_call used by the prompt pipeline.
+
+    Builds the payload with ``build(*args)`` off the event loop, awaits
+    Gemini within the stage deadline and returns ``parse(response_json)``.
+    Failures and missed deadlines return None, like the synchronous helpers.
+    ``on_call`` runs once per Gemini call actually made (not for cache hits,
+    coalesced callers or the file-reference retry).
+    """
+    pipeline = get_prompt_pipeline()
+    if cache is not None:
+        value = await pipeline.run_blocking(cache.get, key)
+        if value is not None:
+            return value
+
+    async def call():
+        if on_call is not None:
+            on_call()
+        payload = await pipeline.run_blocking(build, *args)
+        try:
+            response_json = await pipeline.generate_content(payload)
+        except Exception as e:
+            if not uses_file_reference(payload) or not file_reference_rejected(getattr(e, 'response', None)):
+                raise
+            # Stale Files API reference: upload the image again and retry once
+            payload = await pipeline.run_blocking(functools.partial(build, *args, reupload=True))
+            response_json = await pipeline.generate_content(payload)
+        value = parse(response_json)
+        if value and cache is not None:
+            await pipeline.run_blocking(cache.set, key, value)
+        return value
+
+    try:
+        return await pipeline.stage(job_id, stage, pipeline.coalesce(f"{stage}:{key}", call), PIPELINE_DEADLINES[stage])
+    except Exception as e:
+        logger = logging.getLogger(__name__)
+        logger.warning("Prompt pipeline %s stage failed for job %s: %s", stage, job_id, e)
+        return None
+
+
+async def log_prompt_async(user_inputs, prompt_text, prompt_json, image_path, client_ip, user_agent):
+    """Look up the client location and append the interaction log without blocking a job."""
+    pipeline = get_prompt_pipeline()
+    try:
+        data = await asyncio.wait_for(pipeline.get_json(f'http://ip-api.com/json/{client_ip}'), PIPELINE_DEADLINES['geolocation'])
+        location_info = parse_location(data)
+    except Exception as e:
+        location_info = parse_location(None)
+    try:
+        await pipeline.run_blocking(
+            log_user_interaction, user_inputs, prompt_text, prompt_json, image_path, None,
+            client_ip, location_info, user_agent
+        )
+    except RuntimeError:
+        # Executor already shut down (interpreter exiting)
+        pass
+
+
+async def generate_prompt_async(job_id, inputs):
+    """Run the index() prompt flow on the pipeline loop and return what /prompt_job renders."""
+    pipeline = get_prompt_pipeline()
+    prompt_type = inputs['prompt_type']
+    output_lang = inputs['output_lang']
+    creative_mode = inputs['creative_mode']
+    include_ending = inputs['include_ending']
+    multiple_scenes = inputs['multiple_scenes']
+    time = inputs['time']
+    extra_desc = inputs['extra_desc']
+    image_bytes = inputs['image_bytes']
+    fused_prompt_text = None
+
+    if image_bytes:
+        image_hash = hashlib.sha256(image_bytes).hexdigest()
+        result = None
+        if GEMINI_FUSED_MODE:
+            user_context = fused_user_context(prompt_type, time, inputs['character'], inputs['custom_character'], extra_desc)
+            fused_key = make_cache_key('fused', get_template_registry().version, image_hash, prompt_type, output_lang, creative_mode, include_ending, user_context)
+
+            def count_fused_call():
+                with fused_stats_lock:
+                    fused_stats['calls'] += 1
+
+            fused = await pipeline_gemini_call(
+                job_id, 'recognition', recognition_cache, fused_key,
+                lambda r: validate_fused_result(parse_json_response(r), prompt_type, include_ending),
+                build_fused_payload, image_bytes, inputs['filename'], prompt_type, output_lang, creative_mode, include_ending, user_context,
+                on_call=count_fused_call
+            )
+            if fused:
+                fused_prompt_text = fused.pop('prompt_text')
+                result = fused
+        if result is None:
+            recognition_key = make_cache_key(get_template_registry().version, image_hash, prompt_type, output_lang, creative_mode, include_ending)
+            result = await pipeline_gemini_call(
+                job_id, 'recognition', recognition_cache, recognition_key, parse_json_response,
+                build_recognition_payload, image_bytes, inputs['filename'], prompt_type, output_lang, creative_mode, include_ending
+            )
+        if not result:
+            result = empty_result(prompt_type)
+    else:
+        result, user_input_text = user_inputs_result(
+            prompt_type, inputs['scene'], inputs['custom_scene'], inputs['character'], inputs['custom_character'], time, extra_desc
+        )
+        if user_input_text:
+            enhance_index = enhance_cache_index(
+                output_lang, prompt_type, creative_mode, include_ending, multiple_scenes,
+                inputs['scene'], inputs['custom_scene'], inputs['character'], inputs['custom_character'], time
+            )
+            # The semantic cache embeds and scores under a lock, so it runs off the loop like the other caches
+            enhanced_result = await pipeline.run_blocking(enhance_cache.get, enhance_index, extra_desc) if enhance_cache else None
+            if enhanced_result is None:
+                enhance_key = make_cache_key(get_template_registry().version, user_input_text, prompt_type, output_lang, creative_mode, include_ending, multiple_scenes)
+                enhanced_result = await pipeline_gemini_call(
+                    job_id, 'recognition', None, enhance_key, parse_json_response,
+                    build_enhance_payload, user_input_text, prompt_type, output_lang, creative_mode, include_ending, multiple_scenes
+                )
+                if enhanced_result and enhance_cache:
+                    await pipeline.run_blocking(enhance_cache.set, enhance_index, extra_desc, enhanced_result)
+            if enhanced_result:
+                result = enhanced_result
+
+    prompt_json = compose_prompt_json(result, prompt_type, time, inputs['character'], inputs['custom_character'], extra_desc, include_ending)
+    prompt_json_for_gemini = rewrite_input(prompt_json)
+    rewrite_key = make_cache_key(get_template_registry().version, prompt_json_for_gemini, output_lang, creative_mode)
+    stream_id = None
+    prompt_text = await pipeline.run_blocking(rewrite_cache.get, rewrite_key)
+    if fused_prompt_text:
+        prompt_text = fused_prompt_text
+        await pipeline.run_blocking(rewrite_cache.set, rewrite_key, prompt_text)
+    elif prompt_text is None and inputs['stream']:
+        stream_id = await pipeline.run_blocking(
+            register_prompt_stream, build_rewrite_payload(prompt_json_for_gemini, output_lang, creative_mode), rewrite_key
+        )
+        prompt_text = ''
+    elif prompt_text is None:
+        prompt_text = await pipeline_gemini_call(
+            job_id, 'rewrite', rewrite_cache, rewrite_key, response_text,
+            build_rewrite_payload, prompt_json_for_gemini, output_lang, creative_mode
+        ) or ''
+
+    valid_json = prompt_json and not is_all_infer_or_default(prompt_json)
+    user_inputs = {key: inputs[key] for key in (
+        'prompt_type', 'output_lang', 'time', 'scene', 'custom_scene', 'character',
+        'custom_character', 'extra_desc', 'creative_mode', 'include_ending', 'multiple_scenes'
+    )}
+    if prompt_text or prompt_json:
+        pipeline.spawn(log_prompt_async(user_inputs, prompt_text, prompt_json, inputs['image_path'], inputs['client_ip'], inputs['user_agent']))
+    return {
+        'prompt_text': prompt_text,
+        'prompt_json': prompt_json,
+        'prompt_json_str': json.dumps(prompt_json, ensure_ascii=False, indent=2) if valid_json else '',
+        'image_url': inputs['image_url'],
+        'stream_id': stream_id
+    }
+
+
 @app.route('/', methods=['GET', 'POST'])
 def index():
     # Initialize variables
@@ -310,6 +1132,8 @@ def index():
     image_path = None
     file = None
     generated_images = None
+    prompt_stream_url = None
+    fused_prompt_text = None
     
 
     
@@ -403,422 +1227,108 @@ def index():
                     image_url = url_for('uploaded_file', filename=filename)
                 image_filename = filename
 
+        # Hand the Gemini work to the asyncio pipeline and return a job handle
+        if (PROMPT_PIPELINE_ENABLED and request.form.get('async') == 'true'
+                and request.headers.get('X-Requested-With') == 'XMLHttpRequest'):
+            image_bytes = None
+            if image_path:
+                with open(image_path, "rb") as f:
+                    image_bytes = f.read()
+            inputs = dict(
+                image_bytes=image_bytes, filename=image_filename, image_path=image_path, image_url=image_url,
+                prompt_type=prompt_type, output_lang=output_lang, time=time, scene=scene,
+                custom_scene=custom_scene, character=character, custom_character=custom_character,
+                extra_desc=extra_desc, creative_mode=creative_mode, include_ending=include_ending,
+                multiple_scenes=multiple_scenes, stream=request.form.get('stream') == 'true',
+                client_ip=get_client_ip(), user_agent=request.headers.get('User-Agent', 'Unknown')
+            )
+            job_id = get_prompt_pipeline().submit(generate_prompt_async, inputs)
+            resp = make_response(jsonify({
+                'job_id': job_id,
+                'status_url': url_for('prompt_job_status', job_id=job_id)
+            }), 202)
+            set_prompt_cookies(resp, inputs, output_lang_display, bypass_time)
+            return resp
+
         # 圖片識別（Gemini 2.0 Flash HTTP API）
         if image_path:
-            api_key = os.getenv('GEMINI_API_KEY', 'YOUR_API_KEY')
-            url = "https://generativelanguage.googleapis.com/v1beta/models/gemini-2.0-flash:generateContent"
             with open(image_path, "rb") as f:
-                img_b64 = base64.b64encode(f.read()).decode()
-            
-            # Get appropriate MIME type for the uploaded file
-            mime_type = get_image_mime_type(filename)
-            # 根據 output_lang 設定 prompt 語言
-            lang_map = {
-                'en': 'English',
-                'zh-TW': 'Traditional Chinese',
-                'zh-CN': 'Simplified Chinese'
-            }
-            prompt_lang = lang_map.get(output_lang, 'English')
-            # Language-specific prompts for image recognition
-            if output_lang == 'en':
-                if prompt_type == 'video':
-                    if creative_mode:
-                        prompt_text_recog = f"Please analyze this image in detail and output video content in JSON format: Scene, ambiance_or_mood, Location, Visual style, camera motion, lighting{', ending' if include_ending else ''}. Creative Mode: Be highly creative, artistic, and experimental. For 'camera motion', suggest bold, innovative, and cinematic camera movements that push creative boundaries (e.g., 'surreal spiral descent around subject', 'time-delayed tracking through ethereal space', 'anti-gravity orbital shot', 'dreamlike morphing perspective', 'kaleidoscopic rotation sequence', 'poetic flowing transition'). Make the visuals stunning and emotionally powerful. All responses must be in {prompt_lang}."
-                    else:
-                        prompt_text_recog = f"Please analyze this image in detail and output video content in JSON format: Scene, ambiance_or_mood, Location, Visual style, camera motion, lighting{', ending' if include_ending else ''}. For 'camera motion', suggest creative and cinematic camera movements based on the scene (e.g., tracking shot, crane movement, handheld intimacy, aerial shot, push-pull shot, dolly movement, rotation, etc.). All responses must be in {prompt_lang}."
-                else:
-                    if creative_mode:
-                        prompt_text_recog = f"Please analyze this image in detail and output in JSON format: Scene, ambiance_or_mood, Location, Visual style, lighting{', ending' if include_ending else ''}. Creative Mode: Be highly artistic, experimental, and imaginative. Push creative boundaries with bold visual concepts, unconventional perspectives, and innovative storytelling approaches. All responses must be in {prompt_lang}."
-                    else:
-                        prompt_text_recog = f"Please analyze this image in detail and output in JSON format: Scene, ambiance_or_mood, Location, Visual style, lighting{', ending' if include_ending else ''}. All responses must be in {prompt_lang}."
-            elif output_lang == 'zh-CN':
-                if prompt_type == 'video':
-                    if creative_mode:
-                        prompt_text_recog = f"请详细识别这张图片，并以 json 格式输出视频内容：Scene、ambiance_or_mood、Location、Visual style、camera motion、lighting{'、ending' if include_ending else ''}。创意模式：请极具创意、艺术性和实验性。对于 'camera motion'，请建议大胆、创新且具电影感的摄影机运动，突破创意界限（例如：'围绕主体的超现实螺旋下降'、'穿越飘渺空间的时间延迟追踪'、'反重力轨道镜头'、'梦幻般的变形视角'、'万花筒式旋转序列'、'诗意流动转场'）。让画面视觉震撼且情感强烈。所有回应内容一律使用{prompt_lang}。"
-                    else:
-                        prompt_text_recog = f"请详细识别这张图片，并以 json 格式输出视频内容：Scene、ambiance_or_mood、Location、Visual style、camera motion、lighting{'、ending' if include_ending else ''}。对于 'camera motion'，请根据场景建议富有创意和电影感的摄影机运动（例如：追踪镜头、升降运动、手持亲密感、空拍镜头、推拉镜头、移动推轨、旋转等）。所有回应内容一律使用{prompt_lang}。"
-                else:
-                    if creative_mode:
-                        prompt_text_recog = f"请详细识别这张图片，并以 json 格式输出：Scene、ambiance_or_mood、Location、Visual style、lighting{'、ending' if include_ending else ''}。创意模式：请极具艺术性、实验性和想象力。以大胆的视觉概念、非传统的视角和创新的故事叙述方式突破创意界限。所有回应内容一律使用{prompt_lang}。"
-                    else:
-                        prompt_text_recog = f"请详细识别这张图片，并以 json 格式输出：Scene、ambiance_or_mood、Location、Visual style、lighting{'、ending' if include_ending else ''}。所有回应内容一律使用{prompt_lang}。"
-            else:  # zh-TW and other languages
-                if prompt_type == 'video':
-                    if creative_mode:
-                        prompt_text_recog = f"請詳細識別這張圖片，並以 json 格式輸出影片內容：Scene、ambiance_or_mood、Location、Visual style、camera motion、lighting{'、ending' if include_ending else ''}。創意模式：請極具創意、藝術性和實驗性。對於 'camera motion'，請建議大膽、創新且具電影感的攝影機運動，突破創意界限（例如：'圍繞主體的超現實螺旋下降'、'穿越飄渺空間的時間延遲追蹤'、'反重力軌道鏡頭'、'夢幻般的變形視角'、'萬花筒式旋轉序列'、'詩意流動轉場'）。讓畫面視覺震撼且情感強烈。所有回應內容一律使用{prompt_lang}。"
-                    else:
-                        prompt_text_recog = f"請詳細識別這張圖片，並以 json 格式輸出影片內容：Scene、ambiance_or_mood、Location、Visual style、camera motion、lighting{'、ending' if include_ending else ''}。對於 'camera motion'，請根據場景建議富有創意和電影感的攝影機運動（例如：追蹤鏡頭、升降運動、手持親密感、空拍鏡頭、推拉鏡頭、移動推軌、旋轉等）。所有回應內容一律使用{prompt_lang}。"
-                else:
-                    if creative_mode:
-                        prompt_text_recog = f"請詳細識別這張圖片，並以 json 格式輸出：Scene、ambiance_or_mood、Location、Visual style、lighting{'、ending' if include_ending else ''}。創意模式：請極具藝術性、實驗性和想像力。以大膽的視覺概念、非傳統的視角和創新的故事敘述方式突破創意界限。所有回應內容一律使用{prompt_lang}。"
-                    else:
-                        prompt_text_recog = f"請詳細識別這張圖片，並以 json 格式輸出：Scene、ambiance_or_mood、Location、Visual style、lighting{'、ending' if include_ending else ''}。所有回應內容一律使用{prompt_lang}。"
-            payload = {
-                "contents": [
-                    {
-                        "parts": [
-                            {"text": prompt_text_recog},
-                            {"inline_data": {"mime_type": mime_type, "data": img_b64}}
-                        ]
-                    }
-                ]
-            }
-            headers = {
-                "Content-Type": "application/json",
-                "X-goog-api-key": api_key
-            }
-            resp = requests.post(url, json=payload, headers=headers)
-            import re, json as pyjson
-            try:
-                resp_json = resp.json()
-                text = resp_json['candidates'][0]['content']['parts'][0]['text']
-            except Exception as e:
-                text = ''
-            match = re.search(r'\{[\s\S]*\}', text)
-            if match:
-                try:
-                    parsed_result = pyjson.loads(match.group())
-                    # Extract the content from nested structure if present
-                    if 'VIDEO' in parsed_result:
-                        result = parsed_result['VIDEO']
-                    elif 'IMAGE' in parsed_result:
-                        result = parsed_result['IMAGE']
-                    else:
-                        result = parsed_result
-                except Exception as e:
-                    result = None
-            else:
-                result = None
+                image_bytes = f.read()
+
+            # Identical photo + options: reuse the previous recognition result
+            image_hash = hashlib.sha256(image_bytes).hexdigest()
+            result = None
+            if GEMINI_FUSED_MODE:
+                # The prose depends on the user's details too, so they are part of the key
+                user_context = fused_user_context(prompt_type, time, character, custom_character, extra_desc)
+                fused_key = make_cache_key('fused', get_template_registry().version, image_hash, prompt_type, output_lang, creative_mode, include_ending, user_context)
+                fused = cached_gemini_call(
+                    'fused', recognition_cache, fused_key,
+                    lambda: recognize_and_rewrite(image_bytes, filename, prompt_type, output_lang, creative_mode, include_ending, user_context)
+                )
+                if fused:
+                    fused_prompt_text = fused.pop('prompt_text')
+                    result = fused
+            if result is None:
+                recognition_key = make_cache_key(get_template_registry().version, image_hash, prompt_type, output_lang, creative_mode, include_ending)
+                result = cached_gemini_call(
+                    'recognition', recognition_cache, recognition_key,
+                    lambda: recognize_image(image_bytes, filename, prompt_type, output_lang, creative_mode, include_ending)
+                )
             # 若 result 為 None，則用空欄位
             if not result:
-                if prompt_type == 'video':
-                    result = {'Scene': '', 'ambiance_or_mood': '', 'Location': '', 'Visual style': '', 'camera motion': '', 'lighting': '', 'ending': ''}
-                else:
-                    result = {'Scene': '', 'ambiance_or_mood': '', 'Location': '', 'Visual style': '', 'lighting': '', 'ending': ''}
+                result = empty_result(prompt_type)
         else:
-            # Create a more intelligent user input result
-            user_scene = scene if scene != '其它' else custom_scene
-            user_character = character if character != '其它' else custom_character
-            
-            # Build result based on available user inputs
-            result = {
-                'Scene': user_scene if user_scene and user_scene != '其它' else '',
-                'ambiance_or_mood': '',  # Will be inferred by Gemini based on other inputs
-                'Location': user_scene if user_scene and user_scene != '其它' else '',  # Use scene as location if provided
-                'Visual style': '',  # Will be inferred
-                'camera motion': get_default_camera_motion(prompt_type, user_scene, user_character) if prompt_type == 'video' else '',
-                'lighting': '',  # Will be inferred
-                'ending': ''  # Will be inferred
-            }
-            
+            result, user_input_text = user_inputs_result(prompt_type, scene, custom_scene, character, custom_character, time, extra_desc)
+
             # If we have meaningful user inputs, let Gemini fill in the gaps
-            if any([user_scene, user_character, extra_desc, time]):
-                # Create a prompt for Gemini to enhance user inputs
-                user_inputs = []
-                if user_scene: user_inputs.append(f"場景: {user_scene}")
-                if user_character: user_inputs.append(f"主角: {user_character}")
-                if time: user_inputs.append(f"時間: {time}")
-                if extra_desc: user_inputs.append(f"額外描述: {extra_desc}")
-                
-                user_input_text = ", ".join(user_inputs)
-                
-                # Enhance the user inputs
-                api_key = os.getenv('GEMINI_API_KEY', 'YOUR_API_KEY')
-                url = "https://generativelanguage.googleapis.com/v1beta/models/gemini-2.0-flash:generateContent"
-                
-                # Language mapping for enhancement prompt
-                lang_map = {
-                    'en': 'English',
-                    'zh-TW': 'Traditional Chinese',
-                    'zh-CN': 'Simplified Chinese'
-                }
-                prompt_lang = lang_map.get(output_lang, 'English')
-                
-                if output_lang == 'en':
-                    if prompt_type == 'video':
-                        if creative_mode:
-                            scene_instruction = "Create MULTIPLE connected scenes in a sequence" if multiple_scenes else "Create ONE single scene only"
-                            enhance_prompt = f"Based on these user inputs: {user_input_text}, please create a detailed JSON for VIDEO content with the following fields: Scene, ambiance_or_mood, Location, Visual style, camera motion, lighting{', ending' if include_ending else ''}. IMPORTANT: {scene_instruction}. For 'camera motion', choose ONLY ONE specific camera movement - do not combine multiple shots. Create ONE BOLD, IMAGINATIVE, and UNCONVENTIONAL camera movement that pushes creative boundaries (e.g., 'surreal floating through impossible geometries' OR 'time-warped spiral dance around emotions' OR 'gravity-defying liquid mercury flows' OR 'dream-logic perspective morphing' - pick just ONE). Make it visually stunning, emotionally powerful, and artistically groundbreaking. Output in {prompt_lang} and format as valid JSON only."
-                        else:
-                            scene_instruction = "Create MULTIPLE connected scenes in a sequence" if multiple_scenes else "Create ONE single scene only"
-                            enhance_prompt = f"Based on these user inputs: {user_input_text}, please create a detailed JSON for VIDEO content with the following fields: Scene, ambiance_or_mood, Location, Visual style, camera motion, lighting{', ending' if include_ending else ''}. IMPORTANT: {scene_instruction}. For 'camera motion', choose ONLY ONE specific camera movement - do not combine multiple shots. Create ONE CREATIVE and CINEMATIC camera movement that enhances the storytelling (e.g., 'smooth tracking shot following the subject' OR 'dramatic crane shot revealing the landscape' OR 'intimate handheld close-up' OR 'sweeping drone shot' - pick just ONE). Make the camera motion specific, cinematic, and emotionally engaging. Output in {prompt_lang} and format as valid JSON only."
-                    else:
-                        if creative_mode:
-                            scene_instruction = "Create MULTIPLE connected scenes in a sequence" if multiple_scenes else "Create ONE single scene only"
-                            enhance_prompt = f"Based on these user inputs: {user_input_text}, please create a detailed JSON with the following fields: Scene, ambiance_or_mood, Location, Visual style, lighting{', ending' if include_ending else ''}. IMPORTANT: {scene_instruction}. CREATIVE MODE: Be highly artistic, experimental, and imaginative. Push creative boundaries with bold visual concepts, unconventional perspectives, surreal elements, and innovative storytelling approaches. Fill in missing fields with groundbreaking creative details. Output in {prompt_lang} and format as valid JSON only."
-                        else:
-                            scene_instruction = "Create MULTIPLE connected scenes in a sequence" if multiple_scenes else "Create ONE single scene only"
-                            enhance_prompt = f"Based on these user inputs: {user_input_text}, please create a detailed JSON with the following fields: Scene, ambiance_or_mood, Location, Visual style, lighting{', ending' if include_ending else ''}. IMPORTANT: {scene_instruction}. Fill in creative and appropriate details for missing fields. Output in {prompt_lang} and format as valid JSON only."
-                elif output_lang == 'zh-CN':
-                    if prompt_type == 'video':
-                        if creative_mode:
-                            scene_instruction = "创建多个连续场景序列" if multiple_scenes else "只创建单一场景"
-                            enhance_prompt = f"根据这些用户输入: {user_input_text}，请创建一个专为视频内容设计的详细 JSON，包含以下栏位：Scene、ambiance_or_mood、Location、Visual style、camera motion、lighting{'、ending' if include_ending else ''}。重要：{scene_instruction}。对于 'camera motion' 栏位，请只选择一种特定的摄影机运动 - 不要组合多个镜头。创造一个大胆、富有想象力且非传统的摄影机运动，突破创意界限（例如：'穿越不可能几何体的超现实漂浮' 或 '围绕情感的时间扭曲螺旋舞蹈' 或 '反重力液态水银流动' 或 '梦境逻辑视角变形' - 只选择其中一种）。让它视觉震撼、情感强烈且艺术性突破。请用{prompt_lang}回应，并只输出有效的 JSON 格式。"
-                        else:
-                            scene_instruction = "创建多个连续场景序列" if multiple_scenes else "只创建单一场景"
-                            enhance_prompt = f"根据这些用户输入: {user_input_text}，请创建一个专为视频内容设计的详细 JSON，包含以下栏位：Scene、ambiance_or_mood、Location、Visual style、camera motion、lighting{'、ending' if include_ending else ''}。重要：{scene_instruction}。对于 'camera motion' 栏位，请只选择一种特定的摄影机运动 - 不要组合多个镜头。创造一个富有创意和电影感的摄影机运动，增强故事叙述效果（例如：'平滑追踪镜头跟随主体' 或 '戏剧性升降镜头展现风景' 或 '亲密手持特写' 或 '扫描式空拍镜头' - 只选择其中一种）。让摄影机运动具体、有电影感且富有情感张力。请用{prompt_lang}回应，并只输出有效的 JSON 格式。"
-                    else:
-                        if creative_mode:
-                            scene_instruction = "创建多个连续场景序列" if multiple_scenes else "只创建单一场景"
-                            enhance_prompt = f"根据这些用户输入: {user_input_text}，请创建一个详细的 JSON，包含以下栏位：Scene、ambiance_or_mood、Location、Visual style、lighting{'、ending' if include_ending else ''}。重要：{scene_instruction}。创意模式：请极具艺术性、实验性和想象力。以大胆的视觉概念、非传统的视角、超现实元素和创新的故事叙述方式突破创意界限。为缺少的栏位填入突破性的创意细节。请用{prompt_lang}回应，并只输出有效的 JSON 格式。"
-                        else:
-                            scene_instruction = "创建多个连续场景序列" if multiple_scenes else "只创建单一场景"
-                            enhance_prompt = f"根据这些用户输入: {user_input_text}，请创建一个详细的 JSON，包含以下栏位：Scene、ambiance_or_mood、Location、Visual style、lighting{'、ending' if include_ending else ''}。重要：{scene_instruction}。为缺少的栏位填入富有创意且合适的细节。请用{prompt_lang}回应，并只输出有效的 JSON 格式。"
-                else:  # zh-TW and other languages
-                    if prompt_type == 'video':
-                        if creative_mode:
-                            scene_instruction = "創建多個連續場景序列" if multiple_scenes else "只創建單一場景"
-                            enhance_prompt = f"根據這些用戶輸入: {user_input_text}，請創建一個專為影片內容設計的詳細 JSON，包含以下欄位：Scene、ambiance_or_mood、Location、Visual style、camera motion、lighting{'、ending' if include_ending else ''}。重要：{scene_instruction}。對於 'camera motion' 欄位，請只選擇一種特定的攝影機運動 - 不要組合多個鏡頭。創造一個大膽、富有想像力且非傳統的攝影機運動，突破創意界限（例如：'穿越不可能幾何體的超現實漂浮' 或 '圍繞情感的時間扭曲螺旋舞蹈' 或 '反重力液態水銀流動' 或 '夢境邏輯視角變形' - 只選擇其中一種）。讓它視覺震撼、情感強烈且藝術性突破。請用{prompt_lang}回應，並只輸出有效的 JSON 格式。"
-                        else:
-                            scene_instruction = "創建多個連續場景序列" if multiple_scenes else "只創建單一場景"
-                            enhance_prompt = f"根據這些用戶輸入: {user_input_text}，請創建一個專為影片內容設計的詳細 JSON，包含以下欄位：Scene、ambiance_or_mood、Location、Visual style、camera motion、lighting{'、ending' if include_ending else ''}。重要：{scene_instruction}。對於 'camera motion' 欄位，請只選擇一種特定的攝影機運動 - 不要組合多個鏡頭。創造一個富有創意和電影感的攝影機運動，增強故事敘述效果（例如：'平滑追蹤鏡頭跟隨主體' 或 '戲劇性升降鏡頭展現風景' 或 '親密手持特寫' 或 '掃描式空拍鏡頭' - 只選擇其中一種）。讓攝影機運動具體、有電影感且富有情感張力。請用{prompt_lang}回應，並只輸出有效的 JSON 格式。"
-                    else:
-                        if creative_mode:
-                            scene_instruction = "創建多個連續場景序列" if multiple_scenes else "只創建單一場景"
-                            enhance_prompt = f"根據這些用戶輸入: {user_input_text}，請創建一個詳細的 JSON，包含以下欄位：Scene、ambiance_or_mood、Location、Visual style、lighting{'、ending' if include_ending else ''}。重要：{scene_instruction}。創意模式：請極具藝術性、實驗性和想像力。以大膽的視覺概念、非傳統的視角、超現實元素和創新的故事敘述方式突破創意界限。為缺少的欄位填入突破性的創意細節。請用{prompt_lang}回應，並只輸出有效的 JSON 格式。"
-                        else:
-                            scene_instruction = "創建多個連續場景序列" if multiple_scenes else "只創建單一場景"
-                            enhance_prompt = f"根據這些用戶輸入: {user_input_text}，請創建一個詳細的 JSON，包含以下欄位：Scene、ambiance_or_mood、Location、Visual style、lighting{'、ending' if include_ending else ''}。重要：{scene_instruction}。為缺少的欄位填入富有創意且合適的細節。請用{prompt_lang}回應，並只輸出有效的 JSON 格式。"
-                
-                payload = {
-                    "contents": [
-                        {
-                            "parts": [
-                                {"text": enhance_prompt}
-                            ]
-                        }
-                    ]
-                }
-                headers = {
-                    "Content-Type": "application/json",
-                    "X-goog-api-key": api_key
-                }
-                
-                try:
-                    resp = requests.post(url, json=payload, headers=headers)
-                    
-                    if resp.status_code == 200:
-                        import re, json as pyjson
-                        resp_json = resp.json()
-                        text = resp_json['candidates'][0]['content']['parts'][0]['text']
-                        
-                        # Extract JSON from response
-                        match = re.search(r'\{[\s\S]*\}', text)
-                        if match:
-                            try:
-                                enhanced_result = pyjson.loads(match.group())
-                                # Extract the content from nested structure if present
-                                if 'VIDEO' in enhanced_result:
-                                    result = enhanced_result['VIDEO']
-                                elif 'IMAGE' in enhanced_result:
-                                    result = enhanced_result['IMAGE']
-                                else:
-                                    result = enhanced_result
-                            except Exception as e:
-                                # Keep the original result if parsing fails
-                                pass
-                        else:
-                            pass
-                    else:
-                        pass
-                        
-                except Exception as e:
-                    # Keep the original result if API call fails
-                    pass
-        
-        # 確保 result 總是有預設值，防止 KeyError
-        if 'result' not in locals() or result is None:
-            result = {
-                'Scene': '',
-                'ambiance_or_mood': '',
-                'Location': '',
-                'Visual style': '',
-                'camera motion': '',
-                'lighting': '',
-                'ending': ''
-            }
-        
+            if user_input_text:
+                # A near-identical earlier description answers without calling Gemini
+                enhance_index = enhance_cache_index(
+                    output_lang, prompt_type, creative_mode, include_ending, multiple_scenes,
+                    scene, custom_scene, character, custom_character, time
+                )
+                enhanced_result = enhance_cache.get(enhance_index, extra_desc) if enhance_cache else None
+                if enhanced_result is None:
+                    # Enhance the user inputs
+                    enhance_key = make_cache_key(get_template_registry().version, user_input_text, prompt_type, output_lang, creative_mode, include_ending, multiple_scenes)
+                    enhanced_result = cached_gemini_call(
+                        'enhance', None, enhance_key,
+                        lambda: enhance_inputs(user_input_text, prompt_type, output_lang, creative_mode, include_ending, multiple_scenes)
+                    )
+                    if enhanced_result and enhance_cache:
+                        enhance_cache.set(enhance_index, extra_desc, enhanced_result)
+                if enhanced_result:
+                    result = enhanced_result
 
-        
-        # 確保 result 包含所有必要的鍵
-        default_keys = ['Scene', 'ambiance_or_mood', 'Location', 'Visual style', 'camera motion', 'lighting']
-        if include_ending:
-            default_keys.append('ending')
-        for key in default_keys:
-            if key not in result:
-                result[key] = ''
-        
         # 整合用戶選擇
-        main_character = character if character != '其它' else custom_character
-        def skip_custom(val):
-            return '' if val == '用戶自定' else val
-        def infer_or_value(val, field_name):
-            return val if val else ''
-        def safe_get(dictionary, key, default=''):
-            """安全地從字典獲取值，避免 KeyError"""
-            return dictionary.get(key, default) if dictionary else default
-            
-        prompt_json = {
-            'Scene': infer_or_value(skip_custom(safe_get(result, 'Scene')), 'Scene'),
-            'ambiance_or_mood': infer_or_value(skip_custom(safe_get(result, 'ambiance_or_mood')), 'ambiance_or_mood'),
-            'Location': infer_or_value(skip_custom(safe_get(result, 'Location')), 'Location'),
-            'Visual style': infer_or_value(skip_custom(safe_get(result, 'Visual style')), 'Visual style'),
-            'lighting': infer_or_value(skip_custom(safe_get(result, 'lighting')), 'lighting'),
-            'type': infer_or_value(prompt_type, 'type'),
-            'time': infer_or_value(time, 'time'),
-            'main_character': infer_or_value(skip_custom(main_character), 'main_character'),
-            'extra_desc': infer_or_value(extra_desc, 'extra_desc')
-        }
-        
-        # Only add ending if user requested it
-        if include_ending:
-            prompt_json['ending'] = infer_or_value(skip_custom(safe_get(result, 'ending')), 'ending')
-        
-        # Only add camera motion for video prompts
-        if prompt_type == 'video':
-            prompt_json['camera motion'] = infer_or_value(skip_custom(safe_get(result, 'camera motion')), 'camera motion')
-        
+        prompt_json = compose_prompt_json(result, prompt_type, time, character, custom_character, extra_desc, include_ending)
 
         # 重新組合 json 內容為一篇可讀性高的作品
-        def time_to_chinese(tstr):
-            if not tstr or ':' not in tstr:
-                return ''
-            h, m = tstr.split(':')
-            h = int(h)
-            if 5 <= h < 8:
-                return '黎明'
-            elif 8 <= h < 12:
-                return '上午'
-            elif 12 <= h < 13:
-                return '中午'
-            elif 13 <= h < 17:
-                return '下午'
-            elif 17 <= h < 19:
-                return '傍晚'
-            elif 19 <= h < 23:
-                return '晚上'
-            elif h == 0:
-                return '午夜'
-            elif 23 <= h < 24:
-                return '深夜'
-            else:
-                return ''
-
-        import json
-        zh_time = time_to_chinese(prompt_json.get('time'))
-        prompt_json_for_gemini = dict(prompt_json)
-        if zh_time:
-            prompt_json_for_gemini['time'] = zh_time
-        # Gemini prompt 語言 (handle case insensitive)
-        lang_map = {
-            'en': 'English',
-            'zh-TW': 'Traditional Chinese',
-            'zh-CN': 'Simplified Chinese',
-            'zh-tw': 'Traditional Chinese',  # lowercase variant
-            'zh-cn': 'Simplified Chinese'  # lowercase variant
-        }
-        prompt_lang = lang_map.get(output_lang, 'English')
-        if output_lang == 'en':
-            if creative_mode:
-                prompt_for_gemini = f"Please rewrite the following JSON content into a highly readable, natural, and fluent {prompt_lang} description, omitting all field titles and separators, and arranging the order logically. CREATIVE MODE: Use poetic, artistic, and evocative language. Make the description cinematically rich, emotionally engaging, and visually stunning with bold artistic expressions: {json.dumps(prompt_json_for_gemini, ensure_ascii=False)}"
-            else:
-                prompt_for_gemini = f"Please rewrite the following JSON content into a highly readable, natural, and fluent {prompt_lang} description, omitting all field titles and separators, and arranging the order logically: {json.dumps(prompt_json_for_gemini, ensure_ascii=False)}"
-        elif output_lang in ['zh-CN', 'zh-cn']:
-            if creative_mode:
-                prompt_for_gemini = f"请根据以下 json 内容，重新组合成一篇可读性高、自然流畅的{prompt_lang}作品，省略所有栏位标题与分隔符，并根据内容合理安排先后次序。创意模式：使用诗意、艺术性和令人回味的语言。让描述富有电影感、情感丰富且视觉震撼，以大胆的艺术表达呈现。请务必使用简体中文回复，不要使用任何英文单词或短语：{json.dumps(prompt_json_for_gemini, ensure_ascii=False)}"
-            else:
-                prompt_for_gemini = f"请根据以下 json 内容，重新组合成一篇可读性高、自然流畅的{prompt_lang}作品，省略所有栏位标题与分隔符，并根据内容合理安排先后次序。请务必使用简体中文回复，不要使用任何英文单词或短语：{json.dumps(prompt_json_for_gemini, ensure_ascii=False)}"
-        else:  # zh-TW and other languages
-            if creative_mode:
-                prompt_for_gemini = f"請根據以下 json 內容，重新組合成一篇可讀性高、自然流暢的{prompt_lang}作品，省略所有欄位標題與分隔符，並根據內容合理安排先後次序。創意模式：使用詩意、藝術性和令人回味的語言。讓描述富有電影感、情感豐富且視覺震撼，以大膽的藝術表達呈現：{json.dumps(prompt_json_for_gemini, ensure_ascii=False)}"
-            else:
-                prompt_for_gemini = f"請根據以下 json 內容，重新組合成一篇可讀性高、自然流暢的{prompt_lang}作品，省略所有欄位標題與分隔符，並根據內容合理安排先後次序：{json.dumps(prompt_json_for_gemini, ensure_ascii=False)}"
-
-        api_key = os.getenv('GEMINI_API_KEY', 'YOUR_API_KEY')
-        url = "https://generativelanguage.googleapis.com/v1beta/models/gemini-2.0-flash:generateContent"
-        
-        # Add system instruction to enforce language output
-        system_instruction = ""
-        if output_lang in ['zh-CN', 'zh-cn']:
-            system_instruction = "You must respond ONLY in Simplified Chinese (简体中文). Do not use any English words or phrases in your response."
-        elif output_lang in ['zh-TW', 'zh-tw']:
-            system_instruction = "You must respond ONLY in Traditional Chinese (繁體中文). Do not use any English words or phrases in your response."
-        
-        payload = {
-            "contents": [
-                {
-                    "parts": [
-                        {"text": prompt_for_gemini}
-                    ]
-                }
-            ]
-        }
-        
-        # Add system instruction if needed
-        if system_instruction:
-            payload["systemInstruction"] = {
-                "parts": [
-                    {"text": system_instruction}
-                ]
-            }
-        headers = {
-            "Content-Type": "application/json",
-            "X-goog-api-key": api_key
-        }
-        resp2 = requests.post(url, json=payload, headers=headers)
-        try:
-            resp2_json = resp2.json()
-            prompt_text = resp2_json['candidates'][0]['content']['parts'][0]['text']
-            
-            # Debug logging to track API response
-            logger = logging.getLogger(__name__)
-            logger.info(f"Gemini API Request - Language: {output_lang}, Prompt Lang: {prompt_lang}")
-            logger.info(f"Gemini API Request Prompt: {prompt_for_gemini[:200]}...")
-            logger.info(f"Gemini API Response: {prompt_text[:200]}...")
-            
-        except Exception as e:
-            logger = logging.getLogger(__name__)
-            logger.error(f"Gemini API Error: {str(e)}")
-            logger.error(f"API Response: {resp2.text if resp2 else 'No response'}")
+        prompt_json_for_gemini = rewrite_input(prompt_json)
+        # Identical JSON + language + mode: reuse the previous rewrite
+        rewrite_key = make_cache_key(get_template_registry().version, prompt_json_for_gemini, output_lang, creative_mode)
+        stream_rewrite = request.form.get('stream') == 'true' and request.headers.get('X-Requested-With') == 'XMLHttpRequest'
+        prompt_text = rewrite_cache.get(rewrite_key) if stream_rewrite else None
+        if fused_prompt_text:
+            # Fused mode already wrote the prose alongside the recognition JSON
+            prompt_text = fused_prompt_text
+            rewrite_cache.set(rewrite_key, prompt_text)
+        elif prompt_text is None and stream_rewrite:
+            # Return the results now and let the browser stream the prose in
+            stream_id = register_prompt_stream(
+                build_rewrite_payload(prompt_json_for_gemini, output_lang, creative_mode), rewrite_key
+            )
+            prompt_stream_url = url_for('prompt_stream', stream_id=stream_id)
             prompt_text = ''
+        elif prompt_text is None:
+            prompt_text = cached_gemini_call(
+                'rewrite', rewrite_cache, rewrite_key,
+                lambda: rewrite_prompt(prompt_json_for_gemini, output_lang, creative_mode)
+            ) or ''
     import json
     prompt_json_str = None
     # 僅在 prompt_json 有內容時才生成
-    def is_all_infer_or_default(j):
-        if not j:
-            return True
-        
-        # Define infer keys based on prompt type and user preferences
-        base_infer_keys = [
-            'Scene', 'ambiance_or_mood', 'Location', 'Visual style', 'lighting', 'main_character', 'extra_desc'
-        ]
-        
-        # Add ending only if user requested it
-        if 'ending' in j:
-            base_infer_keys.append('ending')
-        
-        # Add camera motion only for video prompts
-        infer_keys = base_infer_keys.copy()
-        if j.get('type') == 'video':
-            infer_keys.append('camera motion')
-        
-        for k in infer_keys:
-            v = j.get(k, '')
-            # Convert to string if it's not already, then check
-            if v and isinstance(v, str) and not v.startswith('[Please infer'):
-                return False
-            elif v and not isinstance(v, str):
-                # If it's not a string and not empty, it's valid content
-                return False
-        
-        # Check if type and time are default values
-        prompt_type = j.get('type', '')
-        if prompt_type not in ['image', 'video']:
-            return False
-        if j.get('time', '') != '00:00':
-            return False
-        return True
-
     valid_json = prompt_json and not is_all_infer_or_default(prompt_json)
     
     # Generate images automatically only when explicitly requested.
@@ -887,6 +1397,7 @@ def index():
         prompt_text=prompt_text if prompt_text else '',
         prompt_json=prompt_json if prompt_json else None,
         prompt_json_str=prompt_json_str if prompt_json_str else '',
+        prompt_stream_url=prompt_stream_url,
         image_url=image_url if image_url else '',
         generated_images=generated_images if generated_images else None,
         prompt_type=prompt_type,
@@ -917,39 +1428,23 @@ def index():
 
     # Set cookies for POST
     if request.method == 'POST':
-        # Only store user input values, not rendered content
-        if prompt_type is not None:
-            resp.set_cookie('prompt_type', prompt_type)
-        if output_lang is not None:
-            resp.set_cookie('output_lang', output_lang_display)
-        if time is not None:
-            resp.set_cookie('time', time)
-        resp.set_cookie('scene', scene if scene is not None else '')
-        resp.set_cookie('custom_scene', custom_scene if custom_scene is not None else '')
-        resp.set_cookie('character', character if character is not None else '')
-        resp.set_cookie('custom_character', custom_character if custom_character is not None else '')
-        resp.set_cookie('extra_desc', extra_desc if extra_desc is not None else '')
-        resp.set_cookie('creative_mode', 'true' if creative_mode else 'false')
-        resp.set_cookie('include_ending', 'true' if include_ending else 'false')
-        resp.set_cookie('multiple_scenes', 'true' if multiple_scenes else 'false')
-        resp.set_cookie('bypass_time', str(bypass_time).lower())
+        user_inputs = {
+            'prompt_type': prompt_type,
+            'output_lang': output_lang,
+            'time': time,
+            'scene': scene,
+            'custom_scene': custom_scene,
+            'character': character,
+            'custom_character': custom_character,
+            'extra_desc': extra_desc,
+            'creative_mode': creative_mode,
+            'include_ending': include_ending,
+            'multiple_scenes': multiple_scenes
+        }
+        set_prompt_cookies(resp, user_inputs, output_lang_display, bypass_time)
 
         # Log user interaction if we have results
         if prompt_text or prompt_json:
-            user_inputs = {
-                'prompt_type': prompt_type,
-                'output_lang': output_lang,
-                'time': time,
-                'scene': scene,
-                'custom_scene': custom_scene,
-                'character': character,
-                'custom_character': custom_character,
-                'extra_desc': extra_desc,
-                'creative_mode': creative_mode,
-                'include_ending': include_ending,
-                'multiple_scenes': multiple_scenes
-            }
-
             # Fix image_path scope issue - get it from the local context
             uploaded_file_path = image_path if 'image_path' in locals() else None
 
@@ -964,6 +1459,29 @@ def index():
     return resp
 
 
+def watch_for_cancellation(job_id):
+    """Return a CancelToken that fires when the job is cancelled from any worker process.
+
+    A daemon thread follows the job record until it finishes; a DELETE
+    handled by another gunicorn worker reaches it through the shared store.
+    """
+    token = CancelToken()
+
+    def watch():
+        version = 0
+        while True:
+            job = generation_jobs.wait_for_change(job_id, version, 60)
+            if job is None or job['status'] == 'cancelled':
+                token.cancel()
+                return
+            if job['status'] in ('done', 'error'):
+                return
+            version = job['version']
+
+    threading.Thread(target=watch, name=f'cancel-watch-{job_id[:8]}', daemon=True).start()
+    return token
+
+
 def _background_voice_generate(job_id, text, voice_sample, emotion_params=None):
     """Background worker that runs IndexTTS voice generation with progress tracking."""
     if emotion_params is None:
@@ -974,22 +1492,18 @@ def _background_voice_generate(job_id, text, voice_sample, emotion_params=None):
     try:
         # Direct IndexTTS API implementation (no imports from voice_integration)
         
-        with generation_jobs_lock:
-            if job_id not in generation_jobs:
-                print(f"❌ Job {job_id} not found in generation_jobs")
-                return
-            generation_jobs[job_id]['status'] = 'processing'
-            generation_jobs[job_id]['progress'] = 0
+        if not generation_jobs.update(job_id, status='processing', progress=0):
+            print(f"❌ Job {job_id} not found in generation_jobs or cancelled")
+            return
+        cancel_token = watch_for_cancellation(job_id)
         
         print(f"🎵 Job {job_id}: Starting IndexTTS voice generation with voice sample {voice_sample}")
         
         # Define progress callback to update job progress
         def update_progress(progress_percent):
             try:
-                with generation_jobs_lock:
-                    if job_id in generation_jobs:
-                        generation_jobs[job_id]['progress'] = progress_percent
-                        print(f"🎵 Job {job_id} voice progress updated to {progress_percent}%")
+                if generation_jobs.update(job_id, progress=progress_percent):
+                    print(f"🎵 Job {job_id} voice progress updated to {progress_percent}%")
             except Exception as e:
                 print(f"❌ Failed to update voice progress for job {job_id}: {e}")
         
@@ -1055,28 +1569,29 @@ def _background_voice_generate(job_id, text, voice_sample, emotion_params=None):
             
             # Make request to FastAPI server using IndexTTS emotion vector format
             print(f"🚀 Sending request to FastAPI server with emotion vector...")
+            # Read up front: a cancelled request's helper thread may still be uploading after we return
             with open(voice_sample_path, 'rb') as audio_file:
-                files = {'reference_audio': audio_file}
-                
-                data = {
-                    'text': cleaned_text,
-                    'emo_vector': emotion_vector_str,
-                    'emo_alpha': 1.0,  # Full emotion influence
-                    'speed': 1.0,
-                    'temperature': 0.7,
-                    'top_k': 20,
-                    'top_p': 0.8,
-                    'repetition_penalty': 1.1
-                }
-                
-                # Add emotion description if provided (for text-based emotion analysis)
-                emotion_description = emotion_params.get('emotion_description', '').strip()
-                if emotion_description:
-                    data['use_emo_text'] = True
-                    data['emo_text'] = emotion_description
-                
-                print(f"🎭 Sending IndexTTS data: {data}")
-                response = requests.post(f"{server_url}/generate", files=files, data=data, timeout=120)
+                files = {'reference_audio': (os.path.basename(voice_sample_path), audio_file.read())}
+
+            data = {
+                'text': cleaned_text,
+                'emo_vector': emotion_vector_str,
+                'emo_alpha': 1.0,  # Full emotion influence
+                'speed': 1.0,
+                'temperature': 0.7,
+                'top_k': 20,
+                'top_p': 0.8,
+                'repetition_penalty': 1.1
+            }
+            
+            # Add emotion description if provided (for text-based emotion analysis)
+            emotion_description = emotion_params.get('emotion_description', '').strip()
+            if emotion_description:
+                data['use_emo_text'] = True
+                data['emo_text'] = emotion_description
+            
+            print(f"🎭 Sending IndexTTS data: {data}")
+            response = abortable_post(f"{server_url}/generate", cancel_token, files=files, data=data, timeout=120)
             
             if response.status_code == 200:
                 # Generate unique filename
@@ -1099,6 +1614,8 @@ def _background_voice_generate(job_id, text, voice_sample, emotion_params=None):
             else:
                 raise Exception(f"FastAPI request failed: {response.status_code} - {response.text}")
                 
+        except JobCancelled:
+            raise
         except Exception as e:
             print(f"❌ Error in voice generation: {e}")
             audio_files = None
@@ -1106,57 +1623,61 @@ def _background_voice_generate(job_id, text, voice_sample, emotion_params=None):
         print(f"🎵 Job {job_id} IndexTTS voice generation completed, result: {audio_files}")
         
         # Process results
-        with generation_jobs_lock:
-            if audio_files:
-                # Convert file paths to URLs
-                audio_urls = []
-                for audio_file in audio_files:
-                    filename = os.path.basename(audio_file)
-                    audio_urls.append({
-                        'filename': filename,
-                        'url': f'/uploads/generated/{filename}'
-                    })
-                
-                generation_jobs[job_id]['progress'] = 100
-                generation_jobs[job_id]['status'] = 'done'
-                generation_jobs[job_id]['audio_files'] = audio_urls
-                print(f"🎵 Job {job_id} voice generation completed successfully with {len(audio_urls)} audio files")
-            else:
-                generation_jobs[job_id]['status'] = 'error'
-                generation_jobs[job_id]['error'] = 'IndexTTS voice generation failed - no audio files returned'
-                print(f"⚠️ Job {job_id}: No audio files returned from IndexTTS voice generation")
+        if audio_files:
+            # Convert file paths to URLs
+            audio_urls = []
+            for audio_file in audio_files:
+                filename = os.path.basename(audio_file)
+                audio_urls.append({
+                    'filename': filename,
+                    'url': f'/uploads/generated/{filename}'
+                })
+            
+            generation_jobs.update(job_id, progress=100, status='done', audio_files=audio_urls)
+            print(f"🎵 Job {job_id} voice generation completed successfully with {len(audio_urls)} audio files")
+        else:
+            generation_jobs.update(job_id, status='error', error='IndexTTS voice generation failed - no audio files returned')
+            print(f"⚠️ Job {job_id}: No audio files returned from IndexTTS voice generation")
                 
+    except JobCancelled:
+        print(f"🛑 Job {job_id} voice generation cancelled")
     except Exception as e:
         logger.exception("Unhandled error in background_voice_generate for job %s: %s", job_id, e)
-        with generation_jobs_lock:
-            if job_id in generation_jobs:
-                generation_jobs[job_id]['status'] = 'error'
-                generation_jobs[job_id]['error'] = str(e)
+        generation_jobs.update(job_id, status='error', error=str(e))
 
-def _background_generate(job_id, prompt_json, seed=None, modified_text=None):
-    """Background worker that runs image generation without progress tracking."""
+def apply_modified_text(prompt_json, modified_text):
+    """Put user-edited prompt text into the first CLIPTextEncode node of ``prompt_json`` (in place)."""
+    if not modified_text:
+        return prompt_json
+    logger = logging.getLogger(__name__)
+    # This assumes the text prompt is in a node with class_type "CLIPTextEncode"
+    for node_id, node_data in prompt_json.items():
+        if isinstance(node_data, dict) and node_data.get('class_type') == 'CLIPTextEncode':
+            if 'inputs' in node_data and 'text' in node_data['inputs']:
+                logger.info("Updating text prompt from '%s' to '%s'",
+                          node_data['inputs']['text'][:50] + '...' if len(node_data['inputs']['text']) > 50 else node_data['inputs']['text'],
+                          modified_text[:50] + '...' if len(modified_text) > 50 else modified_text)
+                node_data['inputs']['text'] = modified_text
+                break
+    return prompt_json
+
+
+def _background_generate(job_id, prompt_json, seed=None, modified_text=None, seeds=None, count=1):
+    """Background worker that runs image generation (one batch of ``count`` images) without progress tracking."""
     logger = logging.getLogger(__name__)
     logger.info("Background generate started for job %s", job_id)
 
     try:
         # Set initial status to processing
-        with generation_jobs_lock:
-            generation_jobs[job_id]['status'] = 'processing'
-            generation_jobs[job_id]['progress'] = 0
+        if not generation_jobs.update(job_id, status='processing', progress=0):
+            logger.info("Job %s was cancelled or removed before it started", job_id)
+            return
+        cancel_token = watch_for_cancellation(job_id)
 
         # If modified text is provided, update the prompt in the JSON
         if modified_text:
             logger.info("Job %s: Using modified text from user input", job_id)
-            # Find and update the text prompt in the JSON structure
-            # This assumes the text prompt is in a node with class_type "CLIPTextEncode"
-            for node_id, node_data in prompt_json.items():
-                if isinstance(node_data, dict) and node_data.get('class_type') == 'CLIPTextEncode':
-                    if 'inputs' in node_data and 'text' in node_data['inputs']:
-                        logger.info("Job %s: Updating text prompt from '%s' to '%s'", job_id, 
-                                  node_data['inputs']['text'][:50] + '...' if len(node_data['inputs']['text']) > 50 else node_data['inputs']['text'],
-                                  modified_text[:50] + '...' if len(modified_text) > 50 else modified_text)
-                        node_data['inputs']['text'] = modified_text
-                        break
+            apply_modified_text(prompt_json, modified_text)
 
         # Call the actual generation function (this may take time)
         generated_paths = []
@@ -1172,13 +1693,10 @@ def _background_generate(job_id, prompt_json, seed=None, modified_text=None):
                 def update_progress(progress_percent):
                     try:
                         logger.info("🎯 PROGRESS CALLBACK CALLED: Job %s, Progress: %d%%", job_id, progress_percent)
-                        with generation_jobs_lock:
-                            if job_id in generation_jobs:
-                                old_progress = generation_jobs[job_id].get('progress', 0)
-                                generation_jobs[job_id]['progress'] = progress_percent
-                                logger.info("📊 Job %s progress updated: %d%% → %d%%", job_id, old_progress, progress_percent)
-                            else:
-                                logger.warning("⚠️ Job %s not found in generation_jobs during progress update", job_id)
+                        if generation_jobs.update(job_id, progress=progress_percent):
+                            logger.info("📊 Job %s progress updated to %d%%", job_id, progress_percent)
+                        else:
+                            logger.warning("⚠️ Job %s not found in generation_jobs (or cancelled) during progress update", job_id)
                     except Exception as e:
                         logger.error("❌ Failed to update progress for job %s: %s", job_id, e)
                 
@@ -1194,14 +1712,18 @@ def _background_generate(job_id, prompt_json, seed=None, modified_text=None):
                     seed=seed,
                     progress_callback=update_progress,
                     server_address=server_address,
-                    port=server_port
+                    port=server_port,
+                    cancel_token=cancel_token,
+                    seeds=seeds,
+                    count=count
                 )
                 logger.info("Job %s generation completed, result: %s", job_id, generated_paths)
+            except JobCancelled:
+                logger.info("Job %s cancelled, ComfyUI prompt stopped", job_id)
+                return
             except Exception as e:
                 logger.exception("Generation failed for job %s: %s", job_id, e)
-                with generation_jobs_lock:
-                    generation_jobs[job_id]['status'] = 'error'
-                    generation_jobs[job_id]['error'] = str(e)
+                generation_jobs.update(job_id, status='error', error=str(e))
                 return
         else:
             # Simulate generation fallback
@@ -1231,50 +1753,100 @@ def _background_generate(job_id, prompt_json, seed=None, modified_text=None):
         # Only set job status to done if all images exist
         if not generated_paths:
             logger.warning(f"[IMAGE DEBUG] Job {job_id}: No generated paths returned, setting status to error")
-            with generation_jobs_lock:
-                generation_jobs[job_id]['status'] = 'error'
-                generation_jobs[job_id]['error'] = 'No image paths returned after generation.'
-                generation_jobs[job_id]['progress'] = 100
-                generation_jobs[job_id]['images'] = images_info
+            generation_jobs.update(job_id, status='error', error='No image paths returned after generation.',
+                                   progress=100, images=images_info)
         else:
             logger.info("Job %s processed %d images, setting status to done", job_id, len(images_info))
             try:
-                with generation_jobs_lock:
-                    old_progress = generation_jobs[job_id]['progress']
-                    generation_jobs[job_id]['progress'] = 100
-                    generation_jobs[job_id]['status'] = 'done'
-                    generation_jobs[job_id]['images'] = images_info
-                    logger.info("Job %s completion: progress %d%% -> 100%%, status set to done", job_id, old_progress)
+                generation_jobs.update(job_id, progress=100, status='done', images=images_info)
+                logger.info("Job %s completion: progress -> 100%%, status set to done", job_id)
             except Exception as e:
                 logger.exception("Error setting job completion status for job %s: %s", job_id, e)
                 # Try to set error status
-                with generation_jobs_lock:
-                    generation_jobs[job_id]['status'] = 'error'
-                    generation_jobs[job_id]['error'] = f"Completion error: {str(e)}"
+                generation_jobs.update(job_id, status='error', error=f"Completion error: {str(e)}")
 
         logger.info("Job %s processed %d images, setting status to done", job_id, len(images_info))
 
         try:
-            with generation_jobs_lock:
-                old_progress = generation_jobs[job_id]['progress']
-                generation_jobs[job_id]['progress'] = 100
-                generation_jobs[job_id]['status'] = 'done'
-                generation_jobs[job_id]['images'] = images_info
-                logger.info("Job %s completion: progress %d%% -> 100%%, status set to done", job_id, old_progress)
+            generation_jobs.update(job_id, progress=100, status='done', images=images_info)
+            logger.info("Job %s completion: progress -> 100%%, status set to done", job_id)
         except Exception as e:
             logger.exception("Error setting job completion status for job %s: %s", job_id, e)
             # Try to set error status
-            with generation_jobs_lock:
-                generation_jobs[job_id]['status'] = 'error'
-                generation_jobs[job_id]['error'] = f"Completion error: {str(e)}"
+            generation_jobs.update(job_id, status='error', error=f"Completion error: {str(e)}")
 
         logger.info("Job %s marked done, %d images", job_id, len(images_info))
 
     except Exception as e:
         logger.exception("Unhandled error in background_generate for job %s: %s", job_id, e)
-        with generation_jobs_lock:
-            generation_jobs[job_id]['status'] = 'error'
-            generation_jobs[job_id]['error'] = str(e)
+        generation_jobs.update(job_id, status='error', error=str(e))
+    finally:
+        release_image_generation(job_id)
+
+
+def recover_generation_jobs():
+    """Re-queue pending jobs left behind by a dead worker process; fail the ones it was running.
+
+    A job that had already reached ComfyUI or IndexTTS cannot be resumed, so
+    it is marked as an error instead of being silently stuck in 'processing'.
+    """
+    logger = logging.getLogger(__name__)
+    workers = {'image': _background_generate, 'voice': _background_voice_generate}
+    for job in generation_jobs.claim_orphans():
+        job_id = job['id']
+        kind = job.get('type', 'image')
+        if job['status'] == 'pending' and 'args' in job:
+            try:
+                get_job_executor().submit(kind, job_id, workers[kind], *job['args'],
+                                          client=job.get('client'), priority=job.get('priority', 'interactive'))
+                logger.info("Re-queued orphaned %s job %s", kind, job_id)
+                continue
+            except QueueFull:
+                pass
+        generation_jobs.update(job_id, status='error', error='Interrupted by server restart')
+        logger.warning("Orphaned %s job %s marked as failed", kind, job_id)
+
+
+def start_services():
+    """Open the job store and result caches, then take over orphaned generation jobs.
+
+    Runs once per server process. It is kept out of plain module scope
+    because the image preprocess pool uses spawn, and spawned workers
+    re-run this file as ``__mp_main__`` under ``python app.py``; they must
+    not open SQLite, start sweepers or claim jobs.
+    """
+    global generation_jobs, recognition_cache, rewrite_cache, enhance_cache, image_references, generation_results
+    generation_jobs = create_job_store()
+    recognition_cache = ResultCache(
+        'recognition',
+        max_entries=int(os.getenv('RECOGNITION_CACHE_SIZE', '256')),
+        ttl=int(os.getenv('RECOGNITION_CACHE_TTL', str(7 * 24 * 3600))),
+        disk_dir=os.path.join(CACHE_FOLDER, 'recognition'),
+        max_disk_entries=int(os.getenv('RECOGNITION_CACHE_DISK_SIZE', '2048'))
+    )
+    rewrite_cache = ResultCache(
+        'rewrite',
+        max_entries=int(os.getenv('REWRITE_CACHE_SIZE', '1024')),
+        ttl=int(os.getenv('REWRITE_CACHE_TTL', str(24 * 3600))),
+        max_bytes=int(os.getenv('REWRITE_CACHE_MAX_BYTES', str(8 * 1024 * 1024)))
+    )
+    enhance_cache = SemanticCache('enhance') if ENHANCE_SEMANTIC_CACHE else None
+    image_references = ImageReferenceManager(disk_dir=os.path.join(CACHE_FOLDER, 'files'))
+    generation_results = ResultCache(
+        'image_generations',
+        max_entries=int(os.getenv('IMAGE_RESULT_CACHE_SIZE', '512')),
+        ttl=int(os.getenv('IMAGE_RESULT_CACHE_TTL', str(7 * 24 * 3600))),
+        disk_dir=os.path.join(CACHE_FOLDER, 'generations')
+    )
+    recover_generation_jobs()
+    # Opens the prompt job store and fails prompt jobs a dead worker left running
+    get_prompt_pipeline()
+
+
+# gunicorn imports this module as 'app' and `python app.py` runs it as '__main__';
+# only spawned helper processes see '__mp_main__'
+if __name__ != '__mp_main__':
+    start_services()
 
 
 @app.route('/start_generation', methods=['POST'])
@@ -1316,28 +1888,30 @@ def start_generation():
         else:
             modified_text = request.form.get('modified_text')
 
-        # Generate a unique job ID
-        job_id = str(uuid.uuid4())
-
-        # Initialize the job in the global jobs dictionary
-        with generation_jobs_lock:
-            generation_jobs[job_id] = {
-                'status': 'pending',
-                'progress': 0,
-                'images': [],
-                'error': None,
-                'seed': seed,  # Store seed for reference
-                'prompt_json': json_data,  # Store prompt for debug/log
-                'modified_text': modified_text  # Store modified text
-            }
-
-        # Start background generation thread
-        thread = threading.Thread(target=_background_generate, args=(job_id, json_data, seed, modified_text))
-        thread.daemon = True
-        thread.start()
+        # Optional batch: 'count' images or one per entry of 'seeds'
+        seeds, count, invalid = requested_image_batch(seed)
+        if invalid:
+            return invalid
+
+        # Queue the job on the bounded image pool (429 when the queue is full),
+        # or reuse an identical fixed-seed job
+        job_id, queue_position, reused, busy = queue_image_job({
+            'status': 'pending',
+            'progress': 0,
+            'images': [],
+            'error': None,
+            'seed': seed,  # Store seed for reference
+            'seeds': seeds,  # Per-image seeds of a batch, if given
+            'count': count,  # Images in this batch
+            'prompt_json': json_data,  # Store prompt for debug/log
+            'modified_text': modified_text  # Store modified text
+        }, json_data, seed, modified_text, seeds, count)
+        if busy:
+            return busy
 
         # Return the job ID immediately
-        return jsonify({"job_id": job_id, "seed": seed}), 200
+        return jsonify({"job_id": job_id, "seed": seed, "seeds": seeds, "count": count,
+                        "queue_position": queue_position, "reused": reused}), 200
 
     except json.JSONDecodeError as e:
         logger = logging.getLogger(__name__)
@@ -1349,22 +1923,18 @@ def start_generation():
         return jsonify({"error": str(e)}), 500
 
 
-@app.route('/generation_status/<job_id>')
-def generation_status(job_id):
-    logger = logging.getLogger(__name__)
-    with generation_jobs_lock:
-        job = generation_jobs.get(job_id)
-    if job:
-        logger.debug("Status request for job %s: %s", job_id, job.get('status'))
-    if not job:
-        return jsonify({'error': 'Job not found'}), 404
-    
+def generation_status_payload(job_id, job):
+    """Build the status dict shared by /generation_status and /generation_events."""
     resp_dict = {
         'status': job['status'],
+        'version': job.get('version', 0),
         'progress': job['progress'],
         'error': job.get('error'),
         'type': job.get('type', 'image')  # Default to image for backward compatibility
     }
+    if job['status'] == 'pending':
+        # 1 = next to start; None once a worker has picked the job up
+        resp_dict['queue_position'] = get_job_executor().position(resp_dict['type'], job_id)
     
     # Handle different job types
     if job.get('type') == 'voice':
@@ -1374,10 +1944,33 @@ def generation_status(job_id):
     else:
         # Image generation job (default)
         resp_dict['prompt_json'] = job.get('prompt_json')
+        resp_dict['count'] = job.get('count', 1)
         if job['status'] == 'done':
             resp_dict['images'] = job.get('images', [])
+    return resp_dict
+
+
+@app.route('/generation_status/<job_id>')
+def generation_status(job_id):
+    """Return a job's status; with ``?since=<version>&wait=<seconds>`` it long-polls.
+
+    A long-poll returns as soon as the job's version passes ``since`` (or it
+    finishes), otherwise after ``wait`` seconds (at most
+    GENERATION_STATUS_MAX_WAIT) with the unchanged status.
+    """
+    logger = logging.getLogger(__name__)
+    since = request.args.get('since', type=int)
+    wait = min(request.args.get('wait', 0, type=float), GENERATION_STATUS_MAX_WAIT)
+    if since is not None and wait > 0:
+        job = generation_jobs.wait_for_change(job_id, since, wait)
+    else:
+        job = generation_jobs.get(job_id)
+    if job:
+        logger.debug("Status request for job %s: %s", job_id, job.get('status'))
+    if not job:
+        return jsonify({'error': 'Job not found'}), 404
     
-    response = jsonify(resp_dict)
+    response = jsonify(generation_status_payload(job_id, job))
     # Prevent caching of status responses
     response.headers['Cache-Control'] = 'no-cache, no-store, must-revalidate'
     response.headers['Pragma'] = 'no-cache'
@@ -1385,10 +1978,149 @@ def generation_status(job_id):
     return response
 
 
+@app.route('/generation_events/<job_id>')
+def generation_events(job_id):
+    """Push a job's status to the browser as Server-Sent Events until it finishes.
+
+    Events are ``progress`` (pending/processing), ``done``, ``cancelled`` and ``failed``
+    (``error`` is reserved by EventSource for connection errors); each
+    carries the /generation_status payload and the job version as its id,
+    so a reconnecting client resumes from Last-Event-ID. A comment line is
+    sent every GENERATION_EVENTS_HEARTBEAT seconds to keep proxies open.
+    """
+    if generation_jobs.get(job_id) is None:
+        return jsonify({'error': 'Job not found'}), 404
+    try:
+        since = int(request.headers.get('Last-Event-ID', 0))
+    except ValueError:
+        since = 0
+
+    def generate():
+        version = since
+        while True:
+            job = generation_jobs.wait_for_change(job_id, version, GENERATION_EVENTS_HEARTBEAT)
+            if job is None:
+                yield f"event: failed\ndata: {json.dumps({'status': 'error', 'error': 'Job not found'})}\n\n"
+                return
+            finished = job['status'] in ('done', 'error', 'cancelled')
+            if job['version'] <= version and not finished:
+                yield ": keep-alive\n\n"
+                continue
+            version = job['version']
+            event = {'done': 'done', 'error': 'failed', 'cancelled': 'cancelled'}.get(job['status'], 'progress')
+            payload = json.dumps(generation_status_payload(job_id, job), ensure_ascii=False)
+            yield f"id: {version}\nevent: {event}\ndata: {payload}\n\n"
+            if finished:
+                return
+
+    response = Response(generate(), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+
+@app.route('/prompt_stream/<stream_id>')
+def prompt_stream(stream_id):
+    """Relay the JSON-to-prose rewrite to the browser as Server-Sent Events."""
+    pending = take_prompt_stream(stream_id)
+    if not pending:
+        return jsonify({'error': 'Stream not found'}), 404
+
+    def generate():
+        logger = logging.getLogger(__name__)
+        chunks = []
+        try:
+            for chunk in get_gemini_client().stream_generate_content(pending['payload']):
+                chunks.append(chunk)
+                yield f"data: {json.dumps({'text': chunk}, ensure_ascii=False)}\n\n"
+        except Exception as e:
+            logger.error("Gemini stream error for %s: %s", stream_id, e)
+            yield f"event: error\ndata: {json.dumps({'error': str(e)})}\n\n"
+            return
+        prompt_text = ''.join(chunks)
+        if prompt_text:
+            rewrite_cache.set(pending['rewrite_key'], prompt_text)
+        yield "event: done\ndata: {}\n\n"
+
+    response = Response(generate(), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+
+@app.route('/prompt_job/<job_id>')
+def prompt_job_status(job_id):
+    """Poll an async prompt job; the rendered results fragment is included once it completes."""
+    job = get_prompt_pipeline().get(job_id)
+    if not job:
+        return jsonify({'error': 'Job not found'}), 404
+
+    data = {'status': job['status'], 'stage': job['stage']}
+    if job['status'] == 'completed':
+        result = job['result']
+        stream_id = result['stream_id']
+        data['html'] = render_template(
+            '_results.html',
+            prompt_text=result['prompt_text'],
+            prompt_json=result['prompt_json'],
+            prompt_json_str=result['prompt_json_str'],
+            prompt_stream_url=url_for('prompt_stream', stream_id=stream_id) if stream_id else None,
+            image_url=result['image_url'] or '',
+            generated_images=None
+        )
+    elif job['status'] == 'failed':
+        data['error'] = job['error']
+    return jsonify(data), 200
+
+
+@app.route('/gemini_stats')
+def gemini_stats():
+    """Report Gemini client pool usage and result cache counters."""
+    return jsonify({
+        'client': get_gemini_client().stats(),
+        'recognition_cache': recognition_cache.stats(),
+        'rewrite_cache': rewrite_cache.stats(),
+        'single_flight': gemini_flight.stats(),
+        'image_references': image_references.stats(),
+        'enhance_semantic_cache': enhance_cache.stats() if enhance_cache else {'enabled': False, 'available': NUMPY_AVAILABLE},
+        'fused': dict(fused_stats, enabled=GEMINI_FUSED_MODE),
+        'prompt_pipeline': dict(get_prompt_pipeline().stats(), enabled=PROMPT_PIPELINE_ENABLED),
+        'generation_jobs': get_job_executor().stats(),
+        'job_store': generation_jobs.stats(),
+        'image_generation_dedup': dict(generation_dedup_stats, enabled=IMAGE_GENERATION_DEDUP,
+                                       in_flight=len(active_generations), cache=generation_results.stats())
+    }), 200
+
+
+@app.route('/generation/<job_id>', methods=['DELETE'])
+def cancel_generation(job_id):
+    """Cancel a pending or running image/voice job.
+
+    A queued job is dropped from its pool; a running one is stopped by its
+    worker (ComfyUI prompt interrupted or dequeued, IndexTTS request
+    abandoned) once the 'cancelled' status reaches it. A job shared by
+    identical fixed-seed requests keeps running until its last subscriber
+    cancels; the others only detach.
+    """
+    job = generation_jobs.get(job_id)
+    if not job:
+        return jsonify({'error': 'Job not found'}), 404
+    kind = job.get('type', 'image')
+    remaining = generation_jobs.unsubscribe(job_id, error='Cancelled by client')
+    if remaining is None:
+        job = generation_jobs.get(job_id) or job
+        return jsonify({'error': f"Job already {job['status']}", 'status': job['status']}), 409
+    if remaining:
+        logging.getLogger(__name__).info("Client detached from %s job %s (%d still waiting)", kind, job_id, remaining)
+        return jsonify({'job_id': job_id, 'status': 'detached', 'subscribers': remaining}), 200
+    dequeued = get_job_executor().cancel(kind, job_id)
+    logging.getLogger(__name__).info("Cancelled %s job %s (%s)", kind, job_id, 'dequeued' if dequeued else 'stopping worker')
+    return jsonify({'job_id': job_id, 'status': 'cancelled'}), 200
+
+
 @app.route('/generation_result/<job_id>')
 def generation_result(job_id):
-    with generation_jobs_lock:
-        job = generation_jobs.get(job_id)
+    job = generation_jobs.get(job_id)
     if not job:
         return jsonify({'error': 'Job not found'}), 404
     if job['status'] != 'done':
@@ -1399,8 +2131,7 @@ def generation_result(job_id):
 @app.route('/regeneration_result/<job_id>')
 def regeneration_result(job_id):
     """Get regeneration results and return HTML for frontend"""
-    with generation_jobs_lock:
-        job = generation_jobs.get(job_id)
+    job = generation_jobs.get(job_id)
     if not job:
         return jsonify({'error': 'Job not found'}), 404
     if job['status'] != 'done':
@@ -1605,26 +2336,23 @@ def start_voice_generation():
         # Generate a unique job ID for the voice generation request
         job_id = str(uuid.uuid4())
         
-        # Initialize the job in the global jobs dictionary
-        with generation_jobs_lock:
-            generation_jobs[job_id] = {
-                'status': 'pending',
-                'progress': 0,
-                'audio_files': [],
-                'error': None,
-                'type': 'voice'  # Mark this as a voice generation job
-            }
-        
-        # Start background voice generation thread with emotion parameters
-        thread = threading.Thread(target=_background_voice_generate, args=(job_id, text, voice_sample, emotion_params))
-        thread.daemon = True
-        thread.start()
+        # Queue the job on the bounded voice pool with emotion parameters; 429 when the queue is full
+        queue_position, busy = queue_generation_job('voice', job_id, {
+            'status': 'pending',
+            'progress': 0,
+            'audio_files': [],
+            'error': None,
+            'type': 'voice'  # Mark this as a voice generation job
+        }, _background_voice_generate, text, voice_sample, emotion_params)
+        if busy:
+            return busy
         
         # Return job ID for frontend to poll
         return jsonify({
             'job_id': job_id,
             'message': 'Voice generation started',
-            'status': 'pending'
+            'status': 'pending',
+            'queue_position': queue_position
         }), 200
             
     except Exception as e:
@@ -1780,7 +2508,6 @@ def heic_info(filename):
 
 @app.route('/download_prompt')
 def download_prompt():
-    from flask import Response
     prompt = request.args.get('prompt', '')
     return Response(prompt, mimetype='text/plain; charset=utf-8', headers={
         'Content-Disposition': 'attachment; filename=prompt.txt'
@@ -1789,7 +2516,6 @@ def download_prompt():
 @app.route('/download_json')
 def download_json():
     import json
-    from flask import Response
     import urllib.parse
     prompt_json = request.args.get('prompt_json')
     # 解析 query string 傳來的 JSON 字串
@@ -1806,7 +2532,6 @@ def download_json():
     })
 
 def gemini_2_flash_api(image_path, api_key):
-    url = "https://generativelanguage.googleapis.com/v1beta/models/gemini-2.0-flash:generateContent"
     with open(image_path, "rb") as f:
         img_b64 = base64.b64encode(f.read()).decode()
     payload = {
@@ -1819,11 +2544,7 @@ def gemini_2_flash_api(image_path, api_key):
             }
         ]
     }
-    headers = {
-        "Content-Type": "application/json",
-        "X-goog-api-key": api_key
-    }
-    response = requests.post(url, json=payload, headers=headers)
+    response = get_gemini_client().generate_content(payload, api_key=api_key)
     return response.json()
 @app.route('/test_heic.html')
 def test_heic():
@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+"""
+Job Store Contention Benchmark
+
+Measures how status polls behave while generation workers stream progress
+updates into the job store. The ``global-lock`` baseline reproduces the
+old layout: one lock around a dict of mutable job dicts, with the
+progress log line written while the lock is held. The ``memory`` and
+``sqlite`` runs use the stores from api/job_store.py with the app's
+current call pattern (update, then log).
+
+Each reader polls every ``--poll-interval`` seconds, like browsers
+polling /generation_status; ``--poll-interval 0`` makes them spin, which
+on CPython mostly measures GIL hand-offs and starves every writer. Write
+latency (update plus log line) is reported next to read latency to show
+whether progress updates keep up under the poll load.
+
+Usage:
+    python bench_job_store.py
+    python bench_job_store.py --writers 8 --readers 64 --poll-interval 0.05 --seconds 5 --backends global-lock,memory,sqlite
+"""
+
+import argparse
+import logging
+import os
+import random
+import statistics
+import tempfile
+import threading
+import time
+
+from api.job_store import MemoryJobStore, SQLiteJobStore
+
+logger = logging.getLogger('bench_job_store')
+
+
+class GlobalLockJobStore:
+    """The pre-refactor store: every read and write takes one process-wide lock."""
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.jobs = {}
+
+    def create(self, job_id, job):
+        with self.lock:
+            self.jobs[job_id] = dict(job)
+
+    def get(self, job_id):
+        with self.lock:
+            job = self.jobs.get(job_id)
+            return dict(job) if job is not None else None
+
+    def update(self, job_id, **fields):
+        with self.lock:
+            job = self.jobs.get(job_id)
+            if job is None:
+                return False
+            job.update(fields)
+            logger.info("Job %s progress updated to %d%%", job_id, fields.get('progress', 0))
+            return True
+
+
+def make_store(backend, directory):
+    if backend == 'global-lock':
+        return GlobalLockJobStore()
+    if backend == 'memory':
+        return MemoryJobStore(ttl=3600, max_entries=100000, sweep_interval=3600)
+    if backend == 'sqlite':
+        return SQLiteJobStore(os.path.join(directory, 'jobs.sqlite3'), ttl=3600, max_entries=100000, sweep_interval=3600)
+    raise ValueError(f"Unknown backend: {backend}")
+
+
+def percentile(sorted_values, fraction):
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * fraction))]
+
+
+def run(backend, writers, readers, seconds, directory, poll_interval):
+    store = make_store(backend, directory)
+    job_ids = [f'job-{i}' for i in range(writers)]
+    for job_id in job_ids:
+        store.create(job_id, {'status': 'processing', 'progress': 0, 'images': [], 'error': None,
+                              'prompt_json': {'Scene': 'x' * 200}})
+
+    stop = threading.Event()
+    write_latencies = [[] for _ in range(writers)]
+    read_latencies = [[] for _ in range(readers)]
+
+    def write(index):
+        job_id = job_ids[index]
+        latencies = write_latencies[index]
+        progress = 0
+        while not stop.is_set():
+            progress = (progress + 1) % 100
+            started = time.perf_counter()
+            store.update(job_id, progress=progress)
+            if backend != 'global-lock':
+                logger.info("Job %s progress updated to %d%%", job_id, progress)
+            latencies.append(time.perf_counter() - started)
+
+    def read(index):
+        rng = random.Random(index)
+        latencies = read_latencies[index]
+        # Spread the first polls over one interval so the readers don't fire in lockstep
+        stop.wait(rng.uniform(0, poll_interval))
+        while not stop.is_set():
+            started = time.perf_counter()
+            store.get(rng.choice(job_ids))
+            latencies.append(time.perf_counter() - started)
+            if poll_interval:
+                stop.wait(poll_interval)
+
+    threads = [threading.Thread(target=write, args=(i,)) for i in range(writers)]
+    threads += [threading.Thread(target=read, args=(i,)) for i in range(readers)]
+    for thread in threads:
+        thread.start()
+    time.sleep(seconds)
+    stop.set()
+    for thread in threads:
+        thread.join()
+
+    reads = sorted(latency for per_thread in read_latencies for latency in per_thread)
+    writes = sorted(latency for per_thread in write_latencies for latency in per_thread)
+    return {
+        'backend': backend,
+        'reads_per_s': len(reads) / seconds,
+        'writes_per_s': len(writes) / seconds,
+        'read_p50_us': statistics.median(reads) * 1e6,
+        'read_p99_us': percentile(reads, 0.99) * 1e6,
+        'read_max_ms': reads[-1] * 1e3,
+        'write_p50_us': statistics.median(writes) * 1e6,
+        'write_p99_us': percentile(writes, 0.99) * 1e6,
+        'write_max_ms': writes[-1] * 1e3,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Job store status-poll vs progress-update contention benchmark')
+    parser.add_argument('--writers', type=int, default=4, help='Threads streaming progress updates (default: 4)')
+    parser.add_argument('--readers', type=int, default=32, help='Threads polling job status (default: 32)')
+    parser.add_argument('--poll-interval', type=float, default=0.01,
+                        help='Seconds between one reader\'s polls; 0 spins (default: 0.01)')
+    parser.add_argument('--seconds', type=float, default=3.0, help='Duration of each run (default: 3)')
+    parser.add_argument('--backends', default='global-lock,memory,sqlite', help='Comma-separated stores to compare')
+    parser.add_argument('--log-file', default=os.devnull, help='Where progress log lines go (default: discarded)')
+    args = parser.parse_args()
+
+    # Log lines are really formatted and written, as in the app
+    handler = logging.FileHandler(args.log_file)
+    handler.setFormatter(logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s'))
+    logger.addHandler(handler)
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+
+    columns = ['reads/s', 'writes/s', 'read p50 us', 'read p99 us', 'read max ms',
+               'write p50 us', 'write p99 us', 'write max ms']
+    print(f"{'backend':<12} " + ' '.join(f"{column:>12}" for column in columns))
+    with tempfile.TemporaryDirectory() as directory:
+        for backend in args.backends.split(','):
+            result = run(backend.strip(), args.writers, args.readers, args.seconds, directory, args.poll_interval)
+            print(f"{result['backend']:<12} {result['reads_per_s']:>12.0f} {result['writes_per_s']:>12.0f} "
+                  f"{result['read_p50_us']:>12.1f} {result['read_p99_us']:>12.1f} {result['read_max_ms']:>12.2f} "
+                  f"{result['write_p50_us']:>12.1f} {result['write_p99_us']:>12.1f} {result['write_max_ms']:>12.2f}")
+
+
+if __name__ == '__main__':
+    main()
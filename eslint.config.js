@@ -17,6 +17,7 @@ export default [
         XMLHttpRequest: 'readonly',
         Event: 'readonly',
         CustomEvent: 'readonly',
+        EventSource: 'readonly',
         alert: 'readonly',
         navigator: 'readonly',
         location: 'readonly',
@@ -0,0 +1,345 @@
+#!/usr/bin/env python3
+"""
+Gemini Stand-in Server
+
+Local replacement for the Gemini API that replays recorded generateContent
+responses, so index() and the prompt pipeline can be load-tested offline
+without spending quota. Latency follows a configurable distribution and
+429/500/503 errors and timeouts can be injected at given rates.
+
+Point the app at it with GEMINI_BASE_URL=http://127.0.0.1:8089/v1beta.
+
+Usage:
+    python gemini_standin.py
+    python gemini_standin.py --latency lognormal:0.8,0.5 --error-429 0.05 --timeout-rate 0.01
+    python gemini_standin.py --record --upstream https://generativelanguage.googleapis.com
+"""
+
+import argparse
+import json
+import math
+import os
+import random
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit
+
+import requests
+
+DEFAULT_FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures', 'gemini_responses.json')
+KINDS = ('recognition', 'enhance', 'rewrite', 'fused')
+
+ERROR_BODIES = {
+    429: {"code": 429, "message": "Resource has been exhausted (e.g. check quota).", "status": "RESOURCE_EXHAUSTED"},
+    500: {"code": 500, "message": "An internal error has occurred.", "status": "INTERNAL"},
+    503: {"code": 503, "message": "The model is overloaded. Please try again later.", "status": "UNAVAILABLE"},
+}
+
+
+def parse_latency(spec):
+    """Turn a latency spec into a zero-argument sampler returning seconds.
+
+    Specs: ``fixed:S``, ``uniform:LO,HI``, ``normal:MEAN,SD``,
+    ``lognormal:MEDIAN,SIGMA`` and ``exp:MEAN``.
+    """
+    name, _, args = spec.partition(':')
+    values = [float(v) for v in args.split(',') if v.strip()]
+    if name == 'fixed':
+        return lambda: values[0]
+    if name == 'uniform':
+        return lambda: random.uniform(values[0], values[1])
+    if name == 'normal':
+        return lambda: max(0.0, random.gauss(values[0], values[1]))
+    if name == 'lognormal':
+        return lambda: random.lognormvariate(math.log(values[0]), values[1])
+    if name == 'exp':
+        return lambda: random.expovariate(1.0 / values[0])
+    raise ValueError(f"Unknown latency distribution: {spec}")
+
+
+def classify(body):
+    """Which kind of app call a generateContent body is, from its schema and parts."""
+    schema = (body.get('generationConfig') or {}).get('responseSchema') or {}
+    properties = schema.get('properties') or {}
+    if 'prompt_text' in properties:
+        return 'fused'
+    parts = [part for content in body.get('contents', []) for part in content.get('parts', [])]
+    if any('inline_data' in part or 'file_data' in part for part in parts):
+        return 'recognition'
+    return 'enhance' if properties else 'rewrite'
+
+
+def fit_to_schema(response, body):
+    """Reshape a recorded JSON answer to the fields this request's schema asks for."""
+    properties = ((body.get('generationConfig') or {}).get('responseSchema') or {}).get('properties')
+    if not properties:
+        return response
+    response = json.loads(json.dumps(response))
+    part = response['candidates'][0]['content']['parts'][0]
+    try:
+        recorded = json.loads(part['text'])
+    except ValueError:
+        recorded = {}
+    part['text'] = json.dumps({field: recorded.get(field, '') for field in properties}, ensure_ascii=False)
+    return response
+
+
+def response_text(response):
+    try:
+        return response['candidates'][0]['content']['parts'][0]['text']
+    except (KeyError, IndexError, TypeError):
+        return ''
+
+
+class StandinState:
+    """Fixtures, fault settings and counters shared by the request handlers."""
+
+    def __init__(self, args):
+        self.args = args
+        self.latency = parse_latency(args.latency)
+        self.fixtures_path = args.fixtures
+        with open(self.fixtures_path, 'r', encoding='utf-8') as f:
+            self.fixtures = json.load(f)
+        self.lock = threading.Lock()
+        self.counters = {'requests': 0, 'in_flight': 0, 'max_in_flight': 0, 'uploads': 0, 'recorded': 0}
+        self.counters.update({f'{kind}_calls': 0 for kind in KINDS})
+        self.counters.update({f'injected_{status}': 0 for status in ERROR_BODIES})
+        self.counters['injected_timeouts'] = 0
+
+    def count(self, key, delta=1):
+        with self.lock:
+            self.counters[key] += delta
+            if key == 'in_flight':
+                self.counters['max_in_flight'] = max(self.counters['max_in_flight'], self.counters['in_flight'])
+
+    def pick(self, kind):
+        with self.lock:
+            responses = self.fixtures.get(kind) or self.fixtures.get('rewrite')
+            return random.choice(responses)
+
+    def fault(self):
+        """Return an injected status, 'timeout' or None for this request."""
+        roll = random.random()
+        for status, rate in ((429, self.args.error_429), (500, self.args.error_500), (503, self.args.error_503)):
+            if roll < rate:
+                return status
+            roll -= rate
+        if roll < self.args.timeout_rate:
+            return 'timeout'
+        return None
+
+    def record(self, kind, response):
+        """Append an upstream response to the fixtures file."""
+        with self.lock:
+            self.fixtures.setdefault(kind, []).append(response)
+            self.counters['recorded'] += 1
+            tmp_path = f"{self.fixtures_path}.tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(self.fixtures, f, ensure_ascii=False, indent=2)
+            os.replace(tmp_path, self.fixtures_path)
+
+
+class StandinHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    state = None  # set by main()
+
+    def log_message(self, format, *args):
+        if not self.state.args.quiet:
+            super().log_message(format, *args)
+
+    def _send_json(self, status, payload, headers=None):
+        data = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=UTF-8')
+        self.send_header('Content-Length', str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        if self.path.rstrip('/') == '/stats':
+            with self.state.lock:
+                stats = dict(self.state.counters)
+            stats['fixtures'] = {kind: len(self.state.fixtures.get(kind, [])) for kind in KINDS}
+            self._send_json(200, stats)
+            return
+        self._send_json(404, {"error": {"code": 404, "message": "Not found", "status": "NOT_FOUND"}})
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        raw = self.rfile.read(length) if length else b''
+        path = urlsplit(self.path).path
+        self.state.count('requests')
+        self.state.count('in_flight')
+        try:
+            if self.state.args.record:
+                self._proxy(path, raw)
+            elif path.startswith('/upload/'):
+                self._upload(path, raw)
+            elif path.endswith(':generateContent') or path.endswith(':streamGenerateContent'):
+                self._generate(path, json.loads(raw or b'{}'))
+            else:
+                self._send_json(404, {"error": {"code": 404, "message": f"Unknown endpoint {path}", "status": "NOT_FOUND"}})
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+        finally:
+            self.state.count('in_flight', -1)
+
+    def _generate(self, path, body):
+        state = self.state
+        kind = classify(body)
+        state.count(f'{kind}_calls')
+        fault = state.fault()
+        if fault == 'timeout':
+            state.count('injected_timeouts')
+            # Hold the request past the client's read timeout, then drop the connection
+            time.sleep(state.args.timeout_hang)
+            self.close_connection = True
+            return
+        time.sleep(state.latency())
+        if fault is not None:
+            state.count(f'injected_{fault}')
+            headers = {'Retry-After': str(state.args.retry_after)} if fault == 429 and state.args.retry_after else None
+            self._send_json(fault, {"error": ERROR_BODIES[fault]}, headers)
+            return
+
+        response = fit_to_schema(state.pick(kind), body)
+        if path.endswith(':streamGenerateContent'):
+            self._stream(response)
+        else:
+            self._send_json(200, response)
+
+    def _stream(self, response):
+        """Replay a response as SSE chunks of ``--chunk-chars`` characters."""
+        text = response_text(response)
+        size = max(1, self.state.args.chunk_chars)
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+        for start in range(0, len(text), size):
+            chunk = {
+                "candidates": [{"content": {"parts": [{"text": text[start:start + size]}], "role": "model"}, "index": 0}],
+                "modelVersion": response.get('modelVersion')
+            }
+            if start + size >= len(text):
+                chunk['candidates'][0]['finishReason'] = 'STOP'
+                chunk['usageMetadata'] = response.get('usageMetadata')
+            event = f"data: {json.dumps(chunk, ensure_ascii=False)}\r\n\r\n".encode('utf-8')
+            self.wfile.write(b'%x\r\n%s\r\n' % (len(event), event))
+            self.wfile.flush()
+            time.sleep(self.state.args.chunk_delay)
+        self.wfile.write(b'0\r\n\r\n')
+
+    def _upload(self, path, raw):
+        """Files API resumable upload: a start request, then one upload-and-finalize request."""
+        command = self.headers.get('X-Goog-Upload-Command', '')
+        if command == 'start':
+            host = self.headers.get('Host') or f'{self.server.server_address[0]}:{self.server.server_address[1]}'
+            upload_url = f"http://{host}{path.rstrip('/')}/resumable/{uuid.uuid4().hex}"
+            self.send_response(200)
+            self.send_header('X-Goog-Upload-URL', upload_url)
+            self.send_header('X-Goog-Upload-Status', 'active')
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        self.state.count('uploads')
+        name = f"files/{uuid.uuid4().hex[:12]}"
+        now = datetime.now(timezone.utc)
+        base = path.split('/upload/', 1)[1].split('/files', 1)[0]
+        host = self.headers.get('Host')
+        self._send_json(200, {"file": {
+            "name": name,
+            "mimeType": self.headers.get('Content-Type', 'application/octet-stream'),
+            "sizeBytes": str(len(raw)),
+            "createTime": now.isoformat().replace('+00:00', 'Z'),
+            "expirationTime": (now + timedelta(hours=48)).isoformat().replace('+00:00', 'Z'),
+            "uri": f"http://{host}/{base}/{name}",
+            "state": "ACTIVE",
+        }})
+
+    def _proxy(self, path, raw):
+        """Record mode: forward to the real API and save successful generateContent answers."""
+        headers = {name: value for name, value in self.headers.items()
+                   if name.lower() not in ('host', 'content-length', 'connection', 'accept-encoding')}
+        streaming = path.endswith(':streamGenerateContent')
+        upstream = requests.post(self.state.args.upstream.rstrip('/') + self.path, data=raw, headers=headers,
+                                 stream=streaming, timeout=(10, 300))
+        if not streaming:
+            excluded = ('content-length', 'content-encoding', 'transfer-encoding', 'connection')
+            self.send_response(upstream.status_code)
+            for name, value in upstream.headers.items():
+                if name.lower() not in excluded:
+                    self.send_header(name, value)
+            self.send_header('Content-Length', str(len(upstream.content)))
+            self.end_headers()
+            self.wfile.write(upstream.content)
+            if upstream.status_code == 200 and path.endswith(':generateContent'):
+                self.state.record(classify(json.loads(raw or b'{}')), upstream.json())
+            return
+
+        # Relay the stream as it arrives and record the joined text as one response
+        self.send_response(upstream.status_code)
+        self.send_header('Content-Type', upstream.headers.get('Content-Type', 'text/event-stream'))
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+        texts, last = [], {}
+        with upstream:
+            for line in upstream.iter_lines():
+                event = line + b'\r\n'
+                self.wfile.write(b'%x\r\n%s\r\n' % (len(event), event))
+                self.wfile.flush()
+                if line.startswith(b'data:'):
+                    try:
+                        last = json.loads(line[5:])
+                    except ValueError:
+                        continue
+                    texts.append(response_text(last))
+        self.wfile.write(b'0\r\n\r\n')
+        if upstream.status_code == 200 and texts:
+            last.setdefault('candidates', [{}])[0]['content'] = {"parts": [{"text": ''.join(texts)}], "role": "model"}
+            self.state.record(classify(json.loads(raw or b'{}')), last)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Offline Gemini API stand-in for load testing')
+    parser.add_argument('--host', default='127.0.0.1', help='Bind address (default: 127.0.0.1)')
+    parser.add_argument('--port', type=int, default=8089, help='Port (default: 8089)')
+    parser.add_argument('--fixtures', default=DEFAULT_FIXTURES, help='Recorded responses JSON file')
+    parser.add_argument('--latency', default='lognormal:0.8,0.4',
+                        help='Latency distribution: fixed:S, uniform:LO,HI, normal:MEAN,SD, lognormal:MEDIAN,SIGMA, exp:MEAN')
+    parser.add_argument('--chunk-chars', type=int, default=40, help='Characters per streamed SSE chunk (default: 40)')
+    parser.add_argument('--chunk-delay', type=float, default=0.05, help='Seconds between streamed chunks (default: 0.05)')
+    parser.add_argument('--error-429', type=float, default=0.0, help='Fraction of calls answered 429')
+    parser.add_argument('--error-500', type=float, default=0.0, help='Fraction of calls answered 500')
+    parser.add_argument('--error-503', type=float, default=0.0, help='Fraction of calls answered 503')
+    parser.add_argument('--retry-after', type=float, default=1.0, help='Retry-After seconds sent with 429s (0 to omit)')
+    parser.add_argument('--timeout-rate', type=float, default=0.0, help='Fraction of calls that hang and then drop')
+    parser.add_argument('--timeout-hang', type=float, default=90.0, help='Seconds a timed-out call hangs (default: 90)')
+    parser.add_argument('--seed', type=int, help='Random seed for reproducible runs')
+    parser.add_argument('--record', action='store_true', help='Proxy to --upstream and append answers to the fixtures')
+    parser.add_argument('--upstream', default='https://generativelanguage.googleapis.com', help='Real API host for --record')
+    parser.add_argument('--quiet', action='store_true', help='Do not log each request')
+    args = parser.parse_args()
+
+    if args.seed is not None:
+        random.seed(args.seed)
+    StandinHandler.state = StandinState(args)
+    server = ThreadingHTTPServer((args.host, args.port), StandinHandler)
+    server.daemon_threads = True
+    mode = f"recording from {args.upstream}" if args.record else f"latency {args.latency}"
+    print(f"Gemini stand-in on http://{args.host}:{args.port}/v1beta ({mode}); stats at /stats")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("\nStopped")
+    finally:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()
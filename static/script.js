@@ -314,6 +314,12 @@ document.addEventListener("DOMContentLoaded", function() {
             if (bypassTimeFlag && bypassTimeFlag.value === "true") {
                 fd.delete("time");
             }
+            // Ask the server to stream the Complete Prompt instead of waiting for it
+            if (window.EventSource) {
+                fd.append("stream", "true");
+            }
+            // Let the server run Gemini in its async pipeline and hand back a job to poll
+            fd.append("async", "true");
 
             fetch(form.action || "/", {
                 method: "POST",
@@ -323,7 +329,13 @@ document.addEventListener("DOMContentLoaded", function() {
                 body: fd
             }).then(async (resp) => {
                 if (!resp.ok) throw new Error("Network response was not ok");
-                const text = await resp.text();
+                let text;
+                if (resp.status === 202) {
+                    const job = await resp.json();
+                    text = await waitForPromptJob(job.status_url);
+                } else {
+                    text = await resp.text();
+                }
                 // Replace results container inner HTML
                 if (resultsContainer) {
                     resultsContainer.innerHTML = text;
@@ -331,6 +343,7 @@ document.addEventListener("DOMContentLoaded", function() {
                 // Re-bind dynamic buttons
                 bindRegenerateButton();
                 bindCopyButtons();
+                startPromptStream();
                 // Hide loading
                 if (loadingIndicator) loadingIndicator.style.display = "none";
                 if (submitBtn) submitBtn.disabled = false;
@@ -1518,6 +1531,7 @@ function regenerateFromJson() {
             // Debug echo functionality removed
 
             let resultsFetched = false; // Flag to prevent duplicate result fetching
+            const statusWatch = watchGenerationJob(jobId);
             
             const poll = setInterval(() => {
                 // Update elapsed time in progress indicator
@@ -1528,17 +1542,15 @@ function regenerateFromJson() {
                         : `<div class='progress-text'>🎨 生成圖片中... ${elapsed}s</div>`;
                 }
                 
-                fetch(`/generation_status/${jobId}`)
-                    .then(async r => {
-                        if (!r.ok) {
-                            const txt = await r.text().catch(() => "<no-body>");
-                            throw new Error(`HTTP ${r.status}: ${txt}`);
-                        }
-                        const s = await r.json().catch(async (e) => {
-                            const txt = await r.text().catch(() => "<no-body>");
-                            throw new Error(`Invalid JSON response: ${txt}`);
-                        });
+                statusWatch.read()
+                    .then(s => {
+                        if (!s) return;  // Stream open, no status pushed yet
                         if (s.error) throw new Error(s.error);
+                        if (s.queue_position && imageProgress) {
+                            imageProgress.innerHTML = document.documentElement.getAttribute("data-lang") === "en"
+                                ? `<div class='progress-text'>⏳ Queued (position ${s.queue_position})... ${elapsed}s</div>`
+                                : `<div class='progress-text'>⏳ 排隊中（第 ${s.queue_position} 位）... ${elapsed}s</div>`;
+                        }
                         if (s.status === "done" && !resultsFetched) {
                             const startGalleryFetch = () => {
                                 clearInterval(poll);
@@ -1678,6 +1690,7 @@ function regenerateFromJson() {
                         }
                     }).catch(err => {
                         clearInterval(poll);
+                        statusWatch.close();
                         console.error("Polling error:", err);
                         const msg = document.documentElement.getAttribute("data-lang") === "en"
                             ? `Generation polling failed: ${err.message}`
@@ -1719,6 +1732,109 @@ function regenerateFromJson() {
 }
 
 // Notification function
+// Poll an async prompt job until it finishes; resolves with the results HTML
+async function waitForPromptJob(statusUrl) {
+    while (true) {
+        const resp = await fetch(statusUrl);
+        if (!resp.ok) throw new Error("Prompt job not found");
+        const data = await resp.json();
+        if (data.status === "completed") return data.html;
+        if (data.status === "failed") throw new Error(data.error || "Prompt job failed");
+        await new Promise(resolve => setTimeout(resolve, 300));
+    }
+}
+
+// Jobs still running in this tab; they are cancelled if the user leaves the page
+const activeGenerationJobs = new Set();
+window.addEventListener("pagehide", function() {
+    activeGenerationJobs.forEach(jobId => {
+        fetch(`/generation/${jobId}`, { method: "DELETE", keepalive: true }).catch(() => {});
+    });
+});
+
+function isFinishedJobStatus(status) {
+    return status === "done" || status === "error" || status === "cancelled";
+}
+
+// Follow a generation job's status; read() resolves with the latest status, or null before the first event.
+// Uses the server's SSE stream when available and falls back to long-polling /generation_status.
+function watchGenerationJob(jobId) {
+    let latest = null;
+    let source = null;
+    let inFlight = false;
+    const remember = function(status) {
+        latest = status;
+        if (isFinishedJobStatus(latest.status)) {
+            activeGenerationJobs.delete(jobId);
+            if (source) source.close();
+        }
+        return latest;
+    };
+    activeGenerationJobs.add(jobId);
+    if (window.EventSource) {
+        source = new EventSource(`/generation_events/${jobId}`);
+        const onStatus = e => remember(JSON.parse(e.data));
+        ["progress", "done", "failed", "cancelled"].forEach(name => source.addEventListener(name, onStatus));
+    }
+    return {
+        read() {
+            // While the stream is open (or reconnecting) the last pushed status is current
+            if (source && source.readyState !== EventSource.CLOSED) return Promise.resolve(latest);
+            if (latest && isFinishedJobStatus(latest.status)) return Promise.resolve(latest);
+            // One long-poll at a time; it returns as soon as the job's version moves past ours
+            if (inFlight) return Promise.resolve(latest);
+            inFlight = true;
+            const since = latest ? latest.version : 0;
+            return fetch(`/generation_status/${jobId}?since=${since}&wait=25`).then(async r => {
+                if (!r.ok) {
+                    const txt = await r.text().catch(() => "<no-body>");
+                    throw new Error(`HTTP ${r.status}: ${txt}`);
+                }
+                return remember(await r.json().catch(async (e) => {
+                    const txt = await r.text().catch(() => "<no-body>");
+                    throw new Error(`Invalid JSON response: ${txt}`);
+                }));
+            }).finally(() => {
+                inFlight = false;
+            });
+        },
+        close() {
+            if (source) source.close();
+        }
+    };
+}
+
+// Fill the Complete Prompt textarea from the server's SSE stream
+function startPromptStream() {
+    const textArea = document.getElementById("promptTextArea");
+    if (!textArea || !textArea.dataset.streamUrl || !window.EventSource) return;
+
+    const source = new EventSource(textArea.dataset.streamUrl);
+    textArea.removeAttribute("data-stream-url");
+
+    source.onmessage = function(e) {
+        const data = JSON.parse(e.data);
+        if (data.text) {
+            textArea.value += data.text;
+        }
+    };
+    source.addEventListener("done", function() {
+        source.close();
+        const generateVoiceBtn = document.getElementById("generateVoiceBtn");
+        if (generateVoiceBtn && textArea.value.trim()) {
+            generateVoiceBtn.disabled = false;
+            generateVoiceBtn.style.opacity = "1";
+        }
+    });
+    source.addEventListener("error", function(e) {
+        source.close();
+        if (e.data) {
+            const data = JSON.parse(e.data);
+            showNotification(data.error || "Prompt stream failed", "error");
+        }
+    });
+}
+
 function showNotification(message, type = 'info') {
     // Create notification element
     const notification = document.createElement('div');
@@ -2017,20 +2133,14 @@ function generateVoiceFromText(text) {
                 : "<div class='progress-text'>🔄 開始語音生成...</div>";
         }
         
+        const statusWatch = watchGenerationJob(jobId);
         pollInterval = setInterval(() => {
             pollAttempts++;
             
-            // Check job status using the generation_status endpoint
-            fetch(`/generation_status/${jobId}`, {
-                method: 'GET'
-            })
-            .then(response => {
-                if (!response.ok) {
-                    throw new Error(`HTTP ${response.status}: ${response.statusText}`);
-                }
-                return response.json();
-            })
+            // Check job status (pushed over SSE, or fetched from generation_status)
+            statusWatch.read()
             .then(data => {
+                if (!data) return;  // Stream open, no status pushed yet
                 const elapsed = Math.round((Date.now() - startTime) / 1000);
                 
                 if (data.status === 'done') {
@@ -2056,8 +2166,8 @@ function generateVoiceFromText(text) {
                     }
                     
                     resetVoiceGenerationState();
-                } else if (data.status === 'error') {
-                    // Voice generation failed
+                } else if (data.status === 'error' || data.status === 'cancelled') {
+                    // Voice generation failed or was cancelled
                     clearInterval(pollInterval);
                     pollInterval = null;
                     
@@ -2072,7 +2182,11 @@ function generateVoiceFromText(text) {
                 } else {
                     // Still in progress - update progress indicator
                     const progressPercent = data.progress || 0;
-                    if (voiceProgress) {
+                    if (voiceProgress && data.queue_position) {
+                        voiceProgress.innerHTML = document.documentElement.getAttribute("data-lang") === "en"
+                            ? `<div class='progress-text'>⏳ Queued (position ${data.queue_position})... (${elapsed}s)</div>`
+                            : `<div class='progress-text'>⏳ 排隊中（第 ${data.queue_position} 位）... (${elapsed}秒)</div>`;
+                    } else if (voiceProgress) {
                         voiceProgress.innerHTML = document.documentElement.getAttribute("data-lang") === "en" 
                             ? `<div class='progress-text'>🎵 Voice generation in progress... ${progressPercent}% (${elapsed}s)</div>` 
                             : `<div class='progress-text'>🎵 語音生成進行中... ${progressPercent}% (${elapsed}秒)</div>`;
@@ -2087,6 +2201,7 @@ function generateVoiceFromText(text) {
             if (pollAttempts >= maxPollAttempts) {
                 clearInterval(pollInterval);
                 pollInterval = null;
+                statusWatch.close();
                 showNotification(
                     document.documentElement.getAttribute("data-lang") === "en" 
                         ? "⏰ Voice generation timeout - please check manually" 
@@ -2164,7 +2279,10 @@ function generateVoiceFromText(text) {
     .then(response => {
         clearTimeout(requestTimeout);
         if (!response.ok) {
-            throw new Error(`HTTP ${response.status}: ${response.statusText}`);
+            // 429 carries a readable "queue is full" message
+            return response.json().catch(() => ({})).then(body => {
+                throw new Error(body.error || `HTTP ${response.status}: ${response.statusText}`);
+            });
         }
         return response.json();
     })
@@ -0,0 +1,80 @@
+import socket
+import threading
+import time
+
+import pytest
+import requests
+
+from api.cancellation import CancelToken, JobCancelled, abortable_post
+
+
+class SilentServer:
+    """Accepts one connection and reads from it slowly without ever responding."""
+
+    def __init__(self):
+        self.listener = socket.socket()
+        self.listener.bind(('127.0.0.1', 0))
+        self.listener.listen(1)
+        self.url = f"http://127.0.0.1:{self.listener.getsockname()[1]}/generate"
+        self.connected = threading.Event()
+        self.disconnected = threading.Event()
+        threading.Thread(target=self._serve, daemon=True).start()
+
+    def _serve(self):
+        conn, _ = self.listener.accept()
+        self.connected.set()
+        conn.settimeout(10)
+        try:
+            while conn.recv(65536):
+                time.sleep(0.01)
+        except OSError:
+            pass
+        self.disconnected.set()
+        conn.close()
+
+    def close(self):
+        self.listener.close()
+
+
+@pytest.fixture
+def server():
+    server = SilentServer()
+    yield server
+    server.close()
+
+
+def helper_threads():
+    return [thread for thread in threading.enumerate() if thread.name == 'abortable-post']
+
+
+def test_cancel_returns_at_once_and_tears_down_connection(server):
+    token = CancelToken()
+    threading.Timer(0.3, token.cancel).start()
+    started = time.monotonic()
+    with pytest.raises(JobCancelled):
+        abortable_post(server.url, token, files={'reference_audio': ('sample.wav', b"x" * (64 << 20))}, timeout=30)
+    assert time.monotonic() - started < 2
+    assert server.connected.is_set()
+    # The server sees the connection go away instead of the upload carrying on
+    assert server.disconnected.wait(3)
+    deadline = time.monotonic() + 3
+    while helper_threads() and time.monotonic() < deadline:
+        time.sleep(0.05)
+    assert not helper_threads()
+
+
+def test_already_cancelled_token_sends_nothing(server):
+    token = CancelToken()
+    token.cancel()
+    with pytest.raises(JobCancelled):
+        abortable_post(server.url, token, data=b'x')
+    assert not server.connected.wait(0.2)
+
+
+def test_errors_are_raised_in_caller():
+    listener = socket.socket()
+    listener.bind(('127.0.0.1', 0))
+    port = listener.getsockname()[1]
+    listener.close()
+    with pytest.raises(requests.ConnectionError):
+        abortable_post(f"http://127.0.0.1:{port}/", CancelToken(), data=b'x', timeout=5)
@@ -0,0 +1,76 @@
+import pytest
+
+from api.job_store import MemoryJobStore
+
+
+class NoResults:
+    def get(self, key):
+        return None
+
+
+class Executor:
+    def __init__(self):
+        self.cancelled = []
+
+    def cancel(self, kind, job_id):
+        self.cancelled.append(job_id)
+        return False
+
+
+@pytest.fixture
+def app_module(monkeypatch, tmp_path):
+    monkeypatch.chdir(tmp_path)
+    app = pytest.importorskip('app')
+    store = MemoryJobStore(sweep_interval=3600)
+    executor = Executor()
+    monkeypatch.setattr(app, 'generation_jobs', store)
+    monkeypatch.setattr(app, 'get_job_executor', lambda: executor)
+    app.executor = executor
+    return app
+
+
+def test_shared_job_runs_until_last_subscriber_cancels(app_module):
+    store = app_module.generation_jobs
+    store.create('shared', {'status': 'processing', 'type': 'image'})
+    # A second identical fixed-seed request attached to the run
+    assert store.subscribe('shared')
+    client = app_module.app.test_client()
+
+    response = client.delete('/generation/shared')
+    assert response.status_code == 200
+    assert response.get_json()['status'] == 'detached'
+    assert store.get('shared')['status'] == 'processing'
+    assert app_module.executor.cancelled == []
+
+    response = client.delete('/generation/shared')
+    assert response.get_json()['status'] == 'cancelled'
+    assert store.get('shared')['status'] == 'cancelled'
+    assert app_module.executor.cancelled == ['shared']
+
+    assert client.delete('/generation/shared').status_code == 409
+    assert client.delete('/generation/missing').status_code == 404
+
+
+def test_unshared_job_is_cancelled_at_once(app_module):
+    app_module.generation_jobs.create('solo', {'status': 'pending', 'type': 'voice'})
+    response = app_module.app.test_client().delete('/generation/solo')
+    assert response.get_json()['status'] == 'cancelled'
+    assert app_module.executor.cancelled == ['solo']
+
+
+def test_identical_request_subscribes_to_running_job(app_module, monkeypatch):
+    monkeypatch.setattr(app_module, 'image_generation_key', lambda *args: 'same-workflow')
+    monkeypatch.setattr(app_module, 'active_generations', {})
+    monkeypatch.setattr(app_module, 'generation_results', NoResults())
+
+    def queue(kind, job_id, job, fn, *args):
+        app_module.generation_jobs.create(job_id, job)
+        return 1, None
+
+    monkeypatch.setattr(app_module, 'queue_generation_job', queue)
+    app_module.executor.position = lambda kind, job_id: 1
+    with app_module.app.test_request_context('/'):
+        first, _, reused, _ = app_module.queue_image_job({'status': 'pending', 'type': 'image'}, {}, 42)
+        second, _, attached, _ = app_module.queue_image_job({'status': 'pending', 'type': 'image'}, {}, 42)
+    assert (reused, attached, second) == (None, 'attached', first)
+    assert app_module.generation_jobs.get(first)['subscribers'] == 2
@@ -0,0 +1,88 @@
+import pytest
+
+from api import comfyui_client
+
+
+class FakeComfyUI:
+    """Stands in for ComfyUIClient and records which prompts were cancelled."""
+
+    instances = []
+
+    def __init__(self, server_address=None, port=None):
+        self.queued = []
+        self.cancelled = []
+        FakeComfyUI.instances.append(self)
+
+    def queue_prompt(self, workflow, client_id):
+        prompt_id = f"prompt-{len(self.queued)}"
+        self.queued.append(prompt_id)
+        return {'prompt_id': prompt_id}
+
+    def cancel_prompt(self, prompt_id):
+        self.cancelled.append(prompt_id)
+        return True
+
+
+@pytest.fixture
+def comfyui(monkeypatch):
+    FakeComfyUI.instances = []
+    monkeypatch.setattr(comfyui_client, 'ComfyUIClient', FakeComfyUI)
+    monkeypatch.setattr(comfyui_client, 'build_batch_workflows',
+                        lambda prompt_text, negative_prompt='', seeds=None, count=1: [{} for _ in seeds])
+    monkeypatch.setattr(comfyui_client, '_download_images',
+                        lambda client, history, prompt_id, output_dir: [f"{prompt_id}.png"])
+    return FakeComfyUI
+
+
+def test_failed_prompt_drops_rest_of_batch(comfyui, monkeypatch, tmp_path):
+    monkeypatch.setattr(comfyui_client, '_wait_for_history',
+                        lambda client, prompt_id, progress, token: None if prompt_id == 'prompt-1' else {'ok': True})
+    assert comfyui_client.generate_images('a cat', output_dir=str(tmp_path), seeds=[1, 2, 3, 4], count=4) is None
+    client = comfyui.instances[0]
+    assert client.queued == ['prompt-0', 'prompt-1', 'prompt-2', 'prompt-3']
+    # Queued prompts go first, then the failed one in case it is still running
+    assert client.cancelled == ['prompt-3', 'prompt-2', 'prompt-1']
+
+
+def test_successful_batch_cancels_nothing(comfyui, monkeypatch, tmp_path):
+    monkeypatch.setattr(comfyui_client, '_wait_for_history', lambda client, prompt_id, progress, token: {'ok': True})
+    images = comfyui_client.generate_images('a cat', output_dir=str(tmp_path), seeds=[1, 2], count=2)
+    assert images == ['prompt-0.png', 'prompt-1.png']
+    assert comfyui.instances[0].cancelled == []
+
+
+@pytest.fixture
+def app_module(monkeypatch, tmp_path):
+    monkeypatch.chdir(tmp_path)
+    return pytest.importorskip('app')
+
+
+@pytest.mark.parametrize('body, seed, expected', [
+    ({'seeds': [1, 2], 'count': 2}, None, ([1, 2], 2)),
+    ({'count': 3}, 7, (None, 3)),
+    ({}, None, (None, 1)),
+])
+def test_requested_image_batch(app_module, body, seed, expected):
+    with app_module.app.test_request_context('/', method='POST', json=body):
+        seeds, count, invalid = app_module.requested_image_batch(seed)
+    assert invalid is None
+    assert (seeds, count) == expected
+
+
+@pytest.mark.parametrize('body, seed', [
+    ({'seeds': [1, 2], 'count': 2}, 5),
+    ({'seeds': [1, 1], 'count': 2}, None),
+    ({'seeds': [1, 2], 'count': 3}, None),
+    ({'count': 0}, None),
+])
+def test_requested_image_batch_rejects(app_module, body, seed):
+    with app_module.app.test_request_context('/', method='POST', json=body):
+        _, _, invalid = app_module.requested_image_batch(seed)
+    assert invalid[1] == 400
+
+
+def test_seed_and_seeds_form_fields_conflict(app_module):
+    with app_module.app.test_request_context('/', method='POST', data={'seeds': '1,2', 'seed': '9'}):
+        _, _, invalid = app_module.requested_image_batch(9)
+    assert invalid[1] == 400
+    assert 'not both' in invalid[0].get_json()['error']
@@ -0,0 +1,74 @@
+import pytest
+
+from api.gemini_client import GeminiClient
+from api.image_references import file_reference_rejected
+
+
+class FakeResponse:
+    def __init__(self, status_code, text='', headers=None, body=None):
+        self.status_code = status_code
+        self.text = text
+        self.headers = headers or {}
+        self.body = body
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise AssertionError(f"unexpected {self.status_code}")
+
+    def json(self):
+        return self.body
+
+    def close(self):
+        pass
+
+
+@pytest.mark.parametrize('status_code, text, expected', [
+    (403, 'You do not have permission to access the File abc or it may not exist.', True),
+    (404, '', True),
+    (400, 'The File abc is not in an ACTIVE state and usage is not allowed.', True),
+    (400, 'Invalid or expired file URI: files/abc', True),
+    (400, 'Invalid JSON payload received. Unknown name "foo" at generation_config.', False),
+    (400, '* GenerateContentRequest.contents: contents is not specified', False),
+    (400, 'Invalid JSON payload received. Unknown name "file_data" at contents[0].parts[0].', False),
+    (500, 'file not found', False),
+    (200, '', False),
+])
+def test_file_reference_rejected(status_code, text, expected):
+    assert file_reference_rejected(FakeResponse(status_code, text)) is expected
+
+
+def test_unreadable_or_missing_response_is_not_a_file_error():
+    class Streamed:
+        status_code = 400
+
+        @property
+        def text(self):
+            raise RuntimeError('body not read')
+
+    assert not file_reference_rejected(Streamed())
+    assert not file_reference_rejected(None)
+
+
+def test_upload_goes_through_rate_limiter(monkeypatch):
+    client = GeminiClient(api_key='key')
+    posts = []
+
+    def post(url, **kwargs):
+        posts.append(url)
+        if len(posts) == 1:
+            return FakeResponse(200, headers={'X-Goog-Upload-URL': 'https://upload/session'})
+        return FakeResponse(200, body={'file': {'uri': 'files/abc', 'state': 'ACTIVE'}})
+
+    limited = []
+    real_call = client.limiter.call
+
+    def call(send, hold=False):
+        limited.append(send)
+        return real_call(send, hold)
+
+    monkeypatch.setattr(client.session, 'post', post)
+    monkeypatch.setattr(client.limiter, 'call', call)
+    assert client.upload_file(b'x' * 10, 'image/jpeg')['uri'] == 'files/abc'
+    assert len(posts) == 2
+    assert len(limited) == 2
+    assert client.limiter.stats()['attempts'] == 2
@@ -0,0 +1,166 @@
+import threading
+
+import pytest
+
+from api.job_executor import JobPool, QueueFull
+from api.job_store import MemoryJobStore
+
+
+def make_pool(**kwargs):
+    kwargs.setdefault('workers', 1)
+    kwargs.setdefault('max_pending', 50)
+    kwargs.setdefault('expected_duration', 10)
+    return JobPool('image', **kwargs)
+
+
+class Recorder:
+    """Job function that records the order jobs ran in; the first job waits for ``gate``."""
+
+    def __init__(self, expected):
+        self.order = []
+        self.gate = threading.Event()
+        self.blocking = threading.Event()
+        self.done = threading.Event()
+        self.expected = expected
+        self.lock = threading.Lock()
+
+    def __call__(self, job_id):
+        if job_id == 'blocker':
+            self.blocking.set()
+            self.gate.wait(5)
+            return
+        with self.lock:
+            self.order.append(job_id)
+            if len(self.order) == self.expected:
+                self.done.set()
+
+
+def occupy(pool, recorder):
+    """Keep the single worker busy until ``recorder.gate`` is set."""
+    pool.submit('blocker', recorder, client='other')
+    assert recorder.blocking.wait(5)
+
+
+def run_queued(pool, recorder, submissions):
+    """Occupy the single worker, queue ``submissions``, then let them all run."""
+    occupy(pool, recorder)
+    for job_id, client, priority in submissions:
+        pool.submit(job_id, recorder, client=client, priority=priority)
+    recorder.gate.set()
+    assert recorder.done.wait(5)
+    return recorder.order
+
+
+def test_light_client_is_not_starved_by_heavy_client():
+    pool = make_pool(max_pending_per_client=50)
+    submissions = [(f'heavy-{i}', 'heavy', 'interactive') for i in range(10)]
+    submissions += [('light-0', 'light', 'interactive'), ('light-1', 'light', 'interactive')]
+    order = run_queued(pool, Recorder(12), submissions)
+    # Queued after all ten heavy jobs, yet the light client's jobs alternate with them
+    assert order.index('light-0') <= 1
+    assert order.index('light-1') <= 3
+    assert [job for job in order if job.startswith('heavy')] == [f'heavy-{i}' for i in range(10)]
+
+
+def test_interactive_flow_gets_larger_share_than_batch():
+    pool = make_pool(max_pending_per_client=50)
+    submissions = [(f'batch-{i}', 'a', 'batch') for i in range(4)]
+    submissions += [(f'interactive-{i}', 'b', 'interactive') for i in range(4)]
+    order = run_queued(pool, Recorder(8), submissions)
+    # Weights 4:1, so one batch job runs per four interactive ones
+    assert [job.split('-')[0] for job in order[:5]].count('batch') == 1
+    assert order[5:] == ['batch-1', 'batch-2', 'batch-3']
+
+
+def test_running_cap_per_client():
+    started = []
+    gate = threading.Event()
+    both_running = threading.Event()
+
+    def job(job_id):
+        started.append(job_id)
+        if len(started) == 2:
+            both_running.set()
+        gate.wait(5)
+
+    pool = make_pool(workers=2, max_running_per_client=1)
+    pool.submit('heavy-0', job, client='heavy')
+    pool.submit('heavy-1', job, client='heavy')
+    pool.submit('light-0', job, client='light')
+    assert both_running.wait(5)
+    assert sorted(started) == ['heavy-0', 'light-0']
+    assert pool.position('heavy-1') == 1
+    gate.set()
+
+
+def test_per_client_pending_cap_raises_queue_full_with_retry_after():
+    recorder = Recorder(0)
+    pool = make_pool(max_pending_per_client=2, expected_duration=12)
+    occupy(pool, recorder)
+    pool.submit('heavy-0', recorder, client='heavy')
+    pool.submit('heavy-1', recorder, client='heavy')
+    with pytest.raises(QueueFull) as excinfo:
+        pool.submit('heavy-2', recorder, client='heavy')
+    assert excinfo.value.client == 'heavy'
+    assert excinfo.value.retry_after == 12
+    # Other clients still get in
+    assert pool.submit('light-0', recorder, client='light') == 2
+    assert pool.stats()['rejected_client'] == 1
+    recorder.gate.set()
+
+
+def test_total_pending_cap_raises_queue_full():
+    recorder = Recorder(0)
+    pool = make_pool(max_pending=2, expected_duration=5)
+    occupy(pool, recorder)
+    pool.submit('a', recorder, client='a')
+    pool.submit('b', recorder, client='b')
+    with pytest.raises(QueueFull) as excinfo:
+        pool.submit('c', recorder, client='c')
+    assert excinfo.value.client is None
+    assert excinfo.value.retry_after == 5
+    recorder.gate.set()
+
+
+def test_cancel_pending_job():
+    recorder = Recorder(1)
+    pool = make_pool(max_pending_per_client=2)
+    occupy(pool, recorder)
+    pool.submit('a', recorder, client='heavy')
+    pool.submit('b', recorder, client='heavy')
+    assert pool.cancel('a')
+    assert not pool.cancel('a')
+    assert pool.position('a') is None
+    assert pool.position('b') == 1
+    # The cancelled job frees the client's queue slot
+    pool.submit('c', recorder, client='heavy')
+    pool.cancel('c')
+    recorder.gate.set()
+    assert recorder.done.wait(5)
+    assert recorder.order == ['b']
+    assert pool.stats()['cancelled'] == 2
+
+
+def test_queue_full_becomes_429_with_retry_after(monkeypatch, tmp_path):
+    monkeypatch.chdir(tmp_path)
+    app = pytest.importorskip('app')
+    recorder = Recorder(0)
+    pool = make_pool(max_pending_per_client=1, expected_duration=7)
+    occupy(pool, recorder)
+    pool.submit('queued', recorder, client='127.0.0.1')
+
+    class Executor:
+        def submit(self, kind, job_id, fn, *args, client=None, priority='interactive'):
+            return pool.submit(job_id, fn, *args, client=client, priority=priority)
+
+    store = MemoryJobStore(sweep_interval=3600)
+    monkeypatch.setattr(app, 'generation_jobs', store)
+    monkeypatch.setattr(app, 'get_job_executor', Executor)
+    with app.app.test_request_context('/', method='POST', environ_base={'REMOTE_ADDR': '127.0.0.1'}):
+        position, response = app.queue_generation_job('image', 'rejected', {'status': 'pending'}, recorder)
+    recorder.gate.set()
+    assert position is None
+    assert response.status_code == 429
+    assert response.headers['Retry-After'] == '7'
+    assert response.get_json()['retry_after'] == 7
+    assert store.get('rejected') is None
@@ -0,0 +1,161 @@
+import os
+import socket
+import subprocess
+import sys
+import threading
+import time
+
+import pytest
+
+from api import job_store
+from api.job_store import MemoryJobStore, SQLiteJobStore
+
+
+@pytest.fixture(params=['memory', 'sqlite'])
+def store(request, tmp_path):
+    settings = dict(ttl=60, max_entries=100, sweep_interval=3600)
+    if request.param == 'memory':
+        return MemoryJobStore(**settings)
+    return SQLiteJobStore(str(tmp_path / 'jobs.sqlite3'), **settings)
+
+
+def dead_owner():
+    process = subprocess.Popen([sys.executable, '-c', 'pass'])
+    process.wait()
+    return f"{socket.gethostname()}:{process.pid}"
+
+
+def test_update_bumps_version(store):
+    store.create('a', {'status': 'pending', 'progress': 0})
+    version = store.get('a')['version']
+    assert store.update('a', status='processing', progress=10)
+    job = store.get('a')
+    assert job['version'] == version + 1
+    assert (job['status'], job['progress']) == ('processing', 10)
+    assert not store.update('missing', progress=1)
+
+
+def test_cancelled_job_is_terminal(store):
+    store.create('a', {'status': 'pending'})
+    assert store.cancel('a', error='stopped')
+    assert not store.update('a', status='done', progress=100)
+    assert not store.update('a', status='processing')
+    assert not store.cancel('a')
+    job = store.get('a')
+    assert (job['status'], job['error']) == ('cancelled', 'stopped')
+
+
+def test_finished_jobs_cannot_be_cancelled(store):
+    store.create('a', {'status': 'processing'})
+    assert store.update('a', status='done')
+    assert not store.cancel('a')
+    assert store.get('a')['status'] == 'done'
+
+
+def test_wait_for_change_returns_on_version_bump(store):
+    store.create('a', {'status': 'processing', 'progress': 0})
+    since = store.get('a')['version']
+    timer = threading.Timer(0.2, store.update, args=('a',), kwargs={'progress': 50})
+    timer.start()
+    started = time.monotonic()
+    job = store.wait_for_change('a', since=since, timeout=5)
+    timer.join()
+    assert job['version'] > since
+    assert job['progress'] == 50
+    assert time.monotonic() - started < 2
+
+
+def test_wait_for_change_times_out_without_a_change(store):
+    store.create('a', {'status': 'processing'})
+    since = store.get('a')['version']
+    started = time.monotonic()
+    job = store.wait_for_change('a', since=since, timeout=0.3)
+    assert job['version'] == since
+    assert time.monotonic() - started >= 0.3
+
+
+def test_wait_for_change_returns_at_once_for_stale_or_finished(store):
+    store.create('a', {'status': 'processing'})
+    store.update('a', progress=1)
+    assert store.wait_for_change('a', since=0, timeout=5)['progress'] == 1
+    store.update('a', status='done')
+    version = store.get('a')['version']
+    assert store.wait_for_change('a', since=version, timeout=5)['status'] == 'done'
+    assert store.wait_for_change('missing', since=0, timeout=5) is None
+
+
+def test_sweep_drops_expired_finished_jobs_only(store):
+    store.create('done', {'status': 'pending'})
+    store.update('done', status='done')
+    store.create('running', {'status': 'processing'})
+    assert store.sweep(now=time.time() + 120) == 1
+    assert store.get('done') is None
+    assert store.get('running') is not None
+
+
+def test_capacity_evicts_oldest_finished_first(store):
+    store.max_entries = 3
+    for job_id in ('a', 'b', 'c'):
+        store.create(job_id, {'status': 'processing'})
+    store.update('b', status='done')
+    store.update('a', status='error')
+    store.create('d', {'status': 'pending'})
+    store.sweep()
+    assert store.get('b') is None
+    assert [store.get(job_id) is not None for job_id in ('a', 'c', 'd')] == [True, True, True]
+
+
+def test_sqlite_claims_orphans_of_dead_process(tmp_path, monkeypatch):
+    path = str(tmp_path / 'jobs.sqlite3')
+    owner = dead_owner()
+    monkeypatch.setattr(job_store, 'PROCESS_OWNER', owner)
+    previous = SQLiteJobStore(path, sweep_interval=3600)
+    previous.create('orphan', {'status': 'processing'})
+    previous.create('finished', {'status': 'processing'})
+    previous.update('finished', status='done')
+
+    alive_owner = f"{socket.gethostname()}:{os.getpid()}"
+    monkeypatch.setattr(job_store, 'PROCESS_OWNER', alive_owner)
+    current = SQLiteJobStore(path, sweep_interval=3600)
+    claimed = current.claim_orphans()
+    assert [job['id'] for job in claimed] == ['orphan']
+    assert current.get('orphan')['owner'] == alive_owner
+    assert current.claim_orphans() == []
+
+
+def test_sqlite_leaves_jobs_of_live_process(tmp_path, monkeypatch):
+    path = str(tmp_path / 'jobs.sqlite3')
+    monkeypatch.setattr(job_store, 'PROCESS_OWNER', f"{socket.gethostname()}:1")
+    SQLiteJobStore(path, sweep_interval=3600).create('running', {'status': 'processing'})
+    monkeypatch.setattr(job_store, 'PROCESS_OWNER', f"{socket.gethostname()}:{os.getpid()}")
+    assert SQLiteJobStore(path, sweep_interval=3600).claim_orphans() == []
+
+
+def test_sqlite_jobs_are_shared_between_stores(tmp_path):
+    path = str(tmp_path / 'jobs.sqlite3')
+    writer = SQLiteJobStore(path, sweep_interval=3600)
+    reader = SQLiteJobStore(path, sweep_interval=3600)
+    writer.create('a', {'status': 'pending'})
+    assert reader.cancel('a')
+    assert writer.get('a')['status'] == 'cancelled'
+
+
+def test_last_unsubscribe_cancels_shared_job(store):
+    store.create('shared', {'status': 'processing'})
+    assert store.subscribe('shared')
+    assert store.subscribe('shared')
+    assert store.unsubscribe('shared', error='stopped') == 2
+    assert store.unsubscribe('shared', error='stopped') == 1
+    assert store.get('shared')['status'] == 'processing'
+    assert store.unsubscribe('shared', error='stopped') == 0
+    job = store.get('shared')
+    assert (job['status'], job['error']) == ('cancelled', 'stopped')
+    assert store.unsubscribe('shared') is None
+
+
+def test_finished_jobs_take_no_subscribers(store):
+    store.create('a', {'status': 'processing'})
+    store.update('a', status='done')
+    assert not store.subscribe('a')
+    assert store.unsubscribe('a') is None
+    assert store.unsubscribe('missing') is None
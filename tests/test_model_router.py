@@ -0,0 +1,115 @@
+import asyncio
+import threading
+
+from api.model_router import ModelRouter
+
+
+class FakeResponse:
+    def __init__(self, status_code):
+        self.status_code = status_code
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+    async def aclose(self):
+        self.closed = True
+
+
+def make_router(**kwargs):
+    kwargs.setdefault('enabled', True)
+    return ModelRouter('primary', hedge_models=['backup'], default_delay=0.05, min_samples=1000, **kwargs)
+
+
+def scripted_send(script):
+    """``send(model)`` that waits for the model's event, then returns its response."""
+    def send(model):
+        gate, response = script[model]
+        gate.wait(5)
+        return response
+    return send
+
+
+def test_hedging_is_opt_in(monkeypatch):
+    monkeypatch.delenv('GEMINI_HEDGE', raising=False)
+    assert not ModelRouter('primary', hedge_models=['backup']).enabled
+    monkeypatch.setenv('GEMINI_HEDGE', 'true')
+    assert ModelRouter('primary', hedge_models=['backup']).enabled
+
+
+def test_fast_primary_does_not_hedge():
+    router = make_router()
+    response = FakeResponse(200)
+    assert router.call(lambda model: response) is response
+    assert router.stats()['hedges_fired'] == 0
+
+
+def test_backup_wins_and_late_primary_is_closed():
+    router = make_router()
+    primary_gate, backup_gate = threading.Event(), threading.Event()
+    primary, backup = FakeResponse(200), FakeResponse(200)
+    backup_gate.set()
+    result = router.call(scripted_send({'primary': (primary_gate, primary), 'backup': (backup_gate, backup)}))
+    assert result is backup
+    assert not primary.closed
+    primary_gate.set()
+    router._executor.shutdown(wait=True)
+    assert primary.closed
+    assert router.stats()['hedge_wins'] == 1
+
+
+def test_failed_backup_is_closed_when_primary_wins():
+    router = make_router()
+    primary_gate, backup_gate = threading.Event(), threading.Event()
+    primary, backup = FakeResponse(200), FakeResponse(500)
+    backup_gate.set()
+    send = scripted_send({'primary': (primary_gate, primary), 'backup': (backup_gate, backup)})
+    threading.Timer(0.2, primary_gate.set).start()
+    assert router.call(send) is primary
+    assert backup.closed and not primary.closed
+
+
+def test_neither_succeeds_returns_primary_and_closes_backup():
+    router = make_router()
+    primary_gate, backup_gate = threading.Event(), threading.Event()
+    primary, backup = FakeResponse(500), FakeResponse(503)
+    backup_gate.set()
+    threading.Timer(0.2, primary_gate.set).start()
+    result = router.call(scripted_send({'primary': (primary_gate, primary), 'backup': (backup_gate, backup)}))
+    assert result is primary
+    assert backup.closed and not primary.closed
+
+
+def test_async_neither_succeeds_closes_backup():
+    router = make_router()
+    primary, backup = FakeResponse(500), FakeResponse(503)
+
+    async def send(model):
+        await asyncio.sleep(0.2 if model == 'primary' else 0)
+        return primary if model == 'primary' else backup
+
+    assert asyncio.run(router.call_async(send)) is primary
+    assert backup.closed and not primary.closed
+
+
+def test_async_winner_cancels_slow_loser():
+    router = make_router()
+    backup = FakeResponse(200)
+    cancelled = []
+
+    async def send(model):
+        if model == 'backup':
+            return backup
+        try:
+            await asyncio.sleep(5)
+        except asyncio.CancelledError:
+            cancelled.append(model)
+            raise
+
+    async def run():
+        result = await router.call_async(send)
+        await asyncio.sleep(0)
+        return result
+
+    assert asyncio.run(run()) is backup
+    assert cancelled == ['primary']
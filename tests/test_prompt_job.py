@@ -0,0 +1,101 @@
+import asyncio
+import threading
+
+import pytest
+
+
+class LoopThreadRecorder:
+    """Cache stand-in that records which thread each call ran on."""
+
+    def __init__(self, calls):
+        self.calls = calls
+
+    def get(self, *args):
+        self.calls.append(('get', threading.get_ident()))
+        return None
+
+    def set(self, *args):
+        self.calls.append(('set', threading.get_ident()))
+
+
+class FakePipeline:
+    async def run_blocking(self, fn, *args):
+        return await asyncio.get_running_loop().run_in_executor(None, fn, *args)
+
+    def spawn(self, coro):
+        coro.close()
+
+
+@pytest.fixture
+def app_module(monkeypatch, tmp_path):
+    monkeypatch.chdir(tmp_path)
+    return pytest.importorskip('app')
+
+
+def test_blocking_cache_and_store_calls_stay_off_the_loop(app_module, monkeypatch):
+    calls = []
+    monkeypatch.setattr(app_module, 'get_prompt_pipeline', FakePipeline)
+    monkeypatch.setattr(app_module, 'enhance_cache', LoopThreadRecorder(calls))
+    monkeypatch.setattr(app_module, 'rewrite_cache', LoopThreadRecorder(calls))
+
+    async def gemini_call(*args):
+        return {'Scene': 'rainy street'}
+
+    def register(payload, rewrite_key):
+        calls.append(('register', threading.get_ident()))
+        return 'stream-1'
+
+    monkeypatch.setattr(app_module, 'pipeline_gemini_call', gemini_call)
+    monkeypatch.setattr(app_module, 'register_prompt_stream', register)
+    inputs = {
+        'prompt_type': 'image', 'output_lang': 'en', 'creative_mode': False, 'include_ending': False,
+        'multiple_scenes': False, 'time': '16:00', 'extra_desc': 'a cat', 'image_bytes': None,
+        'scene': '其它', 'custom_scene': '', 'character': '其它', 'custom_character': '',
+        'stream': True, 'image_path': None, 'image_url': None, 'client_ip': '127.0.0.1', 'user_agent': '',
+    }
+
+    async def run():
+        return threading.get_ident(), await app_module.generate_prompt_async('job', inputs)
+
+    loop_thread, result = asyncio.run(run())
+    assert result['stream_id'] == 'stream-1'
+    assert [name for name, _ in calls] == ['get', 'set', 'get', 'register']
+    assert all(thread != loop_thread for _, thread in calls)
+
+
+class StaleReferencePipeline(FakePipeline):
+    """Rejects the first payload like an expired Files API reference, then succeeds."""
+
+    def __init__(self):
+        self.payloads = []
+
+    async def generate_content(self, payload):
+        self.payloads.append(payload)
+        if len(self.payloads) == 1:
+            error = Exception('file not found')
+            error.response = type('Response', (), {'status_code': 404})()
+            raise error
+        return {'ok': True}
+
+    async def stage(self, job_id, stage, coro, deadline):
+        return await coro
+
+    async def coalesce(self, key, coro_fn):
+        return await coro_fn()
+
+
+def test_file_reference_retry_counts_one_call(app_module, monkeypatch):
+    pipeline = StaleReferencePipeline()
+    monkeypatch.setattr(app_module, 'get_prompt_pipeline', lambda: pipeline)
+    monkeypatch.setattr(app_module, 'uses_file_reference', lambda payload: True)
+    calls = []
+
+    def build(image, reupload=False):
+        return {'image': image, 'reupload': reupload}
+
+    value = asyncio.run(app_module.pipeline_gemini_call(
+        'job', 'recognition', None, 'key', lambda response: response, build, 'img', on_call=lambda: calls.append(1)
+    ))
+    assert value == {'ok': True}
+    assert [payload['reupload'] for payload in pipeline.payloads] == [False, True]
+    assert calls == [1]
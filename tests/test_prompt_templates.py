@@ -0,0 +1,201 @@
+import itertools
+import json
+
+import pytest
+
+from api.prompt_templates import PromptTemplateRegistry
+
+OUTPUT_LANGS = ('en', 'zh-TW', 'zh-CN', 'zh-tw', 'zh-cn', 'EN', 'ZH-CN', 'fr', '', None)
+PROMPT_JSON = {'Scene': '雨夜的街道', 'lighting': 'neon "glow"'}
+USER_CONTEXT = {'角色': 'a girl', 'time': '夜晚'}
+USER_INPUT = 'a cat on a roof, 黃昏'
+
+
+# The prompt builders as they were written in app.py before the templates moved
+# to api/prompt_templates.json; the registry must render exactly what they did.
+
+def _old_recognition(output_lang, prompt_type, creative_mode, include_ending):
+    # 根據 output_lang 設定 prompt 語言
+    lang_map = {
+        'en': 'English',
+        'zh-TW': 'Traditional Chinese',
+        'zh-CN': 'Simplified Chinese'
+    }
+    prompt_lang = lang_map.get(output_lang, 'English')
+    # Language-specific prompts for image recognition
+    if output_lang == 'en':
+        if prompt_type == 'video':
+            if creative_mode:
+                prompt_text_recog = f"Please analyze this image in detail and output video content in JSON format: Scene, ambiance_or_mood, Location, Visual style, camera motion, lighting{', ending' if include_ending else ''}. Creative Mode: Be highly creative, artistic, and experimental. For 'camera motion', suggest bold, innovative, and cinematic camera movements that push creative boundaries (e.g., 'surreal spiral descent around subject', 'time-delayed tracking through ethereal space', 'anti-gravity orbital shot', 'dreamlike morphing perspective', 'kaleidoscopic rotation sequence', 'poetic flowing transition'). Make the visuals stunning and emotionally powerful. All responses must be in {prompt_lang}."
+            else:
+                prompt_text_recog = f"Please analyze this image in detail and output video content in JSON format: Scene, ambiance_or_mood, Location, Visual style, camera motion, lighting{', ending' if include_ending else ''}. For 'camera motion', suggest creative and cinematic camera movements based on the scene (e.g., tracking shot, crane movement, handheld intimacy, aerial shot, push-pull shot, dolly movement, rotation, etc.). All responses must be in {prompt_lang}."
+        else:
+            if creative_mode:
+                prompt_text_recog = f"Please analyze this image in detail and output in JSON format: Scene, ambiance_or_mood, Location, Visual style, lighting{', ending' if include_ending else ''}. Creative Mode: Be highly artistic, experimental, and imaginative. Push creative boundaries with bold visual concepts, unconventional perspectives, and innovative storytelling approaches. All responses must be in {prompt_lang}."
+            else:
+                prompt_text_recog = f"Please analyze this image in detail and output in JSON format: Scene, ambiance_or_mood, Location, Visual style, lighting{', ending' if include_ending else ''}. All responses must be in {prompt_lang}."
+    elif output_lang == 'zh-CN':
+        if prompt_type == 'video':
+            if creative_mode:
+                prompt_text_recog = f"请详细识别这张图片，并以 json 格式输出视频内容：Scene、ambiance_or_mood、Location、Visual style、camera motion、lighting{'、ending' if include_ending else ''}。创意模式：请极具创意、艺术性和实验性。对于 'camera motion'，请建议大胆、创新且具电影感的摄影机运动，突破创意界限（例如：'围绕主体的超现实螺旋下降'、'穿越飘渺空间的时间延迟追踪'、'反重力轨道镜头'、'梦幻般的变形视角'、'万花筒式旋转序列'、'诗意流动转场'）。让画面视觉震撼且情感强烈。所有回应内容一律使用{prompt_lang}。"
+            else:
+                prompt_text_recog = f"请详细识别这张图片，并以 json 格式输出视频内容：Scene、ambiance_or_mood、Location、Visual style、camera motion、lighting{'、ending' if include_ending else ''}。对于 'camera motion'，请根据场景建议富有创意和电影感的摄影机运动（例如：追踪镜头、升降运动、手持亲密感、空拍镜头、推拉镜头、移动推轨、旋转等）。所有回应内容一律使用{prompt_lang}。"
+        else:
+            if creative_mode:
+                prompt_text_recog = f"请详细识别这张图片，并以 json 格式输出：Scene、ambiance_or_mood、Location、Visual style、lighting{'、ending' if include_ending else ''}。创意模式：请极具艺术性、实验性和想象力。以大胆的视觉概念、非传统的视角和创新的故事叙述方式突破创意界限。所有回应内容一律使用{prompt_lang}。"
+            else:
+                prompt_text_recog = f"请详细识别这张图片，并以 json 格式输出：Scene、ambiance_or_mood、Location、Visual style、lighting{'、ending' if include_ending else ''}。所有回应内容一律使用{prompt_lang}。"
+    else:  # zh-TW and other languages
+        if prompt_type == 'video':
+            if creative_mode:
+                prompt_text_recog = f"請詳細識別這張圖片，並以 json 格式輸出影片內容：Scene、ambiance_or_mood、Location、Visual style、camera motion、lighting{'、ending' if include_ending else ''}。創意模式：請極具創意、藝術性和實驗性。對於 'camera motion'，請建議大膽、創新且具電影感的攝影機運動，突破創意界限（例如：'圍繞主體的超現實螺旋下降'、'穿越飄渺空間的時間延遲追蹤'、'反重力軌道鏡頭'、'夢幻般的變形視角'、'萬花筒式旋轉序列'、'詩意流動轉場'）。讓畫面視覺震撼且情感強烈。所有回應內容一律使用{prompt_lang}。"
+            else:
+                prompt_text_recog = f"請詳細識別這張圖片，並以 json 格式輸出影片內容：Scene、ambiance_or_mood、Location、Visual style、camera motion、lighting{'、ending' if include_ending else ''}。對於 'camera motion'，請根據場景建議富有創意和電影感的攝影機運動（例如：追蹤鏡頭、升降運動、手持親密感、空拍鏡頭、推拉鏡頭、移動推軌、旋轉等）。所有回應內容一律使用{prompt_lang}。"
+        else:
+            if creative_mode:
+                prompt_text_recog = f"請詳細識別這張圖片，並以 json 格式輸出：Scene、ambiance_or_mood、Location、Visual style、lighting{'、ending' if include_ending else ''}。創意模式：請極具藝術性、實驗性和想像力。以大膽的視覺概念、非傳統的視角和創新的故事敘述方式突破創意界限。所有回應內容一律使用{prompt_lang}。"
+            else:
+                prompt_text_recog = f"請詳細識別這張圖片，並以 json 格式輸出：Scene、ambiance_or_mood、Location、Visual style、lighting{'、ending' if include_ending else ''}。所有回應內容一律使用{prompt_lang}。"
+    return prompt_text_recog
+
+
+def _old_fused(user_context, output_lang, creative_mode):
+    lang_map = {
+        'en': 'English',
+        'zh-TW': 'Traditional Chinese',
+        'zh-CN': 'Simplified Chinese'
+    }
+    prompt_lang = lang_map.get(output_lang, 'English')
+    rewrite_instruction = (
+        f"Also fill 'prompt_text': combine all the fields above with these user details "
+        f"{json.dumps(user_context, ensure_ascii=False)} into one highly readable, natural and fluent "
+        f"{prompt_lang} description, omitting all field titles and separators and arranging the order logically."
+    )
+    if creative_mode:
+        rewrite_instruction += " Use poetic, artistic and evocative language that is cinematically rich and visually stunning."
+    return rewrite_instruction
+
+
+def rewrite_system_instruction(output_lang):
+    """Return the system instruction that pins Chinese rewrites to one script, or ''."""
+    if output_lang in ['zh-CN', 'zh-cn']:
+        return "You must respond ONLY in Simplified Chinese (简体中文). Do not use any English words or phrases in your response."
+    elif output_lang in ['zh-TW', 'zh-tw']:
+        return "You must respond ONLY in Traditional Chinese (繁體中文). Do not use any English words or phrases in your response."
+    return ""
+
+
+def _old_rewrite(prompt_json_for_gemini, output_lang, creative_mode):
+    # Gemini prompt 語言 (handle case insensitive)
+    lang_map = {
+        'en': 'English',
+        'zh-TW': 'Traditional Chinese',
+        'zh-CN': 'Simplified Chinese',
+        'zh-tw': 'Traditional Chinese',  # lowercase variant
+        'zh-cn': 'Simplified Chinese'  # lowercase variant
+    }
+    prompt_lang = lang_map.get(output_lang, 'English')
+    if output_lang == 'en':
+        if creative_mode:
+            prompt_for_gemini = f"Please rewrite the following JSON content into a highly readable, natural, and fluent {prompt_lang} description, omitting all field titles and separators, and arranging the order logically. CREATIVE MODE: Use poetic, artistic, and evocative language. Make the description cinematically rich, emotionally engaging, and visually stunning with bold artistic expressions: {json.dumps(prompt_json_for_gemini, ensure_ascii=False)}"
+        else:
+            prompt_for_gemini = f"Please rewrite the following JSON content into a highly readable, natural, and fluent {prompt_lang} description, omitting all field titles and separators, and arranging the order logically: {json.dumps(prompt_json_for_gemini, ensure_ascii=False)}"
+    elif output_lang in ['zh-CN', 'zh-cn']:
+        if creative_mode:
+            prompt_for_gemini = f"请根据以下 json 内容，重新组合成一篇可读性高、自然流畅的{prompt_lang}作品，省略所有栏位标题与分隔符，并根据内容合理安排先后次序。创意模式：使用诗意、艺术性和令人回味的语言。让描述富有电影感、情感丰富且视觉震撼，以大胆的艺术表达呈现。请务必使用简体中文回复，不要使用任何英文单词或短语：{json.dumps(prompt_json_for_gemini, ensure_ascii=False)}"
+        else:
+            prompt_for_gemini = f"请根据以下 json 内容，重新组合成一篇可读性高、自然流畅的{prompt_lang}作品，省略所有栏位标题与分隔符，并根据内容合理安排先后次序。请务必使用简体中文回复，不要使用任何英文单词或短语：{json.dumps(prompt_json_for_gemini, ensure_ascii=False)}"
+    else:  # zh-TW and other languages
+        if creative_mode:
+            prompt_for_gemini = f"請根據以下 json 內容，重新組合成一篇可讀性高、自然流暢的{prompt_lang}作品，省略所有欄位標題與分隔符，並根據內容合理安排先後次序。創意模式：使用詩意、藝術性和令人回味的語言。讓描述富有電影感、情感豐富且視覺震撼，以大膽的藝術表達呈現：{json.dumps(prompt_json_for_gemini, ensure_ascii=False)}"
+        else:
+            prompt_for_gemini = f"請根據以下 json 內容，重新組合成一篇可讀性高、自然流暢的{prompt_lang}作品，省略所有欄位標題與分隔符，並根據內容合理安排先後次序：{json.dumps(prompt_json_for_gemini, ensure_ascii=False)}"
+    return prompt_for_gemini
+
+
+def _old_enhance(user_input_text, prompt_type, output_lang, creative_mode, include_ending, multiple_scenes):
+    # Language mapping for enhancement prompt
+    lang_map = {
+        'en': 'English',
+        'zh-TW': 'Traditional Chinese',
+        'zh-CN': 'Simplified Chinese'
+    }
+    prompt_lang = lang_map.get(output_lang, 'English')
+
+    if output_lang == 'en':
+        if prompt_type == 'video':
+            if creative_mode:
+                scene_instruction = "Create MULTIPLE connected scenes in a sequence" if multiple_scenes else "Create ONE single scene only"
+                enhance_prompt = f"Based on these user inputs: {user_input_text}, please create a detailed JSON for VIDEO content with the following fields: Scene, ambiance_or_mood, Location, Visual style, camera motion, lighting{', ending' if include_ending else ''}. IMPORTANT: {scene_instruction}. For 'camera motion', choose ONLY ONE specific camera movement - do not combine multiple shots. Create ONE BOLD, IMAGINATIVE, and UNCONVENTIONAL camera movement that pushes creative boundaries (e.g., 'surreal floating through impossible geometries' OR 'time-warped spiral dance around emotions' OR 'gravity-defying liquid mercury flows' OR 'dream-logic perspective morphing' - pick just ONE). Make it visually stunning, emotionally powerful, and artistically groundbreaking. Output in {prompt_lang} and format as valid JSON only."
+            else:
+                scene_instruction = "Create MULTIPLE connected scenes in a sequence" if multiple_scenes else "Create ONE single scene only"
+                enhance_prompt = f"Based on these user inputs: {user_input_text}, please create a detailed JSON for VIDEO content with the following fields: Scene, ambiance_or_mood, Location, Visual style, camera motion, lighting{', ending' if include_ending else ''}. IMPORTANT: {scene_instruction}. For 'camera motion', choose ONLY ONE specific camera movement - do not combine multiple shots. Create ONE CREATIVE and CINEMATIC camera movement that enhances the storytelling (e.g., 'smooth tracking shot following the subject' OR 'dramatic crane shot revealing the landscape' OR 'intimate handheld close-up' OR 'sweeping drone shot' - pick just ONE). Make the camera motion specific, cinematic, and emotionally engaging. Output in {prompt_lang} and format as valid JSON only."
+        else:
+            if creative_mode:
+                scene_instruction = "Create MULTIPLE connected scenes in a sequence" if multiple_scenes else "Create ONE single scene only"
+                enhance_prompt = f"Based on these user inputs: {user_input_text}, please create a detailed JSON with the following fields: Scene, ambiance_or_mood, Location, Visual style, lighting{', ending' if include_ending else ''}. IMPORTANT: {scene_instruction}. CREATIVE MODE: Be highly artistic, experimental, and imaginative. Push creative boundaries with bold visual concepts, unconventional perspectives, surreal elements, and innovative storytelling approaches. Fill in missing fields with groundbreaking creative details. Output in {prompt_lang} and format as valid JSON only."
+            else:
+                scene_instruction = "Create MULTIPLE connected scenes in a sequence" if multiple_scenes else "Create ONE single scene only"
+                enhance_prompt = f"Based on these user inputs: {user_input_text}, please create a detailed JSON with the following fields: Scene, ambiance_or_mood, Location, Visual style, lighting{', ending' if include_ending else ''}. IMPORTANT: {scene_instruction}. Fill in creative and appropriate details for missing fields. Output in {prompt_lang} and format as valid JSON only."
+    elif output_lang == 'zh-CN':
+        if prompt_type == 'video':
+            if creative_mode:
+                scene_instruction = "创建多个连续场景序列" if multiple_scenes else "只创建单一场景"
+                enhance_prompt = f"根据这些用户输入: {user_input_text}，请创建一个专为视频内容设计的详细 JSON，包含以下栏位：Scene、ambiance_or_mood、Location、Visual style、camera motion、lighting{'、ending' if include_ending else ''}。重要：{scene_instruction}。对于 'camera motion' 栏位，请只选择一种特定的摄影机运动 - 不要组合多个镜头。创造一个大胆、富有想象力且非传统的摄影机运动，突破创意界限（例如：'穿越不可能几何体的超现实漂浮' 或 '围绕情感的时间扭曲螺旋舞蹈' 或 '反重力液态水银流动' 或 '梦境逻辑视角变形' - 只选择其中一种）。让它视觉震撼、情感强烈且艺术性突破。请用{prompt_lang}回应，并只输出有效的 JSON 格式。"
+            else:
+                scene_instruction = "创建多个连续场景序列" if multiple_scenes else "只创建单一场景"
+                enhance_prompt = f"根据这些用户输入: {user_input_text}，请创建一个专为视频内容设计的详细 JSON，包含以下栏位：Scene、ambiance_or_mood、Location、Visual style、camera motion、lighting{'、ending' if include_ending else ''}。重要：{scene_instruction}。对于 'camera motion' 栏位，请只选择一种特定的摄影机运动 - 不要组合多个镜头。创造一个富有创意和电影感的摄影机运动，增强故事叙述效果（例如：'平滑追踪镜头跟随主体' 或 '戏剧性升降镜头展现风景' 或 '亲密手持特写' 或 '扫描式空拍镜头' - 只选择其中一种）。让摄影机运动具体、有电影感且富有情感张力。请用{prompt_lang}回应，并只输出有效的 JSON 格式。"
+        else:
+            if creative_mode:
+                scene_instruction = "创建多个连续场景序列" if multiple_scenes else "只创建单一场景"
+                enhance_prompt = f"根据这些用户输入: {user_input_text}，请创建一个详细的 JSON，包含以下栏位：Scene、ambiance_or_mood、Location、Visual style、lighting{'、ending' if include_ending else ''}。重要：{scene_instruction}。创意模式：请极具艺术性、实验性和想象力。以大胆的视觉概念、非传统的视角、超现实元素和创新的故事叙述方式突破创意界限。为缺少的栏位填入突破性的创意细节。请用{prompt_lang}回应，并只输出有效的 JSON 格式。"
+            else:
+                scene_instruction = "创建多个连续场景序列" if multiple_scenes else "只创建单一场景"
+                enhance_prompt = f"根据这些用户输入: {user_input_text}，请创建一个详细的 JSON，包含以下栏位：Scene、ambiance_or_mood、Location、Visual style、lighting{'、ending' if include_ending else ''}。重要：{scene_instruction}。为缺少的栏位填入富有创意且合适的细节。请用{prompt_lang}回应，并只输出有效的 JSON 格式。"
+    else:  # zh-TW and other languages
+        if prompt_type == 'video':
+            if creative_mode:
+                scene_instruction = "創建多個連續場景序列" if multiple_scenes else "只創建單一場景"
+                enhance_prompt = f"根據這些用戶輸入: {user_input_text}，請創建一個專為影片內容設計的詳細 JSON，包含以下欄位：Scene、ambiance_or_mood、Location、Visual style、camera motion、lighting{'、ending' if include_ending else ''}。重要：{scene_instruction}。對於 'camera motion' 欄位，請只選擇一種特定的攝影機運動 - 不要組合多個鏡頭。創造一個大膽、富有想像力且非傳統的攝影機運動，突破創意界限（例如：'穿越不可能幾何體的超現實漂浮' 或 '圍繞情感的時間扭曲螺旋舞蹈' 或 '反重力液態水銀流動' 或 '夢境邏輯視角變形' - 只選擇其中一種）。讓它視覺震撼、情感強烈且藝術性突破。請用{prompt_lang}回應，並只輸出有效的 JSON 格式。"
+            else:
+                scene_instruction = "創建多個連續場景序列" if multiple_scenes else "只創建單一場景"
+                enhance_prompt = f"根據這些用戶輸入: {user_input_text}，請創建一個專為影片內容設計的詳細 JSON，包含以下欄位：Scene、ambiance_or_mood、Location、Visual style、camera motion、lighting{'、ending' if include_ending else ''}。重要：{scene_instruction}。對於 'camera motion' 欄位，請只選擇一種特定的攝影機運動 - 不要組合多個鏡頭。創造一個富有創意和電影感的攝影機運動，增強故事敘述效果（例如：'平滑追蹤鏡頭跟隨主體' 或 '戲劇性升降鏡頭展現風景' 或 '親密手持特寫' 或 '掃描式空拍鏡頭' - 只選擇其中一種）。讓攝影機運動具體、有電影感且富有情感張力。請用{prompt_lang}回應，並只輸出有效的 JSON 格式。"
+        else:
+            if creative_mode:
+                scene_instruction = "創建多個連續場景序列" if multiple_scenes else "只創建單一場景"
+                enhance_prompt = f"根據這些用戶輸入: {user_input_text}，請創建一個詳細的 JSON，包含以下欄位：Scene、ambiance_or_mood、Location、Visual style、lighting{'、ending' if include_ending else ''}。重要：{scene_instruction}。創意模式：請極具藝術性、實驗性和想像力。以大膽的視覺概念、非傳統的視角、超現實元素和創新的故事敘述方式突破創意界限。為缺少的欄位填入突破性的創意細節。請用{prompt_lang}回應，並只輸出有效的 JSON 格式。"
+            else:
+                scene_instruction = "創建多個連續場景序列" if multiple_scenes else "只創建單一場景"
+                enhance_prompt = f"根據這些用戶輸入: {user_input_text}，請創建一個詳細的 JSON，包含以下欄位：Scene、ambiance_or_mood、Location、Visual style、lighting{'、ending' if include_ending else ''}。重要：{scene_instruction}。為缺少的欄位填入富有創意且合適的細節。請用{prompt_lang}回應，並只輸出有效的 JSON 格式。"
+    return enhance_prompt
+
+
+@pytest.fixture(scope='module')
+def registry():
+    return PromptTemplateRegistry()
+
+
+@pytest.mark.parametrize('output_lang', OUTPUT_LANGS)
+def test_recognition_and_enhance_match_original(registry, output_lang):
+    for prompt_type, creative, ending, multiple in itertools.product(
+            ('image', 'video'), (False, True), (False, True), (False, True)):
+        assert registry.recognition(output_lang, prompt_type, creative, ending) == \
+            _old_recognition(output_lang, prompt_type, creative, ending)
+        assert registry.enhance(USER_INPUT, output_lang, prompt_type, creative, ending, multiple) == \
+            _old_enhance(USER_INPUT, prompt_type, output_lang, creative, ending, multiple)
+
+
+@pytest.mark.parametrize('output_lang', OUTPUT_LANGS)
+def test_rewrite_fused_and_system_match_original(registry, output_lang):
+    for creative in (False, True):
+        assert registry.rewrite(json.dumps(PROMPT_JSON, ensure_ascii=False), output_lang, creative) == \
+            _old_rewrite(PROMPT_JSON, output_lang, creative)
+        assert registry.fused(json.dumps(USER_CONTEXT, ensure_ascii=False), output_lang, creative) == \
+            _old_fused(USER_CONTEXT, output_lang, creative)
+    assert registry.system_instruction(output_lang) == rewrite_system_instruction(output_lang)
+
+
+def test_form_zh_cn_keeps_original_recognition_template(registry):
+    prompt = registry.recognition('zh-cn', 'image', False, False)
+    assert prompt.startswith('請詳細識別')
+    assert 'English' in prompt
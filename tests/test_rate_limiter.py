@@ -0,0 +1,79 @@
+import pytest
+
+from api import rate_limiter
+from api.rate_limiter import GeminiRateLimiter, RateLimitTimeout, parse_retry_after
+
+
+class FakeResponse:
+    def __init__(self, status_code, retry_after=None):
+        self.status_code = status_code
+        self.headers = {'Retry-After': retry_after} if retry_after else {}
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+
+def make_limiter(**kwargs):
+    settings = dict(rpm=6000, burst=10, max_concurrency=8, min_concurrency=1,
+                    max_retries=3, retry_base=0, retry_max=0, queue_timeout=5)
+    settings.update(kwargs)
+    return GeminiRateLimiter(**settings)
+
+
+def test_parse_retry_after():
+    assert parse_retry_after('3') == 3.0
+    assert parse_retry_after('-1') == 0.0
+    assert parse_retry_after('soon') is None
+    assert parse_retry_after(None) is None
+
+
+def test_throttled_call_is_retried_after_retry_after(monkeypatch):
+    sleeps = []
+    monkeypatch.setattr(rate_limiter.time, 'sleep', sleeps.append)
+    limiter = make_limiter()
+    responses = [FakeResponse(429, '2'), FakeResponse(200)]
+    throttled = responses[0]
+    response = limiter.call(lambda: responses.pop(0))
+    assert response.status_code == 200
+    assert throttled.closed
+    # Backoff waits out Retry-After, and the paused bucket holds the next acquire too
+    assert sleeps[0] >= 2
+    stats = limiter.stats()
+    assert (stats['throttled'], stats['retries'], stats['in_flight']) == (1, 1, 0)
+
+
+def test_throttle_halves_concurrency_limit(monkeypatch):
+    monkeypatch.setattr(rate_limiter.time, 'sleep', lambda seconds: None)
+    limiter = make_limiter(max_retries=0)
+    before = limiter.stats()['concurrency_limit']
+    response = limiter.call(lambda: FakeResponse(503))
+    assert response.status_code == 503
+    assert limiter.stats()['concurrency_limit'] == before // 2
+    assert limiter.stats()['gave_up'] == 1
+
+
+def test_held_slot_is_kept_until_released():
+    limiter = make_limiter()
+    limiter.call(lambda: FakeResponse(200), hold=True)
+    assert limiter.stats()['in_flight'] == 1
+    limiter.release()
+    assert limiter.stats()['in_flight'] == 0
+
+
+def test_queue_timeout_when_bucket_is_empty():
+    limiter = make_limiter(rpm=1, burst=1, queue_timeout=1)
+    limiter.acquire()
+    limiter.release()
+    with pytest.raises(RateLimitTimeout):
+        limiter.acquire()
+    assert limiter.stats()['queue_timeouts'] == 1
+
+
+def test_exhausted_concurrency_slots_time_out():
+    limiter = make_limiter(max_concurrency=1, queue_timeout=0.2)
+    limiter.acquire()
+    with pytest.raises(RateLimitTimeout):
+        limiter.acquire()
+    limiter.release()
+    limiter.acquire()
@@ -0,0 +1,70 @@
+import pytest
+
+pytest.importorskip('numpy')
+
+from api.semantic_cache import SemanticCache
+
+BASE = 'a girl in a red dress walking in the rain'
+
+
+@pytest.fixture
+def cache():
+    cache = SemanticCache('test', threshold=0.95)
+    cache.set('en', BASE, {'Scene': 'girl'})
+    cache.set('zh-TW', '一個穿紅色洋裝的女孩在雨中散步', {'Scene': '女孩'})
+    return cache
+
+
+@pytest.mark.parametrize('text', [
+    BASE,
+    'A girl in a red dress, walking in the rain!',
+    'a girl  in a red dress walking in  the rain',
+    'walking in the rain, a girl in a red dress',
+])
+def test_paraphrase_hits(cache, text):
+    assert cache.get('en', text) == {'Scene': 'girl'}
+
+
+@pytest.mark.parametrize('text', [
+    '一個穿紅色洋裝的女孩，在雨中散步',
+    '一個穿紅色洋裝的女孩 在雨中散步',
+])
+def test_chinese_punctuation_and_spacing_hit(cache, text):
+    assert cache.get('zh-TW', text) == {'Scene': '女孩'}
+
+
+@pytest.mark.parametrize('text', [
+    'a boy in a red dress walking in the rain',
+    'a girl in a blue dress walking in the rain',
+    'a girl not in a red dress walking in the rain',
+    'two girls in a red dress walking in the rain',
+    'a girl in a red dress walking in the snow',
+])
+def test_subject_colour_and_negation_swaps_miss(cache, text):
+    assert cache.get('en', text) is None
+
+
+@pytest.mark.parametrize('text', [
+    '一個穿藍色洋裝的女孩在雨中散步',
+    '一個穿紅色洋裝的男孩在雨中散步',
+    '一個沒穿紅色洋裝的女孩在雨中散步',
+])
+def test_chinese_swaps_miss(cache, text):
+    assert cache.get('zh-TW', text) is None
+
+
+def test_swaps_miss_even_at_low_threshold():
+    cache = SemanticCache('test', threshold=0.5)
+    cache.set('en', 'a happy girl', {'Scene': 'happy'})
+    assert cache.get('en', 'a not happy girl') is None
+    assert cache.get('en', 'a happy boy') is None
+    assert cache.get('en', 'the happy girl') == {'Scene': 'happy'}
+
+
+def test_lru_overwrite_keeps_word_index_in_sync():
+    cache = SemanticCache('test', threshold=0.5, max_entries=1)
+    cache.set('en', 'a red dress', 1)
+    cache.set('en', 'a blue dress', 2)
+    assert cache.get('en', 'the red dress') is None
+    assert cache.get('en', 'the blue dress') == 2
+    assert cache.stats()['evictions'] == 1